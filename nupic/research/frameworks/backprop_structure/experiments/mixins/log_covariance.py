@@ -19,7 +19,9 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
-import torch
+from nupic.research.frameworks.pytorch.streaming_covariance import (
+    StreamingCovariance,
+)
 
 
 class LogCovariance(object):
@@ -29,12 +31,12 @@ class LogCovariance(object):
         self.log_covariance_layernames = log_covariance_layernames
 
     def test(self, loader):
-        activations = {layername: []
+        covariances = {layername: StreamingCovariance()
                        for layername in self.log_covariance_layernames}
 
         def accumulator(layername):
             def accumulate_activation(module, x, y):
-                activations[layername].append(y)
+                covariances[layername].update(y)
 
             return accumulate_activation
 
@@ -45,15 +47,13 @@ class LogCovariance(object):
         for hook in hooks:
             hook.remove()
 
-        for layername, layer_activations in activations.items():
-            H = torch.cat(layer_activations) # NOQA N806
-            H -= torch.mean(H, dim=0)
-            cov = H.t().mm(H) / H.shape[0]
+        for layername, covariance in covariances.items():
+            if covariance.count == 0:
+                continue
+            cov = covariance.covariance()
             var = cov.diag()
-            # Mask out the diagonal
-            cov *= (1 - torch.eye(cov.shape[0]).to(self.device))
             result["{}/covariance_sum_of_squares".format(layername)] = \
-                (cov.pow(2).sum() / 2).item()
+                ((cov.pow(2).sum() - var.pow(2).sum()) / 2).item()
             result["{}/variance_sum".format(layername)] = var.sum().item()
 
         return result
@@ -40,6 +40,12 @@ from torch.nn.modules import Module
 from torch.nn.modules.utils import _pair as pair
 from torch.nn.parameter import Parameter
 
+from nupic.research.frameworks.backprop_structure.modules.local_reparam import (
+    NoiseBuffer,
+    local_reparam_conv2d,
+    local_reparam_linear,
+)
+
 
 class HeavisideStep(Module):
     def __init__(self, neg1_activation, cancel_gradient, inplace):
@@ -77,6 +83,38 @@ def sample_weight(p1, weight, deterministic=False, samples=1):
     return weight * z
 
 
+def topk_mask(p1, counts):
+    """
+    Mask selecting the `counts[i]` largest gate probabilities of each unit i.
+    Equivalent to a topk per unit with varying k, computed for all the units at
+    once by comparing the rank of each gate within its unit with the unit's
+    count.
+    """
+    p1_flat = p1.reshape(p1.size(0), -1)
+    _, order = p1_flat.sort(dim=1, descending=True)
+    ranks = torch.arange(p1_flat.size(1), dtype=p1.dtype, device=p1.device)
+    selected = (ranks.unsqueeze(0) < counts.unsqueeze(1)).to(p1.dtype)
+    mask = torch.zeros_like(p1_flat).scatter_(1, order, selected)
+    return mask.view_as(p1)
+
+
+def inference_mask(p1, deterministic):
+    """
+    Gates kept at inference: the gates with probability >= 0.5 when
+    deterministic, otherwise the expected number of gates of each unit, chosen
+    by decreasing probability.
+    """
+    if deterministic:
+        return (p1 >= 0.5).float()
+    counts = p1.sum(dim=tuple(range(1, p1.dim()))).round()
+    return topk_mask(p1, counts)
+
+
+def _tensors_version(*tensors):
+    # Changes when the tensors are modified in place or moved
+    return tuple((t.data_ptr(), t._version) for t in tensors)
+
+
 class BinaryGatedLinear(Module):
     """
     Linear layer with stochastic binary gates
@@ -127,6 +165,8 @@ class BinaryGatedLinear(Module):
         self.use_bias = bias
         if bias:
             self.bias = Parameter(torch.Tensor(out_features))
+        self._inference_mask = None
+        self._inference_weight = None
         self.reset_parameters()
 
     def reset_parameters(self):
@@ -189,35 +229,44 @@ class BinaryGatedLinear(Module):
         else:
             return 0
 
-    def get_inference_mask(self):
-        exc_p1, inh_p1 = self.get_gate_probabilities()
-
-        if self.deterministic:
-            exc_mask = (exc_p1 >= 0.5).float()
-            inh_mask = (inh_p1 >= 0.5).float()
-            return exc_mask, inh_mask
-        else:
-            exc_count1 = exc_p1.sum(dim=1).round().int()
-            inh_count1 = inh_p1.sum(dim=1).round().int()
+    def train(self, mode=True):
+        # Parameters modified through `.data` keep their version, so rebuild
+        # the cached inference mask and weight after training
+        self._inference_mask = None
+        self._inference_weight = None
+        return super().train(mode)
 
-            # pytorch doesn't offer topk with varying k values.
-            exc_mask = torch.zeros_like(exc_p1)
-            inh_mask = torch.zeros_like(inh_p1)
-            for i in range(exc_count1.size()[0]):
-                _, exc_indices = torch.topk(exc_p1[i], exc_count1[i].item())
-                _, inh_indices = torch.topk(inh_p1[i], inh_count1[i].item())
-                exc_mask[i].scatter_(-1, exc_indices, 1)
-                inh_mask[i].scatter_(-1, inh_indices, 1)
+    def get_inference_mask(self):
+        version = _tensors_version(self.exc_p1, self.inh_p1)
+        if self._inference_mask is None or self._inference_mask[0] != version:
+            exc_p1, inh_p1 = self.get_gate_probabilities()
+            self._inference_mask = (version,
+                                    inference_mask(exc_p1, self.deterministic),
+                                    inference_mask(inh_p1, self.deterministic))
+        return self._inference_mask[1:]
+
+    def get_inference_weight(self):
+        """
+        Weight used at inference. Cached until the gate probabilities or the
+        weights change, unless gradients are enabled.
+        """
+        exc_mask, inh_mask = self.get_inference_mask()
+        if torch.is_grad_enabled():
+            return exc_mask * self.exc_weight - inh_mask * self.inh_weight
 
-            return exc_mask, inh_mask
+        version = _tensors_version(self.exc_p1, self.inh_p1,
+                                   self.exc_weight, self.inh_weight)
+        if self._inference_weight is None or self._inference_weight[0] != version:
+            w = exc_mask * self.exc_weight - inh_mask * self.inh_weight
+            self._inference_weight = (version, w)
+        return self._inference_weight[1]
 
     def sample_weight_and_bias(self):
         if self.training or not self.optimize_inference:
             w = (sample_weight(self.exc_p1, self.exc_weight, self.deterministic)
                  - sample_weight(self.inh_p1, self.inh_weight, self.deterministic))
         else:
-            exc_mask, inh_mask = self.get_inference_mask()
-            w = exc_mask * self.exc_weight - inh_mask * self.inh_weight
+            w = self.get_inference_weight()
 
         b = None
         if self.use_baseline_bias:
@@ -337,6 +386,8 @@ class BinaryGatedConv2d(Module):
         self.inh_p1 = Parameter(torch.Tensor(out_channels, in_channels // groups,
                                              *self.kernel_size))
         self.input_shape = None
+        self._inference_mask = None
+        self._inference_weight = None
 
         self.use_bias = bias
         if bias:
@@ -407,33 +458,37 @@ class BinaryGatedConv2d(Module):
         inh_p1 = torch.clamp(self.inh_p1.data, min=0., max=1.)
         return exc_p1, inh_p1
 
+    def train(self, mode=True):
+        # Parameters modified through `.data` keep their version, so rebuild
+        # the cached inference mask and weight after training
+        self._inference_mask = None
+        self._inference_weight = None
+        return super().train(mode)
+
     def get_inference_mask(self):
-        exc_p1, inh_p1 = self.get_gate_probabilities()
+        version = _tensors_version(self.exc_p1, self.inh_p1)
+        if self._inference_mask is None or self._inference_mask[0] != version:
+            exc_p1, inh_p1 = self.get_gate_probabilities()
+            self._inference_mask = (version,
+                                    inference_mask(exc_p1, self.deterministic),
+                                    inference_mask(inh_p1, self.deterministic))
+        return self._inference_mask[1:]
+
+    def get_inference_weight(self):
+        """
+        Weight used at inference. Cached until the gate probabilities or the
+        weights change, unless gradients are enabled.
+        """
+        exc_mask, inh_mask = self.get_inference_mask()
+        if torch.is_grad_enabled():
+            return exc_mask * self.exc_weight - inh_mask * self.inh_weight
 
-        if self.deterministic:
-            exc_mask = (exc_p1 >= 0.5).float()
-            inh_mask = (inh_p1 >= 0.5).float()
-            return exc_mask, inh_mask
-        else:
-            exc_count1 = exc_p1.sum(
-                dim=tuple(range(1, len(exc_p1.shape)))
-            ).round().int()
-            inh_count1 = inh_p1.sum(
-                dim=tuple(range(1, len(inh_p1.shape)))
-            ).round().int()
-
-            # pytorch doesn't offer topk with varying k values.
-            exc_mask = torch.zeros_like(exc_p1)
-            inh_mask = torch.zeros_like(inh_p1)
-            for i in range(exc_count1.size()[0]):
-                _, exc_indices = torch.topk(exc_p1[i].flatten(),
-                                            exc_count1[i].item())
-                _, inh_indices = torch.topk(inh_p1[i].flatten(),
-                                            inh_count1[i].item())
-                exc_mask[i].flatten().scatter_(-1, exc_indices, 1)
-                inh_mask[i].flatten().scatter_(-1, inh_indices, 1)
-
-            return exc_mask, inh_mask
+        version = _tensors_version(self.exc_p1, self.inh_p1,
+                                   self.exc_weight, self.inh_weight)
+        if self._inference_weight is None or self._inference_weight[0] != version:
+            w = exc_mask * self.exc_weight - inh_mask * self.inh_weight
+            self._inference_weight = (version, w)
+        return self._inference_weight[1]
 
     def sample_weight_and_bias(self, samples=1):
         if self.training or not self.optimize_inference:
@@ -442,8 +497,7 @@ class BinaryGatedConv2d(Module):
                  - sample_weight(self.inh_p1, self.inh_weight,
                                  self.deterministic, samples))
         else:
-            exc_mask, inh_mask = self.get_inference_mask()
-            w = exc_mask * self.exc_weight - inh_mask * self.inh_weight
+            w = self.get_inference_weight()
 
         b = None
         if self.use_baseline_bias:
@@ -527,24 +581,41 @@ class BinaryGatedConv2d(Module):
 class LocalReparamBinaryGatedLinear(BinaryGatedLinear):
     """
     Linear layer with stochastic binary gates
+
+    :param fused: Whether to train with :func:`local_reparam_linear`
     """
+    def __init__(self, *args, fused=False, **kwargs):
+        super(LocalReparamBinaryGatedLinear, self).__init__(*args, **kwargs)
+        self.fused = fused
+        self.noise_buffer = NoiseBuffer()
+
+    def weight_mean_var(self):
+        # Allow gradient to keep pushing p1 outside (0,1).
+        exc_p1 = self.exc_p1.clone()
+        exc_p1.data.clamp_(0, 1)
+        inh_p1 = self.inh_p1.clone()
+        inh_p1.data.clamp_(0, 1)
+        w_mu = (self.exc_weight * exc_p1) - (self.inh_weight * inh_p1)
+
+        # Don't pass back gradients to p1 for the variance when p1 is
+        # outside (0,1). They will be infinite (or very large with the
+        # divide-by-zero handling).
+        exc_p1 = torch.clamp(self.exc_p1, 0, 1)
+        inh_p1 = torch.clamp(self.inh_p1, 0, 1)
+        w_var = ((self.exc_weight.pow(2) * exc_p1 * (1 - exc_p1))
+                 + (self.inh_weight.pow(2) * inh_p1 * (1 - inh_p1)))
+        return w_mu, w_var
+
     def forward(self, x):
-        if self.training:
-            # Allow gradient to keep pushing p1 outside (0,1).
-            exc_p1 = self.exc_p1.clone()
-            exc_p1.data.clamp_(0, 1)
-            inh_p1 = self.inh_p1.clone()
-            inh_p1.data.clamp_(0, 1)
-            w_mu = (self.exc_weight * exc_p1) - (self.inh_weight * inh_p1)
+        if self.training and self.fused:
+            w_mu, w_var = self.weight_mean_var()
+            return local_reparam_linear(
+                x, w_mu, w_var, (self.bias if self.use_bias else None),
+                epsilon=0.000001, noise_buffer=self.noise_buffer,
+                clamp_gradient=True)
+        elif self.training:
+            w_mu, w_var = self.weight_mean_var()
             mu = F.linear(x, w_mu, (self.bias if self.use_bias else None))
-
-            # Don't pass back gradients to p1 for the variance when p1 is
-            # outside (0,1). They will be infinite (or very large with the
-            # divide-by-zero handling).
-            exc_p1 = torch.clamp(self.exc_p1, 0, 1)
-            inh_p1 = torch.clamp(self.inh_p1, 0, 1)
-            w_var = ((self.exc_weight.pow(2) * exc_p1 * (1 - exc_p1))
-                     + (self.inh_weight.pow(2) * inh_p1 * (1 - inh_p1)))
             variance = F.linear(x.pow(2), w_var)
             # Don't backpropagate beyond this variance for units with variance
             # 0. It will divide by 0.
@@ -562,23 +633,40 @@ class LocalReparamBinaryGatedLinear(BinaryGatedLinear):
 class LocalReparamBinaryGatedConv2d(BinaryGatedConv2d):
     """
     Convolutional layer with binary stochastic gates
+
+    :param fused: Whether to train with :func:`local_reparam_conv2d`
     """
+    def __init__(self, *args, fused=False, **kwargs):
+        super(LocalReparamBinaryGatedConv2d, self).__init__(*args, **kwargs)
+        self.fused = fused
+        self.noise_buffer = NoiseBuffer()
+
+    def weight_mean_var(self):
+        # Allow gradient to keep pushing p1 outside (0,1).
+        exc_p1 = self.exc_p1.clone()
+        exc_p1.data.clamp_(0, 1)
+        inh_p1 = self.inh_p1.clone()
+        inh_p1.data.clamp_(0, 1)
+        w_mu = (self.exc_weight * exc_p1) - (self.inh_weight * inh_p1)
+        w_var = ((self.exc_weight.pow(2) * exc_p1 * (1 - exc_p1))
+                 + (self.inh_weight.pow(2) * inh_p1 * (1 - inh_p1)))
+        return w_mu, w_var
+
     def forward(self, x):
         if self.input_shape is None:
             self.input_shape = x.size()
 
-        if self.training:
-            # Allow gradient to keep pushing p1 outside (0,1).
-            exc_p1 = self.exc_p1.clone()
-            exc_p1.data.clamp_(0, 1)
-            inh_p1 = self.inh_p1.clone()
-            inh_p1.data.clamp_(0, 1)
-            w_mu = (self.exc_weight * exc_p1) - (self.inh_weight * inh_p1)
+        if self.training and self.fused:
+            w_mu, w_var = self.weight_mean_var()
+            return local_reparam_conv2d(
+                x, w_mu, w_var, (self.bias if self.use_bias else None),
+                self.stride, self.padding, self.dilation, self.groups,
+                epsilon=0.000001, noise_buffer=self.noise_buffer,
+                clamp_gradient=True)
+        elif self.training:
+            w_mu, w_var = self.weight_mean_var()
             mu = F.conv2d(x, w_mu, (self.bias if self.use_bias else None),
                           self.stride, self.padding, self.dilation, self.groups)
-
-            w_var = ((self.exc_weight.pow(2) * exc_p1 * (1 - exc_p1))
-                     + (self.inh_weight.pow(2) * inh_p1 * (1 - inh_p1)))
             variance = F.conv2d(x.pow(2), w_var, None,
                                 self.stride, self.padding, self.dilation,
                                 self.groups)
@@ -0,0 +1,171 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+
+"""
+Fused training forward of layers using the local reparameterization trick,
+sampling the activations y ~ N(y_mu, y_var) with y_mu = f(x, w_mu) and
+y_var = f(x^2, w_var) for a linear operation f.
+
+Only the input and the weights are kept for the backward pass, which
+recomputes the mean and variance and regenerates the noise from the saved random
+number generator state, rather than keeping x^2, the standard deviation and the
+noise of every layer until the backward pass. This trades an additional forward
+computation of each layer for its activation memory.
+
+The VDrop and local reparameterization binary gated layers use these functions
+for their training forward when created with `fused=True`.
+"""
+
+import torch
+import torch.nn.functional as F
+
+__all__ = [
+    "NoiseBuffer",
+    "local_reparam_conv2d",
+    "local_reparam_linear",
+]
+
+
+class NoiseBuffer(object):
+    """
+    Preallocated noise tensor reused by every training step of a layer
+    """
+
+    def __init__(self):
+        self.tensor = None
+
+    def get(self, like):
+        if (self.tensor is None or self.tensor.shape != like.shape
+                or self.tensor.dtype != like.dtype
+                or self.tensor.device != like.device):
+            self.tensor = torch.empty_like(like)
+        return self.tensor
+
+
+def _get_rng_state(device):
+    if device.type == "cuda":
+        return torch.cuda.get_rng_state(device)
+    return torch.get_rng_state()
+
+
+def _set_rng_state(state, device):
+    if device.type == "cuda":
+        torch.cuda.set_rng_state(state, device)
+    else:
+        torch.set_rng_state(state)
+
+
+def _conv2d_mean_var(x, w_mu, w_var, bias, stride, padding, dilation, groups):
+    # A single grouped convolution of [x, x^2] with [w_mu, w_var] is slower,
+    # as it copies the input and the weights
+    y_mu = F.conv2d(x, w_mu, bias, stride, padding, dilation, groups)
+    y_var = F.conv2d(x * x, w_var, None, stride, padding, dilation, groups)
+    return y_mu, y_var
+
+
+def _linear_mean_var(x, w_mu, w_var, bias):
+    return F.linear(x, w_mu, bias), F.linear(x * x, w_var)
+
+
+class _LocalReparam(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, x, w_mu, w_var, bias, mean_var, noise_buffer, epsilon,
+                clamp_gradient):
+        y_mu, y_var = mean_var(x, w_mu, w_var, bias)
+        y_sigma = y_var.clamp_(min=epsilon).sqrt_()
+
+        # Draw the noise, keeping the generator state to redraw it on backward
+        rng_state = _get_rng_state(x.device)
+        noise = noise_buffer.get(y_mu).normal_()
+        y = torch.addcmul(y_mu, y_sigma, noise)
+
+        ctx.save_for_backward(x, w_mu, w_var, bias)
+        ctx.mean_var = mean_var
+        ctx.noise_buffer = noise_buffer
+        ctx.rng_state = rng_state
+        ctx.epsilon = epsilon
+        ctx.clamp_gradient = clamp_gradient
+        return y
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, w_mu, w_var, bias = ctx.saved_tensors
+        inputs = [t.detach().requires_grad_(need) if t is not None else None
+                  for t, need in zip((x, w_mu, w_var, bias),
+                                     ctx.needs_input_grad[:4])]
+        with torch.enable_grad():
+            y_mu, y_var = ctx.mean_var(*inputs)
+
+        current_state = _get_rng_state(x.device)
+        _set_rng_state(ctx.rng_state, x.device)
+        noise = ctx.noise_buffer.get(y_mu).normal_()
+        _set_rng_state(current_state, x.device)
+
+        # y = y_mu + sqrt(y_var) * noise
+        with torch.no_grad():
+            y_var_clamped = y_var.clamp(min=ctx.epsilon)
+            grad_var = grad_output * noise / (2 * y_var_clamped.sqrt())
+            if ctx.clamp_gradient:
+                grad_var.masked_fill_(y_var < ctx.epsilon, 0)
+
+        outputs, grad_outputs = zip(*[
+            (y, g) for y, g in ((y_mu, grad_output), (y_var, grad_var))
+            if y.requires_grad
+        ])
+        needed = [t for t in inputs if t is not None and t.requires_grad]
+        grads = iter(torch.autograd.grad(outputs, needed, grad_outputs,
+                                         allow_unused=True))
+        result = [next(grads) if t is not None and t.requires_grad else None
+                  for t in inputs]
+        return tuple(result) + (None, None, None, None)
+
+
+def local_reparam_conv2d(x, w_mu, w_var, bias=None, stride=1, padding=0,
+                         dilation=1, groups=1, epsilon=1e-8, noise_buffer=None,
+                         clamp_gradient=False):
+    """
+    Sample conv2d(x, w) with w ~ N(w_mu, w_var) using the local
+    reparameterization trick, fused as described above.
+
+    :param noise_buffer: :class:`NoiseBuffer` of the layer. Optional
+    :param clamp_gradient: Whether to stop the gradient of the variance where
+                           it is clamped to `epsilon`
+    """
+    return _LocalReparam.apply(
+        x, w_mu, w_var, bias,
+        lambda *args: _conv2d_mean_var(*args, stride, padding, dilation, groups),
+        noise_buffer or NoiseBuffer(), epsilon, clamp_gradient)
+
+
+def local_reparam_linear(x, w_mu, w_var, bias=None, epsilon=1e-8,
+                         noise_buffer=None, clamp_gradient=False):
+    """
+    Sample linear(x, w) with w ~ N(w_mu, w_var) using the local
+    reparameterization trick, fused as described above.
+
+    :param noise_buffer: :class:`NoiseBuffer` of the layer. Optional
+    :param clamp_gradient: Whether to stop the gradient of the variance where
+                           it is clamped to `epsilon`
+    """
+    return _LocalReparam.apply(x, w_mu, w_var, bias, _linear_mean_var,
+                               noise_buffer or NoiseBuffer(), epsilon,
+                               clamp_gradient)
@@ -0,0 +1,362 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Export trained networks of variational dropout and gated layers to compact
+inference networks.
+
+The eval forward of these layers recomputes the mask and multiplies it with the
+weight on every call. :func:`export_sparse_inference` folds the masks into the
+weights once and replaces each layer with a :class:`SparseInferenceLinear` or
+:class:`SparseInferenceConv2d` computing the same eval forward with one of the
+kernels:
+
+- "dense": dense operation with the folded weight
+- "block": dense operation restricted to the input and output channels with
+  nonzero weights, skipping the pruned blocks of the weight
+- "sparse": sparse matrix product with the nonzero weights, on the unfolded
+  input for convolutions
+"""
+
+import copy
+import time
+import warnings
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn
+from torch.nn.modules.utils import _pair as pair
+
+from nupic.research.frameworks.backprop_structure.modules import (
+    BinaryGatedConv2d,
+    BinaryGatedLinear,
+    FixedVDropConv2d,
+    HardConcreteGatedConv2d,
+    HardConcreteGatedLinear,
+    VDropConv2d,
+    VDropLinear,
+)
+
+__all__ = [
+    "KERNELS",
+    "SparseInferenceConv2d",
+    "SparseInferenceLinear",
+    "export_sparse_inference",
+    "folded_weight_and_bias",
+]
+
+KERNELS = ("dense", "block", "sparse")
+
+
+def _nonzero_indices(weight, dim):
+    dims = tuple(d for d in range(weight.dim()) if d != dim)
+    return (weight != 0).sum(dim=dims).nonzero().view(-1)
+
+
+def _num_bytes(module):
+    tensors = list(module.parameters()) + list(module.buffers())
+    num_bytes = 0
+    for t in tensors:
+        if t.is_sparse:
+            num_bytes += (t._indices().numel() * t._indices().element_size()
+                          + t._values().numel() * t._values().element_size())
+        else:
+            num_bytes += t.numel() * t.element_size()
+    return num_bytes
+
+
+class _SparseInferenceMixin(object):
+    def _setup_kernel(self, weight, bias, kernel):
+        if kernel not in KERNELS:
+            raise ValueError(f"Unknown kernel {kernel}, expected one of {KERNELS}")
+        self.kernel = kernel
+        self.out_features = weight.size(0)
+        self.register_buffer("bias", None if bias is None else bias.clone())
+        self.register_buffer("out_indices", None)
+        self.register_buffer("in_indices", None)
+
+        if kernel == "dense":
+            self.register_buffer("weight", weight.clone())
+        elif kernel == "block":
+            self.out_indices = _nonzero_indices(weight, 0)
+            self.in_indices = _nonzero_indices(weight, 1)
+            self.register_buffer("weight", weight.index_select(0, self.out_indices)
+                                 .index_select(1, self.in_indices).clone())
+        else:
+            self.register_buffer("weight",
+                                 weight.reshape(weight.size(0), -1)
+                                 .to_sparse().coalesce())
+
+    def _scatter_outputs(self, y, out_shape):
+        if y.size(1) == self.out_features:
+            out = y
+        else:
+            out = y.new_zeros(out_shape)
+            out.index_copy_(1, self.out_indices, y)
+        if self.bias is not None:
+            out = out + self.bias.view(-1, *([1] * (out.dim() - 2)))
+        return out
+
+    def sparsity(self):
+        if self.kernel == "sparse":
+            nonzeros = self.weight._nnz()
+        else:
+            nonzeros = (self.weight != 0).sum().item()
+        return 1 - nonzeros / float(np.prod(self.weight_shape))
+
+
+class SparseInferenceLinear(_SparseInferenceMixin, nn.Module):
+    """
+    Linear layer with a fixed folded weight, for inference only
+
+    :param weight: Folded weight, (out_features, in_features)
+    :param bias: Folded bias or None
+    :param kernel: One of :data:`KERNELS`
+    """
+
+    def __init__(self, weight, bias=None, kernel="dense"):
+        super().__init__()
+        self.in_features = weight.size(1)
+        self.weight_shape = tuple(weight.size())
+        self._setup_kernel(weight.detach(), None if bias is None else bias.detach(),
+                           kernel)
+
+    def extra_repr(self):
+        return (f"{self.in_features}, {self.out_features}, kernel={self.kernel}, "
+                f"bias={self.bias is not None}")
+
+    def forward(self, x):
+        if self.kernel == "dense":
+            return F.linear(x, self.weight, self.bias)
+
+        x2 = x.reshape(-1, self.in_features)
+        if self.kernel == "block":
+            y = F.linear(x2.index_select(1, self.in_indices), self.weight)
+        else:
+            y = torch.sparse.mm(self.weight, x2.t()).t()
+        y = self._scatter_outputs(y, (x2.size(0), self.out_features))
+        return y.view(*x.size()[:-1], self.out_features)
+
+
+class SparseInferenceConv2d(_SparseInferenceMixin, nn.Module):
+    """
+    Convolutional layer with a fixed folded weight, for inference only. The
+    "block" and "sparse" kernels require groups == 1.
+
+    :param weight: Folded weight, (out_channels, in_channels // groups, kh, kw)
+    :param bias: Folded bias or None
+    :param kernel: One of :data:`KERNELS`
+    """
+
+    def __init__(self, weight, bias=None, stride=1, padding=0, dilation=1,
+                 groups=1, kernel="dense"):
+        super().__init__()
+        if groups != 1 and kernel != "dense":
+            raise ValueError(f"The {kernel} kernel requires groups == 1")
+        self.in_channels = weight.size(1) * groups
+        self.kernel_size = tuple(weight.size()[2:])
+        self.stride = pair(stride)
+        self.padding = pair(padding)
+        self.dilation = pair(dilation)
+        self.groups = groups
+        self.weight_shape = tuple(weight.size())
+        self._setup_kernel(weight.detach(), None if bias is None else bias.detach(),
+                           kernel)
+
+    def extra_repr(self):
+        return (f"{self.in_channels}, {self.out_features}, "
+                f"kernel_size={self.kernel_size}, stride={self.stride}, "
+                f"padding={self.padding}, dilation={self.dilation}, "
+                f"groups={self.groups}, kernel={self.kernel}, "
+                f"bias={self.bias is not None}")
+
+    def forward(self, x):
+        if self.kernel == "dense":
+            return F.conv2d(x, self.weight, self.bias, self.stride, self.padding,
+                            self.dilation, self.groups)
+
+        if self.kernel == "block":
+            y = F.conv2d(x.index_select(1, self.in_indices), self.weight, None,
+                         self.stride, self.padding, self.dilation)
+        else:
+            cols = F.unfold(x, self.kernel_size, self.dilation, self.padding,
+                            self.stride)
+            n, k, num_positions = cols.size()
+            y = torch.sparse.mm(self.weight,
+                                cols.transpose(0, 1).reshape(k, n * num_positions))
+            y = y.view(-1, n, num_positions).transpose(0, 1)
+            y = y.reshape(n, -1, *self._output_size(x))
+        return self._scatter_outputs(
+            y, (x.size(0), self.out_features) + tuple(y.size()[2:]))
+
+    def _output_size(self, x):
+        return tuple(
+            (x.size(i + 2) + 2 * self.padding[i]
+             - self.dilation[i] * (self.kernel_size[i] - 1) - 1)
+            // self.stride[i] + 1
+            for i in range(2))
+
+
+def folded_weight_and_bias(layer):
+    """
+    Weight and bias used by the eval forward of a variational dropout or gated
+    layer, with the masks folded in. The binary gated layers always use their
+    inference mask, which is their eval forward with `optimize_inference` or
+    `deterministic`. Without either one, their eval forward samples a new mask
+    every time and a warning is issued.
+
+    :return: (weight, bias), or None if the layer isn't supported
+    """
+    with torch.no_grad():
+        if isinstance(layer, (VDropLinear, VDropConv2d)):
+            return layer.weight * layer.compute_mask(), layer.bias
+        if isinstance(layer, FixedVDropConv2d):
+            return layer.weight, layer.bias
+        if isinstance(layer, (HardConcreteGatedLinear, HardConcreteGatedConv2d)):
+            training = layer.training
+            layer.eval()
+            weight = layer.sample_weight()
+            layer.train(training)
+            return weight, (layer.bias if layer.use_bias else None)
+        if isinstance(layer, (BinaryGatedLinear, BinaryGatedConv2d)):
+            if not (layer.optimize_inference or layer.deterministic):
+                warnings.warn(
+                    f"{type(layer).__name__} samples its gates at eval time, "
+                    "its folded weight uses the inference mask instead. Set "
+                    "optimize_inference=True to evaluate it with the same mask")
+            weight = layer.get_inference_weight()
+            bias = None
+            if layer.use_baseline_bias:
+                bias = -weight.sum(dim=tuple(range(1, weight.dim()))) / 2
+            if layer.use_bias:
+                bias = bias + layer.bias if bias is not None else layer.bias
+            return weight, bias
+    return None
+
+
+def _build(layer, weight, bias, kernel):
+    if isinstance(layer, (VDropLinear, HardConcreteGatedLinear, BinaryGatedLinear)):
+        return SparseInferenceLinear(weight, bias, kernel)
+    return SparseInferenceConv2d(weight, bias, layer.stride, layer.padding,
+                                 layer.dilation, layer.groups, kernel)
+
+
+def _latency(module, x, num_repeats):
+    with torch.no_grad():
+        module(x)
+        times = []
+        for _ in range(num_repeats):
+            t0 = time.perf_counter()
+            module(x)
+            times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def export_sparse_inference(model, example_input, sparsity_threshold=0.5,
+                            kernels=KERNELS, num_repeats=10):
+    """
+    Copy a trained network replacing its variational dropout and gated layers
+    with :class:`SparseInferenceLinear` and :class:`SparseInferenceConv2d`
+    layers computing the same eval forward on the CPU.
+
+    Every layer is timed on its input for `example_input`. Layers whose folded
+    weight has a sparsity of at least `sparsity_threshold` use the fastest of
+    `kernels`, the others use the "dense" kernel. The binary gated layers are
+    exported with their inference mask, see :func:`folded_weight_and_bias`.
+
+    :param model: Trained network
+    :param example_input: Input batch used to time the layers
+    :param sparsity_threshold: Minimum fraction of zero weights of the layers
+                               using the "block" or "sparse" kernels
+    :param kernels: Kernels considered for the sparse layers
+    :param num_repeats: Number of timed forwards of each layer and kernel
+
+    :return: tuple (inference model, report). The report is a list with a dict
+             per replaced layer with its "name", "kernel", "sparsity",
+             "latency" of the original layer and "exported_latency" in seconds,
+             "bytes" of the original layer parameters and buffers,
+             "exported_bytes" and "saved_bytes"
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    example_input = example_input.cpu()
+
+    layers = {}
+    for name, module in model.named_modules():
+        if folded_weight_and_bias(module) is not None:
+            layers[name] = module
+
+    inputs = {}
+    handles = []
+    for name, module in layers.items():
+        def hook(module, args, name=name):
+            inputs.setdefault(name, args[0].detach())
+        handles.append(module.register_forward_pre_hook(hook))
+    with torch.no_grad():
+        model(example_input)
+    for handle in handles:
+        handle.remove()
+
+    report = []
+    for name, layer in layers.items():
+        if name not in inputs:
+            continue
+        x = inputs[name]
+        weight, bias = folded_weight_and_bias(layer)
+        sparsity = (weight == 0).sum().item() / float(weight.numel())
+
+        candidates = ["dense"]
+        if sparsity >= sparsity_threshold and getattr(layer, "groups", 1) == 1:
+            candidates += [k for k in kernels if k != "dense"]
+        if sparsity == 1.0 and "block" in candidates:
+            # No channel left to gather
+            candidates.remove("block")
+        exported, exported_latency = None, float("inf")
+        for kernel in candidates:
+            try:
+                candidate = _build(layer, weight, bias, kernel)
+                latency = _latency(candidate, x, num_repeats)
+            except RuntimeError:
+                # Fall back on the kernels supporting this layer
+                if kernel == "dense":
+                    raise
+                continue
+            if exported is None or latency < exported_latency:
+                exported, exported_latency = candidate, latency
+
+        report.append(dict(
+            name=name,
+            kernel=exported.kernel,
+            sparsity=sparsity,
+            latency=_latency(layer, x, num_repeats),
+            exported_latency=exported_latency,
+            bytes=_num_bytes(layer),
+            exported_bytes=_num_bytes(exported),
+            saved_bytes=_num_bytes(layer) - _num_bytes(exported),
+        ))
+
+        parent = model
+        path = name.split(".")
+        for attr in path[:-1]:
+            parent = getattr(parent, attr)
+        setattr(parent, path[-1], exported)
+
+    return model, report
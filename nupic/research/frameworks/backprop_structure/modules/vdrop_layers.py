@@ -36,11 +36,19 @@ from torch.nn import init
 from torch.nn.modules.utils import _pair as pair
 from torch.nn.parameter import Parameter
 
+from nupic.research.frameworks.backprop_structure.modules.local_reparam import (
+    NoiseBuffer,
+    local_reparam_conv2d,
+    local_reparam_linear,
+)
 from nupic.research.frameworks.pytorch.modules import MaskedConv2d
 
 
 class VDropLinear(nn.Module):
-    def __init__(self, in_features, out_features, bias=True):
+    """
+    :param fused: Whether to train with :func:`local_reparam_linear`
+    """
+    def __init__(self, in_features, out_features, bias=True, fused=False):
         super().__init__()
         self.weight = Parameter(torch.Tensor(out_features, in_features))
         init.kaiming_normal_(self.weight, mode="fan_out")
@@ -59,6 +67,8 @@ class VDropLinear(nn.Module):
         self.tensor_constructor = (torch.FloatTensor
                                    if not torch.cuda.is_available()
                                    else torch.cuda.FloatTensor)
+        self.fused = fused
+        self.noise_buffer = NoiseBuffer()
 
     def constrain_parameters(self):
         self.w_logvar.data.clamp_(min=-10., max=10.)
@@ -68,7 +78,10 @@ class VDropLinear(nn.Module):
         return (w_logalpha < self.threshold).float()
 
     def forward(self, x):
-        if self.training:
+        if self.training and self.fused:
+            return local_reparam_linear(x, self.weight, self.w_logvar.exp(),
+                                        self.bias, self.epsilon, self.noise_buffer)
+        elif self.training:
             return vdrop_linear_forward(x,
                                         lambda: self.weight,
                                         lambda: self.w_logvar.exp(),
@@ -98,8 +111,11 @@ class VDropLinear(nn.Module):
 
 
 class VDropConv2d(nn.Module):
+    """
+    :param fused: Whether to train with :func:`local_reparam_conv2d`
+    """
     def __init__(self, in_channels, out_channels, kernel_size, stride=1,
-                 padding=0, dilation=1, groups=1, bias=True):
+                 padding=0, dilation=1, groups=1, bias=True, fused=False):
         super().__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
@@ -132,6 +148,8 @@ class VDropConv2d(nn.Module):
         self.tensor_constructor = (torch.FloatTensor
                                    if not torch.cuda.is_available()
                                    else torch.cuda.FloatTensor)
+        self.fused = fused
+        self.noise_buffer = NoiseBuffer()
 
     def extra_repr(self):
         s = (f"{self.in_channels}, {self.out_channels}, "
@@ -157,7 +175,12 @@ class VDropConv2d(nn.Module):
         if self.input_shape is None:
             self.input_shape = x.size()
 
-        if self.training:
+        if self.training and self.fused:
+            return local_reparam_conv2d(x, self.weight, self.w_logvar.exp(),
+                                        self.bias, self.stride, self.padding,
+                                        self.dilation, self.groups, self.epsilon,
+                                        self.noise_buffer)
+        elif self.training:
             return vdrop_conv_forward(x,
                                       lambda: self.weight,
                                       lambda: self.w_logvar.exp(),
@@ -210,11 +233,14 @@ class FixedVDropConv2d(MaskedConv2d):
     """
     def __init__(self, in_channels, out_channels, kernel_size, alpha,
                  stride=1, padding=0, dilation=1, groups=1, bias=True,
-                 mask_mode="channel_to_channel"):
+                 mask_mode="channel_to_channel", fused=False):
         """
         @param alpha (float)
         Defined as w_var / w_mu**2. Weights are multiplied with noise sampled
         from distribution N(1,alpha).
+
+        @param fused (bool)
+        Whether to train with local_reparam_conv2d.
         """
         super().__init__(in_channels, out_channels, kernel_size,
                          stride=stride, padding=padding, dilation=dilation,
@@ -224,12 +250,20 @@ class FixedVDropConv2d(MaskedConv2d):
                                    if not torch.cuda.is_available()
                                    else torch.cuda.FloatTensor)
         self.epsilon = 1e-8
+        self.fused = fused
+        self.noise_buffer = NoiseBuffer()
 
     def extra_repr(self):
         return f"alpha={self.alpha}"
 
     def forward(self, x):
-        if self.training:
+        if self.training and self.fused:
+            w = self.weight * self.weight_mask
+            return local_reparam_conv2d(
+                x, w, self.alpha * (self.weight * w), self.bias, self.stride,
+                self.padding, self.dilation, self.groups, self.epsilon,
+                self.noise_buffer)
+        elif self.training:
             return vdrop_conv_forward(
                 x,
                 lambda: self.weight * self.weight_mask,
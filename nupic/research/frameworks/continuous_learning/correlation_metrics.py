@@ -23,90 +23,147 @@ import time
 
 import matplotlib.pyplot as plt
 import numpy as np
+import torch
 
 
-def register_act(experiment, dp_logs=True, shuffle=False):
+class ClassCorrelations(object):
+    """
+    Streaming within- and between-class Pearson correlations and dot products
+    of the activations of several layers.
+
+    Each layer only keeps, for every class, the sum of its flattened activations
+    and the sum of their standardized values, so any number of batches can be
+    added with :meth:`update`. The mean correlation over all the pairs of
+    activation vectors of two classes is the dot product of their standardized
+    sums over the number of pairs, and similarly for the dot products, so all
+    the class pairs of a layer are computed by two matrix products.
+
+    :param num_classes: Number of classes
+    :param device: Device where the sums are accumulated
+    """
+
+    def __init__(self, num_classes, device=None):
+        self.num_classes = num_classes
+        self.device = device
+        self.sums = {}
+
+    def update(self, name, activations, labels):
+        """
+        Add a batch of activations of the layer `name`
+
+        :param activations: Tensor with a row of activations per sample
+        :param labels: Class index of every sample, or a single class index for
+                       the whole batch
+        """
+        x = activations.detach().reshape(activations.size(0), -1)
+        x = x.to(device=self.device, dtype=torch.float64)
+        labels = torch.as_tensor(labels, device=x.device).long()
+        if labels.dim() == 0:
+            labels = labels.expand(x.size(0))
+
+        # Standardize every row. Constant rows have no correlation.
+        centered = x - x.mean(dim=1, keepdim=True)
+        std = centered.pow(2).mean(dim=1, keepdim=True).sqrt()
+        valid = (std > 0).view(-1)
+        z = torch.where(valid.unsqueeze(1), centered / std,
+                        torch.zeros_like(centered))
+
+        if name not in self.sums:
+            size = (self.num_classes, x.size(1))
+            self.sums[name] = dict(
+                x=x.new_zeros(size), z=x.new_zeros(size),
+                count=x.new_zeros(self.num_classes),
+                z_count=x.new_zeros(self.num_classes),
+            )
+        sums = self.sums[name]
+        sums["x"].index_add_(0, labels, x)
+        sums["z"].index_add_(0, labels, z)
+        sums["count"].index_add_(0, labels, torch.ones_like(x[:, 0]))
+        sums["z_count"].index_add_(0, labels, valid.to(x.dtype))
+
+    def matrices(self, name, shuffle=False):
+        """
+        Class pair matrices of the layer `name`. Entry (i, j) of the correlation
+        matrix is the mean Pearson correlation between the activations of
+        classes i and j, over distinct pairs of samples when i == j. Entry
+        (i, j) of the dot product matrix is the mean dot product of the
+        activations of classes i and j over their number of units.
+
+        :param shuffle: Whether to compute the matrices for activations with
+                        the units randomly permuted, with a different
+                        permutation for every class
+        :return: tuple of numpy arrays (corr_mat, dot_mat), with NaN for the
+                 classes without enough samples
+        """
+        sums = self.sums[name]
+        x_sums, z_sums = sums["x"], sums["z"]
+        num_units = x_sums.size(1)
+        if shuffle:
+            perms = torch.from_numpy(np.stack([
+                np.random.permutation(num_units)
+                for _ in range(self.num_classes)])).to(x_sums.device)
+            x_sums = x_sums.gather(1, perms)
+            z_sums = z_sums.gather(1, perms)
+
+        count, z_count = sums["count"], sums["z_count"]
+        dot_mat = (x_sums @ x_sums.t()) / (torch.ger(count, count) * num_units)
+
+        # Every standardized row has a squared norm of num_units, remove the
+        # pairs of a row with itself from the diagonal
+        pairs = torch.ger(z_count, z_count)
+        z_gram = z_sums @ z_sums.t()
+        diag = torch.arange(self.num_classes, device=z_gram.device)
+        z_gram[diag, diag] -= z_count * num_units
+        pairs[diag, diag] -= z_count
+        corr_mat = z_gram / (pairs * num_units)
+
+        # Undefined without pairs of samples
+        nan = float("nan")
+        dot_mat[torch.ger(count, count) == 0] = nan
+        corr_mat[pairs <= 0] = nan
+        return corr_mat.cpu().numpy(), dot_mat.cpu().numpy()
+
+
+def register_act(experiment, dp_logs=True, shuffle=False, classes=range(1, 11),
+                 num_batches=1):
     """ Gets network activations when presented with inputs for each class and runs
      within- and between-batch pearson correlation and dot products between classes.
     :param dp_logs (optional): Boolean, determines whether to return
     the dot product log (base 10)
     :param shuffle (optional): Boolean, if True will also return the metrics
      calculated on a shuffled version of the activations
+    :param classes (optional): indices of the class loaders in
+     experiment.test_loader to compare
+    :param num_batches (optional): number of batches of each class, None to use
+     all of them
     """
+    device = getattr(experiment, "device", None)
+    if device is None:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    metrics = ClassCorrelations(len(classes), device)
 
-    layer_names = [p[0] for p in experiment.model.named_children()]
-
-    act = {}
+    label = [0]
 
     def get_act(name):
         def hook(model, input_, output):
-            act[name] = output.detach().cpu().numpy()
+            metrics.update(name, output, label[0])
         return hook
 
-    cnt = 0
-    for module in experiment.model:
-        module.register_forward_hook(get_act(layer_names[cnt]))
-        cnt += 1
-
-    outputs = []
-    for k in range(1, 11):
-        loader = experiment.test_loader[k]
-        x, _ = next(iter(loader))
-        experiment.model(x.cuda())
-        outputs.append(act)
-        act = {}
-
-    all_keys = outputs[0].keys()
-
-    corr_mats, dot_mats = [], []
-    shuffled_corr_mats, shuffled_dot_mats = [], []
-    for key in all_keys:
-        mod_output = [np.vstack([outputs[n][key][k, :].flatten()
-                                 for k in range(experiment.batch_size)])
-                      for n in range(len(outputs))]
-
-        m_len = mod_output[0].shape[1]
-        iu = np.triu_indices(experiment.batch_size, 1)
-        off_indices = np.triu_indices(10, 1)
-
-        corr_mat = np.zeros((10, 10))
-        dot_mat = np.zeros((10, 10))
-        for i in range(10):
-            for j in range(10):
-                corr_mat[i, j] = np.corrcoef(mod_output[i], mod_output[j])[iu].mean()
-                dot_mat[i, j] = np.nanmean([np.dot(mod_output[i][x, :],
-                                                   mod_output[j][y, :]) / m_len
-                                            for x in range(experiment.batch_size)
-                                            for y in range(experiment.batch_size)])
-
-        corr_mats.append(corr_mat)
-        dot_mats.append(dot_mat)
-
-        if shuffle:
-            shuff_corr_mat = np.zeros((10, 10))
-            shuff_dot_mat = np.zeros((10, 10))
-            shuffled_outputs = [np.random.permutation(k.T).T
-                                for k in mod_output]
-
-            for i in range(10):
-                for j in range(10):
-                    shuff_corr_mat[i, j] = np.corrcoef(
-                        shuffled_outputs[i], shuffled_outputs[j])[iu].mean()
-                    shuff_dot_mat[i, j] = np.nanmean(
-                        [np.dot(shuffled_outputs[i][x, :],
-                                shuffled_outputs[j][y, :]) / m_len
-                         for x in range(experiment.batch_size)
-                         for y in range(experiment.batch_size)])
-
-            shuffled_corr_mats.append(shuff_corr_mat)
-            shuffled_dot_mats.append(shuff_dot_mat)
-
-            sh_offdiag_corrs = [np.nanmean(cc_[off_indices])
-                                for cc_ in shuffled_corr_mats]
-            sh_diag_corrs = [np.nanmean(np.diag(cc_)) for cc_ in shuffled_corr_mats]
-
-        offdiag_corrs = [np.nanmean(cc[off_indices]) for cc in corr_mats]
-        diag_corrs = [np.nanmean(np.diag(cc)) for cc in corr_mats]
+    handles = [module.register_forward_hook(get_act(name))
+               for name, module in experiment.model.named_children()]
+    try:
+        with torch.no_grad():
+            for i, k in enumerate(classes):
+                label[0] = i
+                for b, (x, _) in enumerate(experiment.test_loader[k]):
+                    if num_batches is not None and b >= num_batches:
+                        break
+                    experiment.model(x.to(device))
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    off_indices = np.triu_indices(len(classes), 1)
 
     def try_log(x):
         out = np.log10(x)
@@ -115,30 +172,22 @@ def register_act(experiment, dp_logs=True, shuffle=False):
         else:
             return out
 
-    if dp_logs:
-        offdiag_dotprods = [try_log(np.nanmean(dp[off_indices]) + 1e-9)
-                            for dp in dot_mats]
-        diag_dotprods = [try_log(np.nanmean(np.diag(dp)) + 1e-9) for dp in dot_mats]
-        if shuffle:
-            sh_offdiag_dotprods = [try_log(np.nanmean(dp_[off_indices]) + 1e-9)
-                                   for dp_ in shuffled_dot_mats]
-            sh_diag_dotprods = [try_log(np.nanmean(np.diag(dp_)) + 1e-9)
-                                for dp_ in shuffled_dot_mats]
-
-    else:
+    def summarize(mats):
+        corr_mats, dot_mats = zip(*mats)
+        offdiag_corrs = [np.nanmean(cc[off_indices]) for cc in corr_mats]
+        diag_corrs = [np.nanmean(np.diag(cc)) for cc in corr_mats]
         offdiag_dotprods = [np.nanmean(dp[off_indices]) for dp in dot_mats]
         diag_dotprods = [np.nanmean(np.diag(dp)) for dp in dot_mats]
+        if dp_logs:
+            offdiag_dotprods = [try_log(dp + 1e-9) for dp in offdiag_dotprods]
+            diag_dotprods = [try_log(dp + 1e-9) for dp in diag_dotprods]
+        return [offdiag_corrs, diag_corrs, offdiag_dotprods, diag_dotprods]
 
-        if shuffle:
-            sh_offdiag_dotprods = [np.nanmean(dp_[off_indices])
-                                   for dp_ in shuffled_dot_mats]
-            sh_diag_dotprods = [np.nanmean(np.diag(dp_)) for dp_ in shuffled_dot_mats]
-
-    corrs_ = [offdiag_corrs, diag_corrs, offdiag_dotprods, diag_dotprods]
+    corrs_ = summarize([metrics.matrices(name) for name in metrics.sums])
 
     if shuffle:
-        shuffled_corrs = [sh_offdiag_corrs, sh_diag_corrs,
-                          sh_offdiag_dotprods, sh_diag_dotprods]
+        shuffled_corrs = summarize([metrics.matrices(name, shuffle=True)
+                                    for name in metrics.sums])
         return corrs_, shuffled_corrs
     else:
         return corrs_
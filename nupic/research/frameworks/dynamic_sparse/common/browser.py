@@ -144,17 +144,39 @@ def unpickle_within_dataframe(df, conditions):
 
 
 def load(
-    experiment_path, performance_metrics=None, raw_metrics=None, required_epochs=None
+    experiment_path, performance_metrics=None, raw_metrics=None, required_epochs=None,
+    index=None, where=None,
 ):
-    """Load a single experiment into a dataframe"""
+    """
+    Load a single experiment into a dataframe
+
+    With a :class:`nupic.research.support.results_index.ResultsIndex` `index`,
+    only the results added since the last load are read from the experiment
+    directory, and the trials can be filtered by their params with `where`. See
+    :meth:`ResultsIndex.trial_ids`.
+    """
     experiment_path = os.path.expanduser(experiment_path)
-    experiment_states = _get_experiment_states(experiment_path, exit_on_fail=True)
+    if index is None:
+        if where is not None:
+            raise ValueError("Filtering the trials with `where` requires an index")
+        experiments = (
+            _read_experiment(exp_state, experiment_path) + (exp_name,)
+            for exp_state, exp_name in _get_experiment_states(
+                experiment_path, exit_on_fail=True)
+        )
+    else:
+        # Only read the columns used by _get_value when they are known. Raw
+        # metrics add a stats column for every progress column
+        columns = None
+        if performance_metrics is not None and not raw_metrics:
+            columns = (list(performance_metrics)
+                       + ["val_acc", "training_iteration", "time_this_iter_s"])
+        experiments = _read_indexed_experiment(index, experiment_path, where, columns)
 
     # run once per experiment state
     # columns might differ between experiments
     dataframes = []
-    for exp_state, exp_name in experiment_states:
-        progress, params = _read_experiment(exp_state, experiment_path)
+    for progress, params, exp_name in experiments:
         if len(progress) != 0:
             dataframes.append(
                 _get_value(
@@ -174,11 +196,12 @@ def load(
 
 
 def load_many(
-    experiment_paths, performance_metrics=None, raw_metrics=None, required_epochs=None
+    experiment_paths, performance_metrics=None, raw_metrics=None, required_epochs=None,
+    index=None, where=None,
 ):
     """Load several experiments into a single dataframe"""
     dataframes = [
-        load(path, performance_metrics, raw_metrics, required_epochs)
+        load(path, performance_metrics, raw_metrics, required_epochs, index, where)
         for path in experiment_paths
     ]
     return pd.concat(dataframes, axis=0, ignore_index=True, sort=False)
@@ -213,6 +236,30 @@ def _read_experiment(experiment_state, experiment_path):
     return progress, params
 
 
+def _read_indexed_experiment(index, experiment_path, where=None, columns=None):
+    """
+    Same as :func:`_read_experiment` for every experiment state, reading the
+    `columns` of the progress and the params of the trials matching `where` from
+    the index
+    """
+    index.update(experiment_path)
+    trial_ids = None
+    if where is not None:
+        trial_ids = set(index.trial_ids(experiment_path, where))
+
+    for exp_name, trials in index.experiment_states(experiment_path):
+        if trial_ids is not None:
+            trials = [(t, tag) for t, tag in trials if t in trial_ids]
+        trial_progress = index.progress([t for t, _ in trials], columns)
+        progress = {}
+        params = {}
+        for trial_id, exp_tag in trials:
+            if trial_id in trial_progress:
+                progress[exp_tag] = trial_progress[trial_id]
+                params[exp_tag] = index.params(trial_id)
+        yield progress, params, exp_name
+
+
 def _get_value(  # noqa: C901
     progress,
     params,
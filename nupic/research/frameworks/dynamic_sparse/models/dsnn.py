@@ -19,9 +19,13 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
-import numpy as np
 import torch
 
+from nupic.research.frameworks.dynamic_sparse.networks.layers import (
+    kth_smallest,
+    random_mask,
+)
+
 from .loggers import DSNNLogger
 from .main import SparseModel
 
@@ -97,7 +101,11 @@ class DSNNHeb(SparseModel):
                     self.pruning_active = False
 
     def _reinitialize_weights(self):
-        """Reinitialize weights - prune and grow"""
+        """
+        Reinitialize weights - prune and grow
+        All masks and counts are kept on the device, so no step of the update has
+        to wait on the host and the updates of all modules are queued back to back.
+        """
         if self.pruning_active:
             # keep track of added synapes
             for module in self.sparse_modules:
@@ -106,7 +114,8 @@ class DSNNHeb(SparseModel):
                     keep_mask = self.prune(module)
                     # grow
                     num_params = module.num_params
-                    num_add = int(max(num_params - torch.sum(keep_mask).item(), 0))
+                    # num_params is a float, count the synapses as integers
+                    num_add = (num_params - torch.sum(keep_mask)).clamp(min=0).long()
                     add_mask = self.grow(module, num_add)
                     # join both
                     new_mask = keep_mask | add_mask
@@ -119,80 +128,62 @@ class DSNNHeb(SparseModel):
                     )
                     self.logger.save_surviving_synapses(module, keep_mask, add_mask)
 
-    def _get_hebbian_mask(self, weight, corr, active_synapses, prune_perc):
+    @staticmethod
+    def _count(mask, perc):
+        """Returns int(perc * number of Trues in mask) as a tensor on the device"""
+        return (torch.sum(mask).double() * perc).long()
 
-        num_synapses = np.prod(weight.shape)
-        total_active = torch.sum(active_synapses).item()
+    def _get_hebbian_mask(self, weight, corr, active_synapses, prune_perc):
 
-        corr_active = corr[active_synapses]
         # decide which weights to remove based on correlation
-        kth = int(prune_perc * total_active)
+        kth = self._count(active_synapses, prune_perc)
+        keep_threshold = kth_smallest(corr, kth, active_synapses)
+        # keep mask are ones above threshold and currently active
+        hebbian_mask = (corr > keep_threshold) & active_synapses
         # if kth = 0, keep all the synapses
-        if kth == 0:
-            hebbian_mask = active_synapses
-        # else if kth greater than shape, remove all synapses
-        elif kth >= num_synapses:
-            hebbian_mask = torch.zeros(weight.shape)
-        # if no edge cases
-        else:
-            keep_threshold, _ = torch.kthvalue(corr_active, kth)
-            # keep mask are ones above threshold and currently active
-            hebbian_mask = (corr > keep_threshold) & active_synapses
-        # move to device
-        hebbian_mask.to(self.device)
-
-        return hebbian_mask
+        hebbian_mask = torch.where(kth == 0, active_synapses, hebbian_mask)
 
-    def _get_inverse_hebbian_mask(self, weight, corr, active_synapses, prune_perc):
+        return hebbian_mask.to(self.device)
 
-        num_synapses = np.prod(weight.shape)
-        total_active = torch.sum(active_synapses).item()
+    def _get_inverse_hebbian_mask(self, weight, corr, active_synapses, prune_perc):
 
-        corr_active = corr[active_synapses]
         # decide which weights to remove based on correlation
-        kth = int((1 - prune_perc) * total_active)
-        # if kth = 0, keep all the synapses
-        if kth == 0:
-            hebbian_mask = torch.zeros(weight.shape).bool()
-        # else if kth greater than shape, remove all synapses
-        elif kth >= num_synapses:
-            hebbian_mask = active_synapses
-        # if no edge cases
-        else:
-            keep_threshold, _ = torch.kthvalue(corr_active, kth)
-            # keep mask are ones above threshold and currently active
-            hebbian_mask = (corr <= keep_threshold) & active_synapses
-        hebbian_mask = hebbian_mask.to(self.device)
-
-        return hebbian_mask
+        kth = self._count(active_synapses, 1 - prune_perc)
+        keep_threshold = kth_smallest(corr, kth, active_synapses)
+        # keep mask are ones below threshold and currently active
+        hebbian_mask = (corr <= keep_threshold) & active_synapses
+        # if kth = 0, remove all the synapses
+        hebbian_mask = hebbian_mask & (kth > 0)
+
+        return hebbian_mask.to(self.device)
 
     def _get_magnitude_mask(self, weight, active_synapses, prune_perc):
 
         # calculate the positive
-        weight_pos = weight[weight > 0]
-        pos_kth = int(prune_perc * len(weight_pos))
+        positive = weight > 0
+        pos_kth = self._count(positive, prune_perc)
+        pos_threshold = kth_smallest(weight, pos_kth, positive)
+        # if prune_perc=0, pos_kth=0, prune nothing
+        pos_threshold = torch.where(
+            pos_kth == 0, torch.full_like(pos_threshold, -1), pos_threshold
+        )
         # if no positive weight, threshold can be 0 (select none)
-        if len(weight_pos) > 0:
-            # if prune_perc=0, pos_kth=0, prune nothing
-            if pos_kth == 0:
-                pos_threshold = -1
-            else:
-                pos_threshold, _ = torch.kthvalue(weight_pos, pos_kth)
-        else:
-            pos_threshold = 0
+        pos_threshold = torch.where(
+            positive.any(), pos_threshold, torch.zeros_like(pos_threshold)
+        )
 
         # calculate the negative
-        weight_neg = weight[weight < 0]
-        neg_kth = int((1 - prune_perc) * len(weight_neg))
+        negative = weight < 0
+        neg_kth = self._count(negative, 1 - prune_perc)
+        neg_threshold = kth_smallest(weight, neg_kth, negative)
+        # if prune_perc=1, neg_kth=0, prune all
+        neg_threshold = torch.where(
+            neg_kth == 0, kth_smallest(weight, 1, negative) - 1, neg_threshold
+        )
         # if no negative weight, threshold -1 (select none)
-        if len(weight_neg) > 0:
-            # if prune_perc=1, neg_kth=0, prune all
-            if neg_kth == 0:
-                neg_threshold = torch.min(weight_neg).item() - 1
-            else:
-                neg_threshold, _ = torch.kthvalue(weight_neg, neg_kth)
-        else:
-            neg_threshold = -1
+        neg_threshold = torch.where(
+            negative.any(), neg_threshold, torch.full_like(neg_threshold, -1)
+        )
 
         # consolidate
         partial_weight_mask = (weight > pos_threshold) | (weight <= neg_threshold)
@@ -218,43 +209,34 @@ class DSNNHeb(SparseModel):
         Random mask that ensures the exact number of params is added
         For computationally faster method, see _get_random_add_mask_prob
         """
-        nonzero = torch.nonzero(nonactive_synapses, as_tuple=False)
-        num_add = min(int(num_add), len(nonzero))  # can't select more than available
-        sampled_idxs = np.random.choice(range(len(nonzero)), num_add, replace=False)
-        selected = nonzero[sampled_idxs]
-
-        add_mask = torch.zeros(nonactive_synapses.shape, dtype=torch.bool)
-        if len(selected.shape) > 1:
-            add_mask[list(zip(*selected))] = True
-        else:
-            add_mask[selected] = True
+        add_mask = random_mask(
+            nonactive_synapses.shape, num_add, candidates=nonactive_synapses
+        )
 
         return add_mask.to(self.device)
 
     def _get_hebbian_add_mask(self, corr, nonactive_synapses, num_add):
 
         # get threshold
-        total_nonactive = torch.sum(nonactive_synapses).item()
-        kth = int(total_nonactive - num_add)  # should not be non-int
-        corr_nonactive = corr[nonactive_synapses]
-        add_threshold, _ = torch.kthvalue(corr_nonactive, kth)
+        total_nonactive = torch.sum(nonactive_synapses)
+        kth = total_nonactive - num_add
+        add_threshold = kth_smallest(corr, kth, nonactive_synapses)
         # calculate mask, only for currently nonactive
         add_mask = (corr > add_threshold) & nonactive_synapses
+        # if adding as many as available, add all the nonactive synapses
+        add_mask = torch.where(kth <= 0, nonactive_synapses, add_mask)
 
         return add_mask
 
     def _get_inverse_add_mask(self, corr, nonactive_synapses, num_add):
 
         # get threshold
-        kth = int(num_add)  # should not be non-int
-        if kth > 0:
-            corr_nonactive = corr[nonactive_synapses]
-            add_threshold, _ = torch.kthvalue(corr_nonactive, kth)
-            # calculate mask, only for currently nonactive
-            add_mask = (corr <= add_threshold) & nonactive_synapses
+        kth = torch.as_tensor(num_add, device=corr.device)
+        add_threshold = kth_smallest(corr, kth, nonactive_synapses)
+        # calculate mask, only for currently nonactive
+        add_mask = (corr <= add_threshold) & nonactive_synapses
         # if there is nothing to add, return zeros
-        else:
-            add_mask = torch.zeros(nonactive_synapses.shape).bool()
+        add_mask = add_mask & (kth > 0)
 
         return add_mask
 
@@ -184,7 +184,7 @@ class DSNNLogger(SparseLogger):
             self.log["new_mask_l" + str(idx)] = (
                 torch.sum(new_mask).item() / num_synapses
             )
-            self.log["missing_weights_l" + str(idx)] = num_add / num_synapses
+            self.log["missing_weights_l" + str(idx)] = float(num_add) / num_synapses
 
             # conditional logs
             if hebbian_mask is not None:
@@ -19,14 +19,13 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
-from itertools import product
-
 import numpy as np
 import torch
 
 from nupic.research.frameworks.dynamic_sparse.networks import DynamicSparseBase
 from nupic.research.frameworks.dynamic_sparse.networks.layers import (
     init_coactivation_tracking,
+    random_mask,
 )
 
 __all__ = [
@@ -134,27 +133,10 @@ class SparseModule:
         Similar implementation to how so dense
         Works in any number of dimension, considering the 1st one is the output
         """
-        output_size = self.shape[0]
         input_size = np.prod(self.shape[1:])
         num_add = int(self.on_perc * input_size)
-        mask = torch.zeros(self.shape, dtype=torch.bool)
-        # loop over outputs
-        for dim in range(output_size):
-            # select a subsample of the indexes in the output unit
-            all_idxs = np.array(list(product(*[range(s) for s in self.shape[1:]])))
-            sampled_idxs = np.random.choice(
-                range(len(all_idxs)), num_add, replace=False
-            )
-            selected = all_idxs[sampled_idxs]
-            if len(selected) > 0:
-                # change from long to wide format
-                selected_wide = list(zip(*selected))
-                # append the output dimension to wide format
-                selected_wide.insert(0, tuple([dim] * len(selected_wide[0])))
-                # apply the mask
-                mask[selected_wide] = True
-
-        self.mask = mask.float().to(self.device)
+        mask = random_mask(self.shape, num_add, per_output=True, device=self.device)
+        self.mask = mask.float()
 
     def _mask_stochastic(self):
         """Sthocastic in num of params approach of sparsifying a tensor"""
@@ -165,18 +147,9 @@ class SparseModule:
         Deterministic in number of params approach of sparsifying a tensor
         Sample N from all possible indices
         """
-        all_idxs = np.array(list(product(*[range(s) for s in self.shape])))
         num_add = int(self.on_perc * np.prod(self.shape))
-        sampled_idxs = np.random.choice(range(len(all_idxs)), num_add, replace=False)
-        selected = all_idxs[sampled_idxs]
-
-        mask = torch.zeros(self.shape, dtype=torch.bool)
-        if len(selected.shape) > 1:
-            mask[list(zip(*selected))] = True
-        else:
-            mask[selected] = True
-
-        self.mask = mask.float().to(self.device)
+        mask = random_mask(self.shape, num_add, device=self.device)
+        self.mask = mask.float()
 
 
 class PrunableModule(SparseModule):
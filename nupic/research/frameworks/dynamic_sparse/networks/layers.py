@@ -23,12 +23,15 @@ import itertools
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 
 __all__ = [
     "DynamicSparseBase",
     "DSLinear",
     "DSConv2d",
     "init_coactivation_tracking",
+    "kth_smallest",
+    "random_mask",
 ]
 
 
@@ -47,9 +50,12 @@ def calc_onfrac(weight):
 
 def topk_mask(tensor, k, exclusive=True):
 
+    if k == 0:
+        return torch.zeros_like(tensor, dtype=torch.bool)
+
     # Get value of top 'perc' percentile.
-    tensor_flat = (tensor.cpu() if tensor.is_cuda else tensor).flatten()
-    v = np.partition(tensor_flat, -k)[-k]
+    tensor_flat = tensor.flatten()
+    v, _ = tensor_flat.kthvalue(len(tensor_flat) - k + 1)
 
     # Return mask of values above v.
     topk = (tensor > v) if exclusive else (tensor >= v)
@@ -76,6 +82,78 @@ def where(condition):
     return idx
 
 
+def kth_smallest(tensor, k, candidates=None):
+    """
+    Returns the k-th smallest value (1-indexed) of a tensor, as a 0-dim tensor.
+    Unlike `torch.kthvalue`, `k` may be a tensor, so that it can be computed on
+    the device without synchronizing with the host.
+
+    :param tensor: tensor of values
+    :param k: int or 0-dim long tensor; clamped to the valid range
+    :param candidates: optional boolean mask; if given, only these entries count
+    """
+    values = tensor.flatten()
+    if candidates is not None:
+        values = values.masked_fill(~candidates.flatten(), float("inf"))
+    sorted_values, _ = values.sort()
+
+    k = torch.as_tensor(k, device=values.device).long()
+    return sorted_values[(k - 1).clamp(0, len(sorted_values) - 1)]
+
+
+def _top_keys_mask(keys, k, per_output=False):
+    """
+    Returns a boolean mask of the `k` largest keys - either over the whole tensor
+    or, if `per_output`, along each output (i.e. for each index of the first dim).
+    If `k` is a tensor, the mask is computed from ranks so it stays on the device.
+    """
+    flat_keys = keys.view(keys.shape[0], -1) if per_output else keys.view(-1)
+
+    if torch.is_tensor(k):
+        order = flat_keys.argsort(dim=-1, descending=True)
+        positions = torch.arange(order.shape[-1], device=keys.device)
+        ranks = torch.empty_like(order).scatter_(-1, order, positions.expand_as(order))
+        k = k.to(keys.device)
+        mask = ranks < k.view(-1, 1) if per_output else ranks < k
+        return mask.view(keys.shape)
+
+    k = min(int(k), flat_keys.shape[-1])
+    _, idx = flat_keys.topk(k, dim=-1, sorted=False)
+
+    mask = torch.zeros_like(flat_keys, dtype=torch.bool)
+    mask.scatter_(-1, idx, True)
+    return mask.view(keys.shape)
+
+
+def random_mask(shape, num_on, candidates=None, per_output=False, device=None):
+    """
+    Samples a boolean mask with exactly `num_on` non-zeros, chosen uniformly at
+    random without replacement, by taking the top-k of random keys.
+
+    :param shape: shape of the mask
+    :param num_on: number of non-zeros - in total, or per output if `per_output`;
+                   may be a tensor, in which case no host sync is needed
+    :param candidates: optional boolean mask; if given, only these entries may be
+                       selected and at most `candidates.sum()` will be
+    :param per_output: whether to sample `num_on` per output unit (the first dim)
+    :param device: device on which to sample; defaults to that of the candidates
+    """
+    if candidates is not None:
+        device = device or candidates.device
+        candidates = candidates.to(device=device, dtype=torch.bool)
+
+    keys = torch.rand(shape, device=device)
+    if candidates is not None:
+        # Non-candidates are ranked last, and dropped below if they were picked.
+        keys.masked_fill_(~candidates, -1)
+
+    mask = _top_keys_mask(keys, num_on, per_output=per_output)
+    if candidates is not None:
+        mask &= candidates
+
+    return mask
+
+
 def break_mask_ties(mask, num_remain=None, frac_remain=None):
     """
     Break ties in a mask - whether between zeros or ones.
@@ -91,33 +169,14 @@ def break_mask_ties(mask, num_remain=None, frac_remain=None):
     if num_remain is None:
         num_remain = int(frac_remain * np.prod(mask.shape))
 
-    idx_ones = where(mask == 1)
-    num_ones = len(idx_ones)
-    if num_ones > 0:
-        idx_ones = tuple(
-            idx_ones[i1_]
-            for i1_ in np.random.choice(
-                range(num_ones), min(num_remain, num_ones), replace=False
-            )
-        )
+    # Random keys ranking ones first, then zeros, then anything else.
+    keys = torch.rand(mask.shape, device=mask.device)
+    keys[mask == 1] += 1
+    keys[(mask != 0) & (mask != 1)] = -1
 
-    if num_ones < num_remain:
-        num_fill = num_remain - num_ones
-        idx_zeros = where(mask == 0)
-        num_zeros = len(idx_zeros)
-        idx_remain = idx_ones + tuple(
-            idx_zeros[i0_]
-            for i0_ in np.random.choice(
-                range(num_zeros), min(num_fill, num_zeros), replace=False
-            )
-        )
-
-    else:
-        idx_remain = idx_ones
-
-    idx_remain = tuple(zip(*idx_remain))
+    remain = _top_keys_mask(keys, num_remain) & (keys >= 0)
     mask[...] = 0
-    mask[idx_remain] = 1
+    mask[remain] = 1
 
     return mask
 
@@ -237,26 +296,40 @@ class DSLinear(torch.nn.Linear, DynamicSparseBase):
         self.__dict__.update(new_defaults)
         self.update_interval = self.lin_update_interval
 
-    def calc_coactivations(self, x, y):
-        outer = 0
-        n_samples = x.shape[0]
-        with torch.no_grad():
+    def _update_coactivations(self, input_tensor, output_tensor):
+        if self.update_func or self.moving_average_alpha:
+            super()._update_coactivations(input_tensor, output_tensor)
+            return
 
-            # Get active units.
+        # Plain summation: accumulate the batch in place, with a single matmul.
+        prev_act, curr_act = self._get_activations(input_tensor, output_tensor)
+        self.coactivations.addmm_(curr_act.t(), prev_act)
+
+    def _get_activations(self, x, y):
+        """
+        Returns the (binarized, if configured) input and output activations,
+        flattened to shape (n_samples, features).
+        """
+        with torch.no_grad():
+            x = x.detach().reshape(-1, self.in_features)
+            y = y.detach().reshape(-1, self.out_features)
             if self.use_binary_coactivations:
-                prev_act = (x > 0).detach().float()
-                curr_act = (y > 0).detach().float()
+                prev_act = (x > 0).to(self.coactivations.dtype)
+                curr_act = (y > 0).to(self.coactivations.dtype)
             else:
-                prev_act = x.clone().detach().float()
-                curr_act = y.clone().detach().float()
+                prev_act = x.to(self.coactivations.dtype)
+                curr_act = y.to(self.coactivations.dtype)
 
-            # Cumulate outer product over all samples.
-            # TODO: Vectorize this sum; for instance, using torch.einsum().
-            for s in range(n_samples):
-                outer += torch.ger(curr_act[s], prev_act[s])
+        return prev_act, curr_act
 
-        # Return coactivations.
-        return outer
+    def calc_coactivations(self, x, y):
+        """
+        Sum of the outer products of output and input activations over the batch,
+        i.e. sum_s outer(y[s], x[s]), computed as a single matmul.
+        """
+        prev_act, curr_act = self._get_activations(x, y)
+        with torch.no_grad():
+            return curr_act.t().mm(prev_act)
 
 
 # ------------------
@@ -334,6 +407,10 @@ class DSConv2d(torch.nn.Conv2d, DynamicSparseBase):
                                calculating the coactivation - this only works when the
                                device is "cuda" and is mainly for memory saving during
                                training
+        :param coactivation_memory_budget: if set, approximate number of bytes
+                                           of temporaries allowed when calculating
+                                           the coactivations; the computation is
+                                           then done in chunks via `unfold`
         """
         super().__init__(
             in_channels,
@@ -414,6 +491,7 @@ class DSConv2d(torch.nn.Conv2d, DynamicSparseBase):
             half_precision=False,
             coactivation_test="correlation_proxy",
             threshold_multiplier=1,
+            coactivation_memory_budget=None,  # See `calc_coactivations_chunked`
         )
         new_defaults = {k: (config.get(k, None) or v) for k, v in defaults.items()}
         self.__dict__.update(new_defaults)
@@ -458,6 +536,9 @@ class DSConv2d(torch.nn.Conv2d, DynamicSparseBase):
             2. (unit_in  - mean_input ) > input_activity_threshold
             3. (unit_out - mean_output) > output_activity_threshold
         """
+        if self.coactivation_memory_budget and self.groups == 1:
+            return self.calc_coactivations_chunked(input_tensor, output_tensor)
+
         with torch.no_grad():
 
             # Switch to half-floating precision if needed.
@@ -547,6 +628,118 @@ class DSConv2d(torch.nn.Conv2d, DynamicSparseBase):
 
             return new_coacts
 
+    def _get_chunk_sizes(self, batch_size, out_width, element_size):
+        """
+        Returns the number of output channels and output rows to process at a time
+        so the temporaries of each chunk, of `element_size` bytes per element, fit
+        within `coactivation_memory_budget`.
+        """
+        num_filters = self.new_groups
+        budget = self.coactivation_memory_budget / (element_size * out_width)
+
+        # The correlation test keeps a (channels x filters) matrix per position.
+        corr_factor = 3 if self.coactivation_test == "correlation" else 0
+
+        # Shrink the output channels until at least one row fits.
+        channels = self.out_channels
+        free = budget - batch_size * num_filters
+        if free < batch_size * channels + corr_factor * num_filters * channels:
+            channels = int(free // (batch_size + corr_factor * num_filters))
+        channels = min(max(channels, 1), self.out_channels)
+
+        row_size = batch_size * (num_filters + channels)
+        row_size += corr_factor * num_filters * channels
+        rows = max(int(budget // row_size), 1)
+
+        return channels, rows
+
+    def calc_coactivations_chunked(self, input_tensor, output_tensor):
+        """
+        Memory bounded equivalent of :meth:`calc_coactivations`.
+
+        Rather than replicating the input for every connection, the receptive
+        fields are extracted with `unfold` (im2col) a few output rows at a time,
+        and compared against a few output channels at a time. The tiles are sized
+        so that their temporaries fit within `coactivation_memory_budget` bytes.
+        Only supports `groups=1` and zero padding.
+        """
+        with torch.no_grad():
+
+            input_tensor = input_tensor.detach().float()
+            output_tensor = output_tensor.detach().float()
+            batch_size = input_tensor.shape[0]
+            out_height, out_width = output_tensor.shape[2:]
+
+            mu_in = input_tensor.mean()
+            mu_out = output_tensor.mean()
+            if self.coactivation_test == "variance":
+                a1, a2 = self.get_activity_threshold(input_tensor, output_tensor)
+                a1 = a1 * self.threshold_multiplier
+                a2 = a2 * self.threshold_multiplier
+
+            # Pad once, so each row tile can be unfolded independently.
+            padding = (
+                self.padding[1], self.padding[1], self.padding[0], self.padding[0]
+            )
+            padded_input = F.pad(input_tensor, padding)
+
+            channels, rows = self._get_chunk_sizes(
+                batch_size, out_width, input_tensor.element_size()
+            )
+            k_height = self.dilation[0] * (self.kernel_size[0] - 1) + 1
+
+            h = torch.zeros(
+                self.out_channels, self.new_groups, device=input_tensor.device
+            )
+            for r0 in range(0, out_height, rows):
+                r1 = min(r0 + rows, out_height)
+
+                # Receptive fields of output rows r0 to r1: (batch, filters, pos)
+                i0 = r0 * self.stride[0]
+                i1 = (r1 - 1) * self.stride[0] + k_height
+                patches = F.unfold(
+                    padded_input[:, :, i0:i1],
+                    self.kernel_size,
+                    dilation=self.dilation,
+                    stride=self.stride,
+                )
+                outputs = output_tensor[:, :, r0:r1].flatten(start_dim=2)
+
+                if self.coactivation_test == "variance":
+                    patches = (patches - mu_in).abs_().gt_(a1)
+                elif self.coactivation_test == "correlation_proxy":
+                    patches = (patches != 0).float()
+                elif self.coactivation_test == "correlation":
+                    patches_std = patches.std(dim=0)
+                    patches = patches - patches.mean(dim=0)
+
+                for c0 in range(0, self.out_channels, channels):
+                    c1 = min(c0 + channels, self.out_channels)
+                    chunk = outputs[:, c0:c1]
+
+                    if self.coactivation_test == "variance":
+                        chunk = (chunk - mu_out).abs_().gt_(a2)
+                        h[c0:c1] += torch.einsum("bcl,bfl->cf", chunk, patches)
+
+                    elif self.coactivation_test == "correlation_proxy":
+                        chunk = (chunk != 0).float()
+                        h[c0:c1] += torch.einsum("bcl,bfl->cf", chunk, patches)
+
+                    elif self.coactivation_test == "correlation":
+                        chunk_std = chunk.std(dim=0)
+                        chunk = chunk - chunk.mean(dim=0)
+                        cov = torch.einsum("bcl,bfl->cfl", chunk, patches)
+                        cov = cov / batch_size
+                        std = chunk_std.unsqueeze(1) * patches_std.unsqueeze(0)
+                        corr = cov.div_(std)
+                        corr[std == 0] = 0
+                        h[c0:c1] += corr.abs_().sum(dim=2)
+
+                del patches
+                del outputs
+
+            return h.view_as(self.coactivations).type(self.coactivations.dtype)
+
     def __call__(self, input_tensor, *args, **kwargs):
         output_tensor = super().__call__(input_tensor, *args, **kwargs)
         return output_tensor
@@ -19,4 +19,5 @@
 #
 
 from .dataset_utils import *
-from .hdf5_utils import *
\ No newline at end of file
+from .hdf5_utils import *
+from .shard_utils import *
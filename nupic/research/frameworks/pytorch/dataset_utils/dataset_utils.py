@@ -46,11 +46,13 @@ __all__ = [
     "create_validation_data_sampler",
     "select_subset",
     "UnionDataset",
+    "IndexedDataset",
     "split_dataset",
     "PreprocessedDataset",
     "CachedDatasetFolder",
     "ProgressiveRandomResizedCrop",
     "HDF5Dataset",
+    "load_encoded_sample",
 ]
 
 
@@ -165,6 +167,31 @@ class UnionDataset(Dataset):
         return len(self.datasets[0])
 
 
+class IndexedDataset(Dataset):
+    """Dataset wrapper adding the index of each sample to its target, so the
+    samples of a batch can be identified, i.e. to cache per sample values.
+    The target becomes a tensor with the original target followed by the
+    index. Other attributes are the ones of the wrapped dataset.
+
+    :param dataset: dataset returning (data, target) with integer targets
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, index):
+        data, target = self.dataset[index]
+        return data, torch.tensor([int(target), index])
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getattr__(self, name):
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+
 def split_dataset(dataset, groupby):
     """Split the given dataset into multiple datasets grouped by the given
     groupby function. For example::
@@ -347,6 +374,43 @@ class ProgressiveRandomResizedCrop(object):
             self.image_size = size
 
 
+def load_encoded_sample(data, target, load_as_images=True, transform=None,
+                        target_transform=None, replicas_per_sample=1):
+    """
+    Decode one sample stored by :class:`HDF5Dataset` or :class:`ShardedDataset`
+    and apply the dataset transforms.
+
+    :param data: Encoded image file or saved tensor
+    :param target: Sample class
+    :param load_as_images:
+        whether to use `Image.open` or `torch.load` when loading data
+    :param transform: Optional transform applied to the decoded sample
+    :param target_transform: Optional transform applied to the target
+    :param replicas_per_sample:
+        number of replicas of each sample, each one transformed independently
+    :return: (sample, target)
+    """
+    # Convert image to RGB
+    if load_as_images:
+        image = Image.open(BytesIO(data))
+        sample = image.convert("RGB")
+    else:
+        sample = torch.load(BytesIO(data))
+
+    if transform is not None:
+        if replicas_per_sample > 1:
+            # add an extra dimension with size replicas_per_sample
+            sample = torch.stack([
+                transform(sample) for _ in range(replicas_per_sample)
+            ])
+        else:
+            sample = transform(sample)
+    if target_transform is not None:
+        target = target_transform(target)
+
+    return sample, target
+
+
 class HDF5Dataset(VisionDataset):
     """
     HDF5 image dataset where the images are arranged into class groups, similar
@@ -482,25 +546,13 @@ class HDF5Dataset(VisionDataset):
             # Load image data from dataset
             image_data = image_file[()]
 
-        # Convert image to RGB
-        if self._load_as_images:
-            image = Image.open(BytesIO(image_data))
-            sample = image.convert("RGB")
-        else:
-            sample = torch.load(BytesIO(image_data))
-
-        if self.transform is not None:
-            if self.replicas_per_sample > 1:
-                # add an extra dimension with size replicas_per_sample
-                sample = torch.stack([
-                    self.transform(sample) for _ in range(self.replicas_per_sample)
-                ])
-            else:
-                sample = self.transform(sample)
-        if self.target_transform is not None:
-            target = self.target_transform(target)
-
-        return sample, target
+        return load_encoded_sample(
+            image_data, target,
+            load_as_images=self._load_as_images,
+            transform=self.transform,
+            target_transform=self.target_transform,
+            replicas_per_sample=self.replicas_per_sample,
+        )
 
     def __len__(self):
         return len(self._images)
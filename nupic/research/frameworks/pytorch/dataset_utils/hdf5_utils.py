@@ -19,6 +19,10 @@
 # ----------------------------------------------------------------------
 
 import io
+import multiprocessing
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
 import h5py
 import numpy as np
@@ -28,6 +32,7 @@ from torchvision.transforms import ToPILImage
 __all__ = [
     "tensor_to_byte_array",
     "HDF5DataSaver",
+    "BatchedHDF5DataSaver",
 ]
 
 
@@ -90,3 +95,137 @@ class HDF5DataSaver(object):
         lock = self.lock
         self.hdf5_save(
             data_path, image_data, group_name, class_name, image_name, lock=lock)
+
+
+class BatchedHDF5DataSaver(HDF5DataSaver):
+    """
+    Faster alternative to :class:`HDF5DataSaver` for building large datasets.
+    Samples are encoded by `to_bytes_func` in a pool of worker processes and
+    written in batches of `batch_size` by this object, the only writer, which
+    keeps the HDF5 file open until :meth:`close`. The image index used by
+    :class:`HDF5Dataset` (".__hdf5_index__") is updated after every batch.
+
+    Example::
+
+        with BatchedHDF5DataSaver("data.hdf5") as saver:
+            for i, (image, target) in enumerate(dataset):
+                saver.append_tensor(image, f"{i}.png", "train", str(target))
+
+    :param data_path: HDF5 file path
+    :param to_bytes_func: Function encoding each sample into `np.void` bytes.
+                          Must be picklable when `num_workers > 0`.
+                          Default: PNG images
+    :param num_workers: Number of encoding processes. Encode in the calling
+                        process when 0. Default: number of CPUs
+    :param batch_size: Number of samples written at once
+    """
+
+    def __init__(self, data_path, to_bytes_func=None, num_workers=None,
+                 batch_size=256):
+        super().__init__(data_path=data_path, to_bytes_func=to_bytes_func)
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self._executor = ProcessPoolExecutor(num_workers) if num_workers > 0 else None
+        self._pending = []
+        self._hdf5 = None
+        self._hdf5_idx = None
+
+    def append_tensor(self, tensor, image_name, group_name, class_name):
+        self.append(tensor, image_name, group_name, class_name)
+
+    def append(self, data, image_name, group_name, class_name):
+        """
+        Queue `to_bytes_func(data)` to be saved as
+        "/group_name/class_name/image_name"
+        """
+        if self._executor is None:
+            image_data = self.to_bytes_func(data)
+        else:
+            image_data = self._executor.submit(self.to_bytes_func, data)
+        self._pending.append((image_data, image_name, group_name, class_name))
+        # Keep the next batch encoding while the oldest one is written
+        if len(self._pending) >= 2 * self.batch_size:
+            self._write(self.batch_size)
+
+    def flush(self):
+        """
+        Write all queued samples and update the image index
+        """
+        self._write(len(self._pending))
+
+    def _write(self, count):
+        if count == 0:
+            return
+        if self._hdf5 is None:
+            self._hdf5 = h5py.File(name=self.data_path, mode="a")
+            index_file = Path(self.data_path).with_suffix(".__hdf5_index__")
+            self._hdf5_idx = h5py.File(name=index_file, mode="a")
+
+        pending, self._pending = self._pending[:count], self._pending[count:]
+        new_images = {}
+        for image_data, image_name, group_name, class_name in pending:
+            if not isinstance(image_data, np.void):
+                image_data = image_data.result()
+            main_group = self._hdf5.require_group(group_name)
+            wnid_group = main_group.require_group(class_name)
+            wnid_group.create_dataset(image_name, data=image_data)
+            new_images.setdefault(group_name, []).append(
+                posixpath.join("/", group_name, class_name, image_name))
+
+        for group_name, images in new_images.items():
+            self._append_index(group_name, images)
+        self._hdf5.flush()
+        self._hdf5_idx.flush()
+
+    def _append_index(self, group_name, images):
+        hdf5_idx_root = self._hdf5_idx.require_group(group_name)
+        if "images" not in hdf5_idx_root:
+            # Include images saved to this group before this writer was used
+            hdf5_root = self._hdf5[group_name]
+            images = [
+                posixpath.join("/", group_name, class_name, image_name)
+                for class_name in hdf5_root
+                for image_name in hdf5_root[class_name]
+            ]
+            index_data = np.array(images, dtype="S")
+            hdf5_idx_root.create_dataset(
+                "images", data=index_data, maxshape=(None,), chunks=True)
+            return
+
+        index = hdf5_idx_root["images"]
+        index_data = np.array(images, dtype="S")
+        if index.maxshape[0] is not None or \
+                index_data.itemsize > index.dtype.itemsize:
+            # Index created by HDF5Dataset (not resizable) or names longer
+            # than the current fixed length string size
+            index_data = np.concatenate((index[()], index_data))
+            del hdf5_idx_root["images"]
+            hdf5_idx_root.create_dataset(
+                "images", data=index_data, maxshape=(None,), chunks=True)
+        else:
+            size = index.shape[0]
+            index.resize((size + len(index_data),))
+            index[size:] = index_data
+
+    def close(self):
+        """
+        Write all queued samples and close the HDF5 files
+        """
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            if self._hdf5 is not None:
+                self._hdf5.close()
+                self._hdf5_idx.close()
+                self._hdf5 = None
+                self._hdf5_idx = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,372 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+import itertools
+import math
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+from .dataset_utils import HDF5Dataset, load_encoded_sample
+
+__all__ = [
+    "SHARD_INDEX_FILE",
+    "convert_hdf5_to_shards",
+    "is_sharded_dataset",
+    "ShardedDataset",
+]
+
+SHARD_INDEX_FILE = "index.npz"
+SHARD_FILE_FORMAT = "shard-{:05d}.bin"
+
+
+def convert_hdf5_to_shards(hdf5_file, root, output_dir, shard_size=256 * 2 ** 20,
+                           load_as_images=True, seed=42):
+    """
+    Convert one group of a class-group HDF5 file (see :class:`HDF5Dataset`) into
+    packed shards readable by :class:`ShardedDataset`::
+
+        output_dir/root/index.npz
+        output_dir/root/shard-00000.bin
+        output_dir/root/shard-00001.bin
+        ...
+
+    Each shard is the raw concatenation of the encoded samples. The index holds
+    the class names and, for every sample, its shard, byte offset, byte size
+    and class. Samples are shuffled once before packing so that every shard
+    holds a mix of classes and a small shuffle buffer is enough at read time.
+
+    :param hdf5_file: HDF5 file path
+    :param root: Root group name (i.e. "train", "val", "test")
+    :param output_dir: Directory where the "root" shard directory is created
+    :param shard_size: Target shard size in bytes
+    :param load_as_images: whether the group holds images or saved tensors
+    :param seed: Seed used to shuffle the samples across shards
+    :return: Path to the shard directory
+    """
+    # Reuse the cached image list of the HDF5 dataset
+    dataset = HDF5Dataset(hdf5_file=hdf5_file, root=root,
+                          load_as_images=load_as_images)
+    class_paths = list(dataset.get_classes().keys())
+    class_idx = {c: i for i, c in enumerate(class_paths)}
+    images = np.array(dataset._images)
+    images = images[np.random.RandomState(seed).permutation(len(images))]
+
+    shard_dir = os.path.join(output_dir, root)
+    os.makedirs(shard_dir, exist_ok=True)
+
+    shards = np.empty(len(images), dtype=np.int32)
+    offsets = np.empty(len(images), dtype=np.int64)
+    sizes = np.empty(len(images), dtype=np.int64)
+    targets = np.empty(len(images), dtype=np.int32)
+    shard_files = []
+    shard_file = None
+    with h5py.File(name=hdf5_file, mode="r") as hdf5:
+        try:
+            offset = shard_size
+            for i, image_name in enumerate(images):
+                if offset >= shard_size:
+                    if shard_file is not None:
+                        shard_file.close()
+                    shard_files.append(SHARD_FILE_FORMAT.format(len(shard_files)))
+                    shard_file = open(os.path.join(shard_dir, shard_files[-1]), "wb")
+                    offset = 0
+
+                data = hdf5[image_name][()].tobytes()
+                shard_file.write(data)
+                shards[i] = len(shard_files) - 1
+                offsets[i] = offset
+                sizes[i] = len(data)
+                targets[i] = class_idx[posixpath.dirname(image_name)]
+                offset += len(data)
+        finally:
+            if shard_file is not None:
+                shard_file.close()
+
+    np.savez(
+        os.path.join(shard_dir, SHARD_INDEX_FILE),
+        classes=np.array([posixpath.basename(c) for c in class_paths]),
+        shard_files=np.array(shard_files),
+        images=images,
+        shards=shards,
+        offsets=offsets,
+        sizes=sizes,
+        targets=targets,
+    )
+    return shard_dir
+
+
+def is_sharded_dataset(data_dir, root):
+    """
+    Whether the "root" group of `data_dir` was created by
+    :func:`convert_hdf5_to_shards`
+    """
+    return os.path.isfile(os.path.join(data_dir, root, SHARD_INDEX_FILE))
+
+
+class ShardedDataset(IterableDataset):
+    """
+    Iterable image dataset reading the packed shards created by
+    :func:`convert_hdf5_to_shards`. Shards are read whole, in a random order
+    that changes every epoch, while the next shard is read in the background.
+    Samples are shuffled with a buffer of `shuffle_buffer_size` encoded samples.
+
+    Every epoch, the shards are concatenated in a new order and the resulting
+    sample stream is split into contiguous ranges, one for each distributed
+    replica and data loader worker. Every replica yields `len(self)` samples,
+    wrapping around the stream as needed, so all replicas process the same
+    number of batches. With `pad=False` no sample is repeated and the replicas
+    sizes may differ by one, as with :class:`UnpaddedDistributedSampler`.
+
+    .. note::
+        Call `set_epoch` at the beginning of each epoch, as you would on a
+        :class:`torch.utils.data.DistributedSampler`, to reshuffle the shards.
+
+    :param data_dir:
+        Directory passed as `output_dir` to :func:`convert_hdf5_to_shards`
+    :param root:
+        Root group name (i.e. "train", "val", "test")
+    :param num_classes:
+        Number of classes used to Limit the dataset size. Not limited when None
+    :param classes:
+        Limit the dataset to images from the given classes.
+    :param load_as_images:
+        whether to use `Image.open` or `torch.load` when loading data
+    :param replicas_per_sample:
+        Number of replicas to create per sample in the batch.
+        (each replica is transformed independently)
+        Used in maxup.
+    :param transform:
+        A function/transform applied to each sample
+    :param target_transform:
+        A function/transform applied to each target
+    :param shuffle:
+        Whether to shuffle the shard order and the samples
+    :param shuffle_buffer_size:
+        Number of samples held in the shuffle buffer
+    :param batch_size:
+        The data loader batch size. Used to split the samples among the loader
+        workers along batch boundaries so `len(DataLoader)` is exact.
+    :param num_replicas:
+        Number of distributed replicas. Defaults to the world size
+    :param rank:
+        Rank of the current replica. Defaults to the current process rank
+    :param seed:
+        Random seed shared by all replicas
+    :param pad:
+        Whether to repeat samples so that all replicas have the same size.
+        Disable for validation.
+    """
+
+    def __init__(
+        self, data_dir, root,
+        num_classes=None, classes=None, load_as_images=True,
+        replicas_per_sample=1, transform=None, target_transform=None,
+        shuffle=True, shuffle_buffer_size=10000, batch_size=1,
+        num_replicas=None, rank=None, seed=0, pad=True,
+    ):
+        super(ShardedDataset, self).__init__()
+        self.root = root
+        self.transform = transform
+        self.target_transform = target_transform
+        self.replicas_per_sample = replicas_per_sample
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.batch_size = batch_size
+        self.seed = seed
+        self.pad = pad
+        self.epoch = 0
+        self._load_as_images = load_as_images
+        self._shard_dir = os.path.join(data_dir, root)
+
+        if num_replicas is None or rank is None:
+            distributed = dist.is_available() and dist.is_initialized()
+            if num_replicas is None:
+                num_replicas = dist.get_world_size() if distributed else 1
+            if rank is None:
+                rank = dist.get_rank() if distributed else 0
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+        with np.load(os.path.join(self._shard_dir, SHARD_INDEX_FILE)) as index:
+            all_classes = index["classes"].tolist()
+            self._shard_files = index["shard_files"].tolist()
+            shards = index["shards"]
+            offsets = index["offsets"]
+            sizes = index["sizes"]
+            targets = index["targets"]
+
+        # Same class selection as HDF5Dataset
+        self._classes = {
+            posixpath.join("/", root, g): i for i, g in enumerate(all_classes)
+        }
+        if classes is not None:
+            self._classes = {
+                posixpath.join("/", root, g): i for i, g in enumerate(classes)
+            }
+        if num_classes is not None:
+            self._classes = dict(itertools.islice(self._classes.items(), num_classes))
+
+        # Map the stored class index to the selected target, -1 when filtered out
+        target_map = np.full(len(all_classes), -1, dtype=np.int64)
+        for class_name, target in self._classes.items():
+            target_map[all_classes.index(posixpath.basename(class_name))] = target
+        targets = target_map[targets]
+        selected = targets >= 0
+
+        # Per shard (offset, size, target) of the selected samples. Samples
+        # are stored in shard order, so split them at the shard boundaries.
+        samples = np.stack((offsets, sizes, targets), axis=1)[selected]
+        boundaries = np.searchsorted(
+            shards[selected], np.arange(1, len(self._shard_files)))
+        self._samples = np.split(samples, boundaries)
+        self._total_samples = int(selected.sum())
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _replica_range(self):
+        """
+        Range of the epoch sample stream of the current replica
+        """
+        if self.pad:
+            num_samples = int(math.ceil(self._total_samples / self.num_replicas))
+            start = self.rank * num_samples
+            return start, start + num_samples
+        start = self.rank * self._total_samples // self.num_replicas
+        stop = (self.rank + 1) * self._total_samples // self.num_replicas
+        return start, stop
+
+    def __len__(self):
+        start, stop = self._replica_range()
+        return stop - start
+
+    def _worker_range(self, worker_id, num_workers):
+        """
+        Range of the replica samples yielded by the given worker. The loader
+        takes whole batches from each worker in turn, so worker `w` gets as
+        many samples as batches `w, w + num_workers, ...` and only the very
+        last batch may be partial.
+        """
+        num_samples = len(self)
+        num_batches = int(math.ceil(num_samples / self.batch_size))
+        quotas = []
+        for w in range(num_workers):
+            worker_batches = len(range(w, num_batches, num_workers))
+            quota = worker_batches * self.batch_size
+            if worker_batches > 0 and (num_batches - 1) % num_workers == w:
+                quota -= num_batches * self.batch_size - num_samples
+            quotas.append(quota)
+        start = sum(quotas[:worker_id])
+        return start, start + quotas[worker_id]
+
+    def _shard_slices(self, start, stop):
+        """
+        Map the range `[start, stop)` of the epoch sample stream to a list of
+        `(shard, first, last)` sample slices. The stream is the concatenation
+        of the shards in the epoch order, wrapped around to pad the last
+        replica, as :class:`torch.utils.data.DistributedSampler` does.
+        """
+        order = np.arange(len(self._shard_files))
+        if self.shuffle:
+            order = np.random.RandomState((self.seed, self.epoch)).permutation(order)
+        counts = np.array([len(self._samples[s]) for s in order])
+        ends = np.cumsum(counts)
+        slices = []
+        while start < stop:
+            pos = start % self._total_samples
+            k = np.searchsorted(ends, pos, side="right")
+            first = pos - (ends[k] - counts[k])
+            last = min(counts[k], first + stop - start)
+            slices.append((order[k], first, last))
+            start += last - first
+        return slices
+
+    def _read_samples(self, shard, first, last):
+        """
+        Read the contiguous byte range holding the given samples of a shard
+        """
+        samples = self._samples[shard][first:last]
+        begin = samples[0, 0]
+        end = samples[-1, 0] + samples[-1, 1]
+        with open(os.path.join(self._shard_dir, self._shard_files[shard]), "rb") as f:
+            f.seek(begin)
+            data = f.read(end - begin)
+        return data, samples - (begin, 0, 0)
+
+    def _iter_encoded(self, start, stop):
+        """
+        Iterate the encoded samples in the given range of the epoch sample
+        stream, reading the next shard in the background
+        """
+        slices = self._shard_slices(start, stop)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self._read_samples, *slices[0])
+            for i in range(len(slices)):
+                data, samples = pending.result()
+                if i + 1 < len(slices):
+                    pending = executor.submit(self._read_samples, *slices[i + 1])
+                for offset, size, target in samples:
+                    yield data[offset:offset + size], target
+
+    def _shuffle(self, samples, rng):
+        buffer = []
+        for sample in samples:
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(sample)
+                continue
+            i = rng.randint(len(buffer))
+            yield buffer[i]
+            buffer[i] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (
+            worker_info.id, worker_info.num_workers)
+
+        start, stop = self._worker_range(worker_id, num_workers)
+        if start == stop:
+            return
+
+        # Contiguous range of the epoch sample stream for this replica/worker
+        offset = self._replica_range()[0]
+        samples = self._iter_encoded(offset + start, offset + stop)
+        if self.shuffle and self.shuffle_buffer_size > 1:
+            rng = np.random.RandomState(
+                (self.seed, self.epoch, self.rank, worker_id))
+            samples = self._shuffle(samples, rng)
+
+        for data, target in samples:
+            yield load_encoded_sample(
+                data, int(target),
+                load_as_images=self._load_as_images,
+                transform=self.transform,
+                target_transform=self.target_transform,
+                replicas_per_sample=self.replicas_per_sample,
+            )
+
+    def get_classes(self):
+        return self._classes
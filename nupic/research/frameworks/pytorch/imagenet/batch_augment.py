@@ -0,0 +1,430 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+"""
+Batched data augmentation running on the training device.
+
+The data loader workers only decode the images into fixed size uint8 tensors
+(:class:`DecodeToTensor`), keeping the original image sizes. :class:`BatchAugment`
+then applies the training augmentation used by `create_train_dataset` (random
+resized crop, horizontal flip, optional `ImageNetPolicy` auto-augment and
+normalization) to the whole batch at once, replicas included, usually as the
+`transform` of a `PrefetchLoader`. The crops are drawn in the original image
+coordinates, so they follow the same distribution as `RandomResizedCrop` on the
+full images. All random parameters are drawn on the CPU from a dedicated
+generator, so the same seed gives the same results whether the batch is
+augmented on the GPU or on the CPU.
+"""
+import math
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F
+from torchvision import transforms
+
+from .auto_augment import ImageNetPolicy
+
+__all__ = [
+    "DecodeToTensor",
+    "BatchAugment",
+]
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Operations using a random sign for the magnitude. See auto_augment.py
+SIGNED_OPS = {"shear_x", "shear_y", "translate_x", "translate_y", "color",
+              "contrast", "sharpness", "brightness"}
+
+
+class DecodeToTensor(object):
+    """
+    Data loader side of the batched augmentation pipeline. Resize the whole
+    image to `size` x `size`, without cropping it, and convert it to a uint8
+    CxHxW tensor so images can be collated into batches. The original
+    (height, width) of the image is returned with it, so :class:`BatchAugment`
+    draws the crops from the full image with its original aspect ratio.
+
+    :param size: Size of the decoded images
+    :return: tuple with the decoded image and its original (height, width)
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.resize = transforms.Resize((size, size))
+
+    def __call__(self, img):
+        width, height = img.size
+        image = np.array(self.resize(img), dtype=np.uint8)
+        image = torch.from_numpy(image).permute(2, 0, 1).contiguous()
+        return image, torch.tensor([height, width])
+
+    def __repr__(self):
+        return "DecodeToTensor(size={})".format(self.size)
+
+
+def _blend(degenerate, images, factor):
+    """Same as `PIL.Image.blend(degenerate, images, factor)`"""
+    factor = factor.view(-1, 1, 1, 1)
+    return (degenerate + factor * (images - degenerate)).round_().clamp_(0, 255)
+
+
+def _grayscale(images):
+    """Same as PIL "L" conversion. Returns Nx1xHxW"""
+    r, g, b = images.unbind(dim=1)
+    return (0.299 * r + 0.587 * g + 0.114 * b).round_().unsqueeze(1)
+
+
+def _sample(images, matrix, size, mode="bilinear", fill=None):
+    """
+    Sample `images` following the PIL `Image.transform` affine convention: the
+    Nx2x3 `matrix` maps the (x, y) pixel coordinates of the output, taken at
+    the pixel centers, to the input pixel coordinates.
+
+    :param size: Output (height, width)
+    :param fill: Value used outside the input image. None to repeat the border
+    """
+    n, c, height, width = images.shape
+    ys = torch.arange(size[0], dtype=images.dtype, device=images.device) + 0.5
+    xs = torch.arange(size[1], dtype=images.dtype, device=images.device) + 0.5
+    ys = ys.view(-1, 1).expand(size[0], size[1])
+    xs = xs.view(1, -1).expand(size[0], size[1])
+    coords = torch.stack((xs, ys, torch.ones_like(xs)), dim=-1)
+    grid = coords.view(1, -1, 3).matmul(matrix.transpose(1, 2))
+    scale = torch.tensor([2.0 / width, 2.0 / height], device=images.device)
+    grid = (grid * scale - 1).view(n, size[0], size[1], 2)
+
+    if fill is None:
+        return F.grid_sample(images, grid, mode=mode, padding_mode="border",
+                             align_corners=False)
+
+    # Sample an extra channel of ones to find the pixels outside the image
+    ones = torch.ones_like(images[:, :1])
+    output = F.grid_sample(torch.cat((images, ones), dim=1), grid, mode=mode,
+                           padding_mode="zeros", align_corners=False)
+    inside = output[:, c:]
+    return output[:, :c] + (1 - inside) * fill
+
+
+def _affine(images, a, b, c, d, e, f, mode, fill=128):
+    matrix = torch.stack((a, b, c, d, e, f), dim=1).view(-1, 2, 3)
+    return _sample(images, matrix, images.shape[-2:], mode=mode, fill=fill).round_()
+
+
+def shear_x(images, magnitude):
+    zero, one = torch.zeros_like(magnitude), torch.ones_like(magnitude)
+    return _affine(images, one, magnitude, zero, zero, one, zero, mode="bilinear")
+
+
+def shear_y(images, magnitude):
+    zero, one = torch.zeros_like(magnitude), torch.ones_like(magnitude)
+    return _affine(images, one, zero, zero, magnitude, one, zero, mode="bilinear")
+
+
+def translate_x(images, magnitude):
+    zero, one = torch.zeros_like(magnitude), torch.ones_like(magnitude)
+    offset = magnitude * images.shape[-1]
+    return _affine(images, one, zero, offset, zero, one, zero, mode="nearest")
+
+
+def translate_y(images, magnitude):
+    zero, one = torch.zeros_like(magnitude), torch.ones_like(magnitude)
+    offset = magnitude * images.shape[-2]
+    return _affine(images, one, zero, zero, zero, one, offset, mode="nearest")
+
+
+def rotate(images, magnitude):
+    """Counter clockwise rotation in degrees around the center, as `Image.rotate`"""
+    center_x, center_y = images.shape[-1] / 2.0, images.shape[-2] / 2.0
+    angle = -magnitude * math.pi / 180
+    cos, sin = torch.cos(angle), torch.sin(angle)
+    return _affine(
+        images,
+        cos, sin, center_x - cos * center_x - sin * center_y,
+        -sin, cos, center_y + sin * center_x - cos * center_y,
+        mode="nearest",
+    )
+
+
+def color(images, magnitude):
+    degenerate = _grayscale(images).expand_as(images)
+    return _blend(degenerate, images, 1 + magnitude)
+
+
+def contrast(images, magnitude):
+    mean = _grayscale(images).mean(dim=(1, 2, 3), keepdim=True)
+    degenerate = torch.floor(mean + 0.5).expand_as(images)
+    return _blend(degenerate, images, 1 + magnitude)
+
+
+def sharpness(images, magnitude):
+    # PIL "SMOOTH" filter, leaving the border pixels unchanged
+    channels = images.shape[1]
+    kernel = images.new_ones(channels, 1, 3, 3)
+    kernel[:, :, 1, 1] = 5
+    kernel /= 13
+    degenerate = images.clone()
+    degenerate[:, :, 1:-1, 1:-1] = F.conv2d(images, kernel, groups=channels).round_()
+    return _blend(degenerate, images, 1 + magnitude)
+
+
+def brightness(images, magnitude):
+    return _blend(torch.zeros_like(images), images, 1 + magnitude)
+
+
+def posterize(images, magnitude):
+    step = (2 ** (8 - magnitude)).view(-1, 1, 1, 1)
+    return torch.floor(images / step) * step
+
+
+def solarize(images, magnitude):
+    threshold = magnitude.view(-1, 1, 1, 1)
+    return torch.where(images >= threshold, 255 - images, images)
+
+
+def autocontrast(images, magnitude):
+    """Per channel autocontrast without cutoff, as `ImageOps.autocontrast`"""
+    flat = images.flatten(2)
+    lo = flat.min(dim=2, keepdim=True)[0]
+    hi = flat.max(dim=2, keepdim=True)[0]
+    scale = 255 / (hi - lo).clamp(min=1)
+    output = torch.floor(flat * scale - lo * scale).clamp_(0, 255)
+    return torch.where(hi > lo, output, flat).view_as(images)
+
+
+def equalize(images, magnitude):
+    """Per channel histogram equalization, as `ImageOps.equalize`"""
+    flat = images.flatten(0, 1).flatten(1).long()
+    hist = torch.zeros(len(flat), 256, dtype=torch.long, device=images.device)
+    hist.scatter_add_(1, flat, torch.ones_like(flat))
+    last = hist.gather(1, flat.max(dim=1, keepdim=True)[0])
+    step = (flat.shape[1] - last) // 255
+    lut = (step // 2 + hist.cumsum(dim=1) - hist) // step.clamp(min=1)
+    lut = lut.clamp_(max=255)
+    output = torch.where(step > 0, lut.gather(1, flat), flat)
+    return output.to(images.dtype).view_as(images)
+
+
+def invert(images, magnitude):
+    return 255 - images
+
+
+class BatchAugment(object):
+    """
+    Batched version of the `create_train_dataset` training transforms::
+
+        RandomResizedCrop(size, scale, ratio)
+        RandomHorizontalFlip()
+        ImageNetPolicy()  # optional
+        ToTensor()
+        Normalize(mean, std)
+
+    Takes the (images, sizes) batch created by :class:`DecodeToTensor`, a uint8
+    NxCxHxW batch and the Nx2 original (height, width) of the images, or just
+    the images when they were not resized, and returns the normalized float
+    batch, with shape NxRxCxSxS when `replicas_per_sample` R > 1, each replica
+    augmented independently.
+
+    The random parameters are drawn on the CPU, so the results do not depend on
+    the device used.
+
+    :param size: Output image size
+    :param scale: Range of the area of the random crop relative to the image
+    :param ratio: Range of the aspect ratio of the random crop
+    :param auto_augment: Whether to apply the `ImageNetPolicy` auto-augment
+    :param replicas_per_sample: Number of replicas to create per sample
+    :param mean: Normalization mean
+    :param std: Normalization standard deviation
+    :param seed: Random seed. Taken from the torch random generator when None
+    :param rank: Distributed rank mixed into the seed, so every replica draws
+                 different parameters. Defaults to the current process rank
+    """
+
+    def __init__(self, size=224, scale=(0.08, 1.0), ratio=(3. / 4., 4. / 3.),
+                 auto_augment=False, replicas_per_sample=1,
+                 mean=IMAGENET_MEAN, std=IMAGENET_STD, seed=None, rank=None):
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+        self.auto_augment = auto_augment
+        self.replicas_per_sample = replicas_per_sample
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+
+        if seed is None:
+            seed = int(torch.randint(2 ** 62, (1,)))
+        if rank is None:
+            distributed = dist.is_available() and dist.is_initialized()
+            rank = dist.get_rank() if distributed else 0
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed + rank)
+
+        # Sub-policy table of ImageNetPolicy: operation, probability and
+        # magnitude of both operations of every sub-policy
+        self.operations = {
+            "shear_x": shear_x, "shear_y": shear_y,
+            "translate_x": translate_x, "translate_y": translate_y,
+            "rotate": rotate, "color": color, "posterize": posterize,
+            "solarize": solarize, "contrast": contrast, "sharpness": sharpness,
+            "brightness": brightness, "autocontrast": autocontrast,
+            "equalize": equalize, "invert": invert,
+        }
+        names = list(self.operations.keys())
+        policies = ImageNetPolicy().policies
+        self._policy_ops = torch.tensor([
+            [names.index(p.op1name), names.index(p.op2name)] for p in policies])
+        self._policy_probs = torch.tensor([[p.p1, p.p2] for p in policies])
+        self._policy_magnitudes = torch.tensor(
+            [[float(p.magnitude1), float(p.magnitude2)] for p in policies])
+        self._signed_ops = torch.tensor([name in SIGNED_OPS for name in names])
+
+    def __call__(self, data):
+        sizes = None
+        if isinstance(data, (list, tuple)):
+            data, sizes = data
+        n, channels, height, width = data.shape
+        replicas = self.replicas_per_sample
+        images = data.float()
+        if replicas > 1:
+            images = images.repeat_interleave(replicas, dim=0)
+            if sizes is not None:
+                sizes = sizes.repeat_interleave(replicas, dim=0)
+
+        images = self.resized_crop_flip(images, sizes)
+        if self.auto_augment:
+            images = self.apply_policy(images)
+
+        mean = self.mean.to(images.device)
+        std = self.std.to(images.device)
+        images = images.div_(255).sub_(mean).div_(std)
+        if replicas > 1:
+            images = images.view(n, replicas, channels, self.size, self.size)
+        return images
+
+    def crop_params(self, n, height, width):
+        """
+        Same as `RandomResizedCrop.get_params` for `n` images at once.
+
+        :param height: Height of the images, int or tensor with one per image
+        :param width: Width of the images, int or tensor with one per image
+        :return: top, left, crop height and crop width of every image, on the
+                 device of `height`
+        """
+        g = self.generator
+        attempts = 10
+        height = torch.as_tensor(height, dtype=torch.float).expand(n)
+        width = torch.as_tensor(width, dtype=torch.float).expand(n)
+        device = height.device
+
+        # Draw on the CPU generator, then combine with the sizes on their device
+        scale = torch.empty(n, attempts).uniform_(*self.scale, generator=g)
+        log_ratio = (math.log(self.ratio[0]), math.log(self.ratio[1]))
+        aspect_ratio = torch.exp(
+            torch.empty(n, attempts).uniform_(*log_ratio, generator=g))
+        rand_top = torch.rand(n, generator=g).to(device)
+        rand_left = torch.rand(n, generator=g).to(device)
+
+        area = (height * width).unsqueeze(1)
+        target_area = area * scale.to(device)
+        aspect_ratio = aspect_ratio.to(device)
+        w = torch.round(torch.sqrt(target_area * aspect_ratio))
+        h = torch.round(torch.sqrt(target_area / aspect_ratio))
+
+        # Keep the first valid attempt
+        valid = ((w > 0) & (w <= width.unsqueeze(1))
+                 & (h > 0) & (h <= height.unsqueeze(1)))
+        first = valid.float().argmax(dim=1, keepdim=True)
+        w = w.gather(1, first).squeeze(1)
+        h = h.gather(1, first).squeeze(1)
+        top = torch.floor(rand_top * (height - h + 1))
+        left = torch.floor(rand_left * (width - w + 1))
+
+        # Fallback to central crop
+        in_ratio = width / height
+        narrow = in_ratio < min(self.ratio)
+        wide = in_ratio > max(self.ratio)
+        fallback_w = torch.where(wide, torch.round(height * max(self.ratio)), width)
+        fallback_h = torch.where(narrow, torch.round(width / min(self.ratio)), height)
+        found = valid.any(dim=1)
+        w = torch.where(found, w, fallback_w)
+        h = torch.where(found, h, fallback_h)
+        top = torch.where(found, top, torch.floor((height - fallback_h) / 2))
+        left = torch.where(found, left, torch.floor((width - fallback_w) / 2))
+        return top, left, h, w
+
+    def resized_crop_flip(self, images, sizes=None):
+        """
+        Random resized crop followed by a random horizontal flip, sampling
+        each crop bilinearly into the output size in a single pass.
+
+        :param sizes: Nx2 original (height, width) of the resized images. The
+                      crops are drawn in the original image coordinates
+        """
+        n, _, height, width = images.shape
+        if sizes is None:
+            top, left, h, w = self.crop_params(n, height, width)
+            scale_x = scale_y = 1.0
+        else:
+            sizes = sizes.to(images.device, torch.float)
+            top, left, h, w = self.crop_params(n, sizes[:, 0], sizes[:, 1])
+            # Map the crops to the resized image coordinates
+            scale_y = height / sizes[:, 0]
+            scale_x = width / sizes[:, 1]
+        flip = torch.rand(n, generator=self.generator).to(top.device) < 0.5
+
+        # Map the output pixel coordinates to the crop, mirrored when flipped
+        matrix_x = torch.where(flip, -w, w) * scale_x / self.size
+        offset_x = torch.where(flip, left + w, left) * scale_x
+        matrix_y = h * scale_y / self.size
+        offset_y = top * scale_y
+        zero = torch.zeros_like(top)
+        matrix = torch.stack(
+            (matrix_x, zero, offset_x, zero, matrix_y, offset_y), dim=1).view(n, 2, 3)
+        matrix = matrix.to(images.device)
+        images = _sample(images, matrix, (self.size, self.size))
+        return images.round_().clamp_(0, 255)
+
+    def apply_policy(self, images):
+        """
+        Apply a random `ImageNetPolicy` sub-policy to every image. Each operation
+        is applied at once to all the images selecting it.
+        """
+        g = self.generator
+        n = len(images)
+        policy = torch.randint(len(self._policy_ops), (n,), generator=g)
+        names = list(self.operations.keys())
+        for stage in range(2):
+            ops = self._policy_ops[policy, stage]
+            apply = torch.rand(n, generator=g) < self._policy_probs[policy, stage]
+            sign = torch.randint(2, (n,), generator=g).float() * 2 - 1
+            magnitude = self._policy_magnitudes[policy, stage]
+            magnitude = torch.where(self._signed_ops[ops], magnitude * sign, magnitude)
+            for op in torch.unique(ops[apply]).tolist():
+                idx = torch.nonzero(apply & (ops == op)).squeeze(1)
+                func = self.operations[names[op]]
+                idx_device = idx.to(images.device)
+                images[idx_device] = func(images[idx_device],
+                                          magnitude[idx].to(images.device))
+        return images
+
+    def __repr__(self):
+        return ("BatchAugment(size={}, auto_augment={}, "
+                "replicas_per_sample={})").format(
+                    self.size, self.auto_augment, self.replicas_per_sample)
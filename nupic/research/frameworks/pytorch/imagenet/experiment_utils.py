@@ -31,10 +31,13 @@ from torchvision.transforms import RandomResizedCrop
 from nupic.research.frameworks.pytorch.dataset_utils import (
     CachedDatasetFolder,
     HDF5Dataset,
+    ShardedDataset,
+    is_sharded_dataset,
 )
 from nupic.research.frameworks.pytorch.lr_scheduler import ComposedLRScheduler
 
 from .auto_augment import ImageNetPolicy
+from .batch_augment import DecodeToTensor
 
 IMAGENET_NUM_CLASSES = {
     10: [
@@ -66,17 +69,33 @@ IMAGENET_NUM_CLASSES = {
 }
 
 
+def _create_sharded_dataset(data_dir, root, num_classes, **kwargs):
+    """
+    Create a :class:`ShardedDataset`, using the fixed Imagenet classes if
+    a mapping is available for `num_classes`
+    """
+    if num_classes in IMAGENET_NUM_CLASSES:
+        kwargs.update(classes=IMAGENET_NUM_CLASSES[num_classes])
+    else:
+        kwargs.update(num_classes=num_classes)
+    return ShardedDataset(data_dir=data_dir, root=root, **kwargs)
+
+
 def create_train_dataset(data_dir, train_dir, num_classes=1000,
                          use_auto_augment=False, sample_transform=None,
-                         target_transform=None, replicas_per_sample=1):
+                         target_transform=None, replicas_per_sample=1,
+                         shuffle_buffer_size=10000, batch_size=1,
+                         batch_augment=False):
     """
     Configure Imagenet training dataset
 
-    Creates :class:`CachedDatasetFolder` :class:`HDF5Dataset` pre-configured
-    for the training cycle
+    Creates :class:`CachedDatasetFolder`, :class:`HDF5Dataset` or
+    :class:`ShardedDataset` pre-configured for the training cycle
 
-    :param data_dir: The directory or hdf5 file containing the dataset
-    :param train_dir: The directory or hdf5 group containing the training data
+    :param data_dir: The directory, hdf5 file or shard directory containing
+                     the dataset
+    :param train_dir: The directory, hdf5 group or shard group containing the
+                      training data
     :param num_classes: Limit the dataset size to the given number of classes
     :param sample_transform: List of transforms acting on the samples
                              to be added to the defaults below
@@ -84,10 +103,23 @@ def create_train_dataset(data_dir, train_dir, num_classes=1000,
     :param replicas_per_sample: Number of replicas to create per sample
                                 in the batch (each replica is transformed
                                 independently). Used in maxup.
-
-    :return: CachedDatasetFolder or HDF5Dataset
+    :param shuffle_buffer_size: Shuffle buffer size. Only used by
+                                :class:`ShardedDataset`
+    :param batch_size: Data loader batch size. Only used by
+                       :class:`ShardedDataset`
+    :param batch_augment: Whether to only decode the images into uint8 tensors
+                          and leave the augmentation to :class:`BatchAugment`.
+                          `use_auto_augment` and `replicas_per_sample` are
+                          then ignored and must be given to :class:`BatchAugment`
+
+    :return: CachedDatasetFolder, HDF5Dataset or ShardedDataset
     """
-    if use_auto_augment:
+    if batch_augment:
+        if sample_transform:
+            raise ValueError("sample_transform is not supported with batch_augment")
+        transform = DecodeToTensor()
+        replicas_per_sample = 1
+    elif use_auto_augment:
         transform = transforms.Compose(
             transforms=[
                 RandomResizedCrop(224),
@@ -129,6 +161,13 @@ def create_train_dataset(data_dir, train_dir, num_classes=1000,
                                   num_classes=num_classes, transform=transform,
                                   target_transform=target_transform,
                                   replicas_per_sample=replicas_per_sample)
+    elif is_sharded_dataset(data_dir, train_dir):
+        dataset = _create_sharded_dataset(data_dir, train_dir, num_classes,
+                                          transform=transform,
+                                          target_transform=target_transform,
+                                          replicas_per_sample=replicas_per_sample,
+                                          shuffle_buffer_size=shuffle_buffer_size,
+                                          batch_size=batch_size)
     else:
         dataset = CachedDatasetFolder(root=os.path.join(data_dir, train_dir),
                                       num_classes=num_classes, transform=transform,
@@ -136,17 +175,19 @@ def create_train_dataset(data_dir, train_dir, num_classes=1000,
     return dataset
 
 
-def create_validation_dataset(data_dir, val_dir, num_classes=1000):
+def create_validation_dataset(data_dir, val_dir, num_classes=1000, batch_size=1):
     """
     Configure Imagenet validation dataloader
 
-    Creates :class:`CachedDatasetFolder` or :class:`HDF5Dataset` pre-configured
-    for the validation cycle.
+    Creates :class:`CachedDatasetFolder`, :class:`HDF5Dataset` or
+    :class:`ShardedDataset` pre-configured for the validation cycle.
 
     :param data_dir: The directory or hdf5 file containing the dataset
     :param val_dir: The directory containing or hdf5 group the validation data
     :param num_classes: Limit the dataset size to the given number of classes
-    :return: CachedDatasetFolder or HDF5Dataset
+    :param batch_size: The data loader batch size, used by
+                       :class:`ShardedDataset`
+    :return: CachedDatasetFolder, HDF5Dataset or ShardedDataset
     """
 
     transform = transforms.Compose(
@@ -168,6 +209,11 @@ def create_validation_dataset(data_dir, val_dir, num_classes=1000):
         else:
             dataset = HDF5Dataset(hdf5_file=data_dir, root=val_dir,
                                   num_classes=num_classes, transform=transform)
+    elif is_sharded_dataset(data_dir, val_dir):
+        # Read the shards in order, splitting them among replicas without padding
+        dataset = _create_sharded_dataset(data_dir, val_dir, num_classes,
+                                          transform=transform, shuffle=False,
+                                          pad=False, batch_size=batch_size)
     else:
         dataset = CachedDatasetFolder(root=os.path.join(data_dir, val_dir),
                                       num_classes=num_classes, transform=transform)
@@ -22,8 +22,10 @@ import logging
 import multiprocessing
 import sys
 import time
+from collections.abc import Mapping
 from pprint import pformat
 
+import numpy as np
 import ray.services
 import ray.util.sgd.utils as ray_utils
 import torch
@@ -32,11 +34,12 @@ from torch.backends import cudnn
 from torch.nn import DataParallel
 from torch.nn.parallel import DistributedDataParallel
 from torch.optim.lr_scheduler import OneCycleLR
-from torch.utils.data import DataLoader, DistributedSampler
+from torch.utils.data import DataLoader, DistributedSampler, IterableDataset
 
 from nupic.research.frameworks.pytorch.distributed_sampler import (
     UnpaddedDistributedSampler,
 )
+from nupic.research.frameworks.pytorch.imagenet.batch_augment import BatchAugment
 from nupic.research.frameworks.pytorch.imagenet.experiment_utils import (
     create_lr_scheduler,
     create_optimizer,
@@ -48,10 +51,14 @@ from nupic.research.frameworks.pytorch.lr_scheduler import ComposedLRScheduler
 from nupic.research.frameworks.pytorch.model_utils import (
     deserialize_state_dict,
     evaluate_model,
+    load_flat_state_dict,
+    serialize_flat_state_dict,
     serialize_state_dict,
     set_random_seed,
     train_model,
 )
+from nupic.research.frameworks.pytorch.prefetch_loader import PrefetchLoader
+from nupic.research.frameworks.pytorch.step_timer import StepTimer
 
 try:
     from apex import amp
@@ -65,12 +72,40 @@ __all__ = ["ImagenetExperiment"]
 cudnn.benchmark = True
 
 
+def _copy_to_cpu(obj):
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        copy = type(obj)((k, _copy_to_cpu(v)) for k, v in obj.items())
+        if hasattr(obj, "_metadata"):
+            # Versions used by `load_state_dict`
+            copy._metadata = obj._metadata
+        return copy
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_copy_to_cpu(v) for v in obj)
+    return obj
+
+
 class ImagenetExperiment:
     """
     Experiment class used to train Sparse and dense versions of Resnet50 v1.5
     models on Imagenet dataset
     """
 
+    # Config keys not used to create the data loaders. The data loaders are
+    # kept by `reset_experiment` when only these keys change
+    MODEL_CONFIG_KEYS = frozenset([
+        "batch_norm_weight_decay", "batches_in_epoch", "bias_weight_decay",
+        "checkpoint_at_init", "checkpoint_file", "checkpoint_format",
+        "dist_url", "epochs", "epochs_to_validate", "evaluate_model_func",
+        "init_batch_norm", "launch_time", "local_dir", "log_format", "log_level",
+        "logdir", "loss_function", "lr_scheduler_args", "lr_scheduler_class",
+        "mixed_precision", "mixed_precision_args", "model_args", "model_class",
+        "name", "optimizer_args", "optimizer_class", "prefetch_batches",
+        "progress", "seed", "step_timing", "step_timing_cuda_sync",
+        "train_model_func",
+    ])
+
     def __init__(self):
         self.model = None
         self.optimizer = None
@@ -86,12 +121,15 @@ class ImagenetExperiment:
         self.mixed_precision = False
         self.rank = 0
         self.total_batches = 0
+        self.step_timer = None
         self.progress = False
         self.logger = None
         self.seed = 42
         self.launch_time = 0
         self.epochs_to_validate = []
         self.current_epoch = 0
+        self.checkpoint_format = "gzip"
+        self._dataloaders = None
 
     def setup_experiment(self, config):
         """
@@ -105,7 +143,11 @@ class ImagenetExperiment:
             - world_size: Total number of processes participating
             - rank: Rank of the current process
             - data: Dataset path
-            - train_dir: Dataset training data relative path
+            - train_dir: Dataset training data relative path. When `data` is a
+                         directory created by `convert_hdf5_to_shards`, the
+                         training data is streamed from packed shards
+            - shuffle_buffer_size: Shuffle buffer size used when streaming the
+                                   training data from packed shards
             - batch_size: Training batch size
             - val_dir: Dataset validation data relative path
             - val_batch_size: Validation batch size
@@ -147,6 +189,22 @@ class ImagenetExperiment:
             - replicas_per_sample: Number of replicas to create per sample in the batch.
                                    (each replica is transformed independently)
                                    Used in maxup.
+            - batch_augment: Whether to augment the training batches on the
+                             device with `BatchAugment` instead of per image in
+                             the data loader workers. Default: False
+            - prefetch_batches: Number of batches staged on the device ahead of
+                                the current batch, copied on a side CUDA stream.
+                                Wraps the loaders returned by
+                                `create_train_dataloader` and
+                                `create_validation_dataloader`, so overrides
+                                of these methods are prefetched too.
+                                See `PrefetchLoader`. Default: 0 (disabled)
+            - step_timing: Whether to record the data, forward, backward and
+                           optimizer time of every training batch. Histograms
+                           merged across processes are returned by `run_epoch`
+                           under "timing". See `StepTimer`. Default: False
+            - step_timing_cuda_sync: Whether to synchronize CUDA when timing
+                                     the training batches. Default: False
             - train_model_func: Optional user defined function to train the model,
                                 expected to behave similarly to `train_model`
                                 in terms of input parameters and return values
@@ -167,6 +225,11 @@ class ImagenetExperiment:
             - launch_time: time the config was created (via time.time). Used to report
                            wall clock time until the first batch is done.
                            Default: time.time() in this setup_experiment().
+            - checkpoint_format: Format used by `get_state` to serialize the model,
+                                 optimizer, etc. Either "gzip" (compressed pickle)
+                                 or "flat" (uncompressed, see
+                                 `serialize_flat_state_dict`). `set_state` reads
+                                 both. Default: "gzip"
         """
         # Configure logging related stuff
         log_format = config.get("log_format", logging.BASIC_FORMAT)
@@ -175,10 +238,12 @@ class ImagenetExperiment:
         console.setFormatter(logging.Formatter(log_format))
         self.logger = logging.getLogger(config.get("name", type(self).__name__))
         self.logger.setLevel(log_level)
-        self.logger.addHandler(console)
+        if not self.logger.handlers:
+            self.logger.addHandler(console)
         self.progress = config.get("progress", False)
         self.launch_time = config.get("launch_time", time.time())
         self.logdir = config.get("logdir", None)
+        self.checkpoint_format = config.get("checkpoint_format", "gzip")
 
         # Configure seed
         self.seed = config.get("seed", self.seed)
@@ -196,12 +261,17 @@ class ImagenetExperiment:
             dist_url = config.get("dist_url", "tcp://127.0.0.1:54321")
             backend = config.get("backend", "nccl")
             world_size = config.get("world_size", 1)
-            dist.init_process_group(
-                backend=backend,
-                init_method=dist_url,
-                rank=self.rank,
-                world_size=world_size,
-            )
+            # Keep the process group of a previous trial of the same size
+            if dist.is_initialized() and (dist.get_world_size() != world_size
+                                          or dist.get_rank() != self.rank):
+                dist.destroy_process_group()
+            if not dist.is_initialized():
+                dist.init_process_group(
+                    backend=backend,
+                    init_method=dist_url,
+                    rank=self.rank,
+                    world_size=world_size,
+                )
             # Only enable logs from first process
             self.logger.disabled = self.rank != 0
             self.progress = self.progress and self.rank == 0
@@ -262,12 +332,38 @@ class ImagenetExperiment:
 
         # CUDA runtime does not support the fork start method.
         # See https://pytorch.org/docs/stable/notes/multiprocessing.html
-        if torch.cuda.is_available():
+        if (torch.cuda.is_available()
+                and multiprocessing.get_start_method(allow_none=True) != "spawn"):
             multiprocessing.set_start_method("spawn")
 
-        # Configure data loaders
-        self.train_loader = self.create_train_dataloader(config)
-        self.val_loader = self.create_validation_dataloader(config)
+        # Configure data loaders, keeping the loaders of a previous trial with
+        # the same data configuration
+        dataloader_config = {
+            k: v for k, v in config.items() if k not in self.MODEL_CONFIG_KEYS
+        }
+        if (self._dataloaders is None
+                or self._dataloaders[0] != dataloader_config):
+            self._dataloaders = (dataloader_config,
+                                 self.create_train_dataloader(config),
+                                 self.create_validation_dataloader(config))
+        _, self.train_loader, self.val_loader = self._dataloaders
+
+        # Stage batches on the device ahead of time, augmenting them there
+        prefetch_batches = config.get("prefetch_batches", 0)
+        batch_augment = None
+        if config.get("batch_augment", False):
+            batch_augment = BatchAugment(
+                auto_augment=config.get("use_auto_augment", False),
+                replicas_per_sample=config.get("replicas_per_sample", 1),
+                rank=self.rank,
+            )
+        if prefetch_batches > 0 or batch_augment is not None:
+            self.train_loader = PrefetchLoader(
+                self.train_loader, self.device, num_prefetch=prefetch_batches,
+                transform=batch_augment)
+        if prefetch_batches > 0:
+            self.val_loader = PrefetchLoader(
+                self.val_loader, self.device, num_prefetch=prefetch_batches)
         self.total_batches = len(self.train_loader)
 
         # Configure learning rate scheduler
@@ -283,10 +379,31 @@ class ImagenetExperiment:
                 lr_scheduler_args=lr_scheduler_args,
                 steps_per_epoch=self.total_batches)
 
+        # Configure per batch timing
+        if config.get("step_timing", False):
+            self.step_timer = StepTimer(
+                cuda_sync=config.get("step_timing_cuda_sync", False))
+
         # Set train and validate methods.
         self.train_model = config.get("train_model_func", train_model)
         self.evaluate_model = config.get("evaluate_model_func", evaluate_model)
 
+    def reset_experiment(self, config):
+        """
+        Configure the experiment for a new trial, reusing this process. The data
+        loaders are kept when the new config only changes `MODEL_CONFIG_KEYS`,
+        and the distributed process group when the world size is the same.
+
+        :param config: Dictionary containing the configuration parameters. See
+                       `setup_experiment`
+        """
+        # Release the previous trial before creating the new model
+        self.model = None
+        self.optimizer = None
+        self.lr_scheduler = None
+        self.step_timer = None
+        self.setup_experiment(config)
+
     @classmethod
     def create_model(cls, config, device):
         """
@@ -327,8 +444,20 @@ class ImagenetExperiment:
             sample_transform=config.get("sample_transform", None),
             target_transform=config.get("target_transform", None),
             replicas_per_sample=config.get("replicas_per_sample", 1),
+            shuffle_buffer_size=config.get("shuffle_buffer_size", 10000),
+            batch_size=config.get("batch_size", 1),
+            batch_augment=config.get("batch_augment", False),
         )
 
+        if isinstance(dataset, IterableDataset):
+            # Shuffling and distributed sharding are handled by the dataset
+            return DataLoader(
+                dataset=dataset,
+                batch_size=config.get("batch_size", 1),
+                num_workers=config.get("workers", 0),
+                pin_memory=torch.cuda.is_available(),
+            )
+
         if config.get("distributed", False):
             sampler = DistributedSampler(dataset)
         else:
@@ -348,20 +477,30 @@ class ImagenetExperiment:
         This method is a classmethod so that it can be used directly by analysis
         tools, while also being easily overrideable.
         """
+        batch_size = config.get("val_batch_size", config.get("batch_size", 1))
         dataset = create_validation_dataset(
             data_dir=config["data"],
             val_dir=config.get("val_dir", "val"),
             num_classes=config.get("num_classes", 1000),
+            batch_size=batch_size,
         )
 
+        if isinstance(dataset, IterableDataset):
+            # Distributed sharding is handled by the dataset
+            return DataLoader(
+                dataset=dataset,
+                batch_size=batch_size,
+                num_workers=config.get("workers", 0),
+                pin_memory=torch.cuda.is_available(),
+            )
+
         if config.get("distributed", False):
             sampler = UnpaddedDistributedSampler(dataset, shuffle=False)
         else:
             sampler = None
         return DataLoader(
             dataset=dataset,
-            batch_size=config.get("val_batch_size",
-                                  config.get("batch_size", 1)),
+            batch_size=batch_size,
             shuffle=False,
             num_workers=config.get("workers", 0),
             sampler=sampler,
@@ -396,6 +535,10 @@ class ImagenetExperiment:
         return results
 
     def train_epoch(self):
+        # Only pass the timer when enabled to support custom `train_model_func`
+        kwargs = {}
+        if self.step_timer is not None:
+            kwargs.update(step_timer=self.step_timer)
         self.train_model(
             model=self.model,
             loader=self.train_loader,
@@ -405,19 +548,28 @@ class ImagenetExperiment:
             batches_in_epoch=self.batches_in_epoch,
             pre_batch_callback=self.pre_batch,
             post_batch_callback=self.post_batch,
+            **kwargs
         )
 
     def run_epoch(self):
         if -1 in self.epochs_to_validate and self.current_epoch == 0:
             self.logger.debug("Validating before any training:")
             self.validate()
+        if self.step_timer is not None:
+            self.step_timer.reset()
         self.pre_epoch()
         self.train_epoch()
         self.post_epoch()
         t1 = time.time()
         ret = self.validate()
+        if self.step_timer is not None:
+            ret.update(timing=self.step_timer.summary(
+                distributed=self.distributed, device=self.device))
 
         if self.rank == 0:
+            if isinstance(self.train_loader, PrefetchLoader):
+                self.logger.debug("train data wait time: %s",
+                                  self.train_loader.total_wait_time)
             self.logger.debug("validate time: %s", time.time() - t1)
             self.logger.debug("---------- End of run epoch ------------")
             self.logger.debug("")
@@ -426,7 +578,9 @@ class ImagenetExperiment:
         return ret
 
     def pre_epoch(self):
-        if self.distributed:
+        if isinstance(self.train_loader.dataset, IterableDataset):
+            self.train_loader.dataset.set_epoch(self.current_epoch)
+        elif self.distributed:
             self.train_loader.sampler.set_epoch(self.current_epoch)
 
     def pre_batch(self, model, batch_idx):
@@ -445,9 +599,11 @@ class ImagenetExperiment:
             total_batches = self.total_batches
             current_batch = batch_idx
             if self.distributed:
-                # Compute actual batch size from distributed sampler
-                total_batches *= self.train_loader.sampler.num_replicas
-                current_batch *= self.train_loader.sampler.num_replicas
+                # Compute actual batch size from the number of replicas. Sharded
+                # datasets are split by the dataset itself, without a sampler
+                num_replicas = dist.get_world_size()
+                total_batches *= num_replicas
+                current_batch *= num_replicas
             self.logger.debug("End of batch for rank: %s. Epoch: %s, Batch: %s/%s, "
                               "loss: %s, Learning rate: %s num_images: %s",
                               self.rank, self.current_epoch, current_batch,
@@ -469,62 +625,114 @@ class ImagenetExperiment:
     def loss_function(self, output, target, **kwargs):
         return self._loss_function(output, target, **kwargs)
 
+    def _state_dicts(self):
+        state = {
+            "current_epoch": self.current_epoch,
+            "model": self.model.module.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+        }
+        if self.lr_scheduler is not None:
+            state["lr_scheduler"] = self.lr_scheduler.state_dict()
+        if self.mixed_precision:
+            state["amp"] = amp.state_dict()
+        return state
+
     def get_state(self):
         """
         Get experiment serialized state as a dictionary of  byte arrays
         :return: dictionary with "model", "optimizer" and "lr_scheduler" states
         """
-        state = {
-            "current_epoch": self.current_epoch
-        }
+        return self.serialize_state(self._state_dicts(), self.checkpoint_format)
 
-        # Save state into a byte array to avoid ray's GPU serialization issues
-        # See https://github.com/ray-project/ray/issues/5519
-        with io.BytesIO() as buffer:
-            serialize_state_dict(buffer, self.model.module.state_dict())
-            state["model"] = buffer.getvalue()
-
-        with io.BytesIO() as buffer:
-            serialize_state_dict(buffer, self.optimizer.state_dict())
-            state["optimizer"] = buffer.getvalue()
+    def get_state_snapshot(self):
+        """
+        Get experiment state with its state dicts copied to the CPU but not
+        serialized, so it can be serialized with `serialize_state` while the
+        training continues
+        :return: dictionary with "model", "optimizer" and "lr_scheduler" state dicts
+        """
+        return _copy_to_cpu(self._state_dicts())
 
-        if self.lr_scheduler is not None:
-            with io.BytesIO() as buffer:
-                serialize_state_dict(buffer, self.lr_scheduler.state_dict())
-                state["lr_scheduler"] = buffer.getvalue()
+    @staticmethod
+    def serialize_state(state, checkpoint_format="gzip"):
+        """
+        Serialize the state dicts returned by `get_state_snapshot`
+        :param state: dictionary with "model", "optimizer" and "lr_scheduler" state
+                      dicts
+        :param checkpoint_format: See "checkpoint_format" in `setup_experiment`
+        :return: dictionary of byte arrays, as returned by `get_state`
+        """
+        if checkpoint_format == "flat":
+            serialize = serialize_flat_state_dict
+        else:
+            serialize = serialize_state_dict
 
-        if self.mixed_precision:
+        # Save state into a byte array to avoid ray's GPU serialization issues
+        # See https://github.com/ray-project/ray/issues/5519
+        serialized = {}
+        for name, value in state.items():
+            if name == "current_epoch":
+                serialized[name] = value
+                continue
             with io.BytesIO() as buffer:
-                serialize_state_dict(buffer, amp.state_dict())
-                state["amp"] = buffer.getvalue()
+                serialize(buffer, value)
+                serialized[name] = buffer.getvalue()
+        return serialized
 
-        return state
+    @staticmethod
+    def pack_state(state):
+        """
+        Decode the state returned by `get_state` into a single buffer in the flat
+        state dict format, so every process restoring the state maps the buffer
+        (i.e. from the ray object store) instead of decoding its own copy
+        :param state: dictionary of byte arrays returned by `get_state`
+        :return: numpy uint8 array accepted by `set_state`
+        """
+        decoded = {}
+        for name, value in state.items():
+            if isinstance(value, bytes):
+                with io.BytesIO(value) as buffer:
+                    value = deserialize_state_dict(buffer, "cpu")
+            decoded[name] = value
+        with io.BytesIO() as buffer:
+            serialize_flat_state_dict(buffer, decoded)
+            return np.frombuffer(buffer.getvalue(), dtype=np.uint8)
+
+    def _load_state_dict(self, value, copy=False):
+        if isinstance(value, bytes):
+            with io.BytesIO(value) as buffer:
+                return deserialize_state_dict(buffer, self.device)
+        if copy:
+            # The optimizer keeps CPU tensors of its state, i.e. the momentum
+            # buffers, which must not alias the shared packed state
+            return _copy_to_cpu(value)
+        return value
 
     def set_state(self, state):
         """
         Restore the experiment from the state returned by `get_state`
         :param state: dictionary with "model", "optimizer", "lr_scheduler", and "amp"
-                      states
+                      states, or the state packed by `pack_state`
         """
+        packed = not isinstance(state, Mapping)
+        if packed:
+            # Map the tensors of the packed state without copying them
+            state = load_flat_state_dict(state)
+
         if "model" in state:
-            with io.BytesIO(state["model"]) as buffer:
-                state_dict = deserialize_state_dict(buffer, self.device)
-            self.model.module.load_state_dict(state_dict)
+            self.model.module.load_state_dict(self._load_state_dict(state["model"]))
 
+        # Unlike the model, these states may be kept as they are loaded
         if "optimizer" in state:
-            with io.BytesIO(state["optimizer"]) as buffer:
-                state_dict = deserialize_state_dict(buffer, self.device)
-            self.optimizer.load_state_dict(state_dict)
+            self.optimizer.load_state_dict(
+                self._load_state_dict(state["optimizer"], copy=packed))
 
         if "lr_scheduler" in state:
-            with io.BytesIO(state["lr_scheduler"]) as buffer:
-                state_dict = deserialize_state_dict(buffer, self.device)
-            self.lr_scheduler.load_state_dict(state_dict)
+            self.lr_scheduler.load_state_dict(
+                self._load_state_dict(state["lr_scheduler"], copy=packed))
 
         if "amp" in state and amp is not None:
-            with io.BytesIO(state["amp"]) as buffer:
-                state_dict = deserialize_state_dict(buffer, self.device)
-            amp.load_state_dict(state_dict)
+            amp.load_state_dict(self._load_state_dict(state["amp"], copy=packed))
 
         if "current_epoch" in state:
             self.current_epoch = state["current_epoch"]
@@ -582,6 +790,7 @@ class ImagenetExperiment:
     def get_execution_order(cls):
         return dict(
             setup_experiment=["ImagenetExperiment.setup_experiment"],
+            reset_experiment=["ImagenetExperiment.reset_experiment"],
             create_model=["ImagenetExperiment.create_model"],
             create_train_dataloader=["ImagenetExperiment.create_train_dataloader"],
             create_validation_dataloader=[
@@ -22,6 +22,7 @@ import logging
 import os
 import pickle
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 
 import ray
@@ -85,9 +86,17 @@ class ImagenetTrainable(Trainable):
         # Try to recover a trial at least this many times
         self.max_retries = max(config.get("max_retries", 3), 0)
 
+        # Serialize and write the checkpoints in the background, see `_save`
+        self._async_checkpoint = config.get("async_checkpoint", False)
+        self._checkpoint_writer = ThreadPoolExecutor(max_workers=1)
+        self._pending_checkpoint = None
+        self._sync_checkpoint = False
+
         # Create ray remote workers
         self._create_workers(config)
+        self._setup_state(config)
 
+    def _setup_state(self, config):
         # Save initialized model
         if config.get("checkpoint_at_init", False):
             self.save()
@@ -102,6 +111,44 @@ class ImagenetTrainable(Trainable):
 
         self._first_run = True
 
+    def reset_config(self, new_config):
+        """
+        Reuse this trainable and its remote workers for a new trial when running
+        with `reuse_actors=True`. The workers are reset in place by
+        `reset_experiment`, keeping their data loaders and process group. A new
+        trainable is created instead when the number of workers, their resources
+        or the "experiment_class" change, or when the reset fails.
+        """
+        if not self.procs:
+            return False
+        self._wait_for_checkpoint()
+        resources = self._worker_resources(new_config)
+        if (resources != self._worker_resources(self.config)
+                or new_config["experiment_class"] != self.config["experiment_class"]):
+            return False
+
+        new_config["logdir"] = self.logdir
+        self._process_config(new_config)
+        status = []
+        for rank, w in enumerate(self.procs):
+            status.append(w.reset_experiment.remote(
+                self._worker_config(new_config, rank)))
+        if not ray_utils.check_for_failure(status):
+            self.logger.warning("Failed to reset workers")
+            self._kill_workers()
+            return False
+
+        # Start the new trial from the first iteration
+        self.config = new_config
+        self._iteration = 0
+        self._time_total = 0.0
+        self._time_since_restore = 0.0
+        self._iterations_since_restore = 0
+        self._restored = False
+        self._setup_state(new_config)
+        self.logger.debug(f"reset_config: {self._trial_info.trial_name}")
+        return True
+
     def _train(self):
         self.logger.debug(f"_train: {self._trial_info.trial_name}({self.iteration})")
         try:
@@ -157,14 +204,60 @@ class ImagenetTrainable(Trainable):
             # Stop on failures
             return True
 
-    def _save(self, _=None):
+    def _save(self, checkpoint_dir=None):
+        """
+        Save the state of the experiment. With "async_checkpoint", the state is
+        only copied to the CPU and the next epoch starts while the state is
+        serialized and written to "checkpoint" in `checkpoint_dir` in the
+        background. Restoring or saving again waits for the pending checkpoint
+        """
         self.logger.debug(f"_save: {self._trial_info.trial_name}({self.iteration})")
+        self._wait_for_checkpoint()
+
         # All models are synchronized. Just save the state of first model
+        if (self._async_checkpoint and not self._sync_checkpoint
+                and checkpoint_dir is not None):
+            with warn_if_slow("ImagenetExperiment.get_state_snapshot.remote"):
+                state = ray.get(self.procs[0].get_state_snapshot.remote())
+            checkpoint_path = os.path.join(checkpoint_dir, "checkpoint")
+            self._pending_checkpoint = self._checkpoint_writer.submit(
+                self._write_checkpoint, state, checkpoint_path)
+            return checkpoint_path
+
         with warn_if_slow("ImagenetExperiment.get_state.remote"):
             return ray.get(self.procs[0].get_state.remote())
 
+    def _write_checkpoint(self, state, checkpoint_path):
+        state = self.config["experiment_class"].serialize_state(
+            state, self.config.get("checkpoint_format", "gzip"))
+        with open(checkpoint_path + ".tmp", "wb") as f:
+            pickle.dump(state, f)
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+    def _wait_for_checkpoint(self):
+        if self._pending_checkpoint is not None:
+            pending, self._pending_checkpoint = self._pending_checkpoint, None
+            pending.result()
+
+    def save_to_object(self):
+        # The checkpoint is read right after saving it
+        self._sync_checkpoint = True
+        try:
+            return super().save_to_object()
+        finally:
+            self._sync_checkpoint = False
+
     def _restore(self, state):
-        # Restore the state to every process
+        self._wait_for_checkpoint()
+        if isinstance(state, str):
+            # Checkpoint path returned by `_save`
+            with open(state, "rb") as f:
+                state = pickle.load(f)
+
+        # Decode the state once into the shared memory object store. Every
+        # process maps it without copying and loads it into its model
+        with warn_if_slow("ImagenetExperiment.pack_state"):
+            state = self.config["experiment_class"].pack_state(state)
         state_id = ray.put(state)
         ray.get([w.set_state.remote(state_id) for w in self.procs])
 
@@ -173,9 +266,11 @@ class ImagenetTrainable(Trainable):
 
         self.logger.debug(f"_restore: {self._trial_info.trial_name}({self.iteration})")
 
-    def _create_workers(self, config):
+    @staticmethod
+    def _worker_resources(config):
         """
-        Create one ray remote process for each GPU/process
+        Number of distributed processes and the CPUs and GPUs of each process
+        :return: tuple (world_size, num_cpus, num_gpus)
         """
         num_gpus = config.get("num_gpus", 0)
         num_cpus = config.get("num_cpus", 1)
@@ -192,6 +287,21 @@ class ImagenetTrainable(Trainable):
             world_size = num_cpus
             # Assign one CPU per remote process
             num_cpus = 1
+        return world_size, num_cpus, num_gpus
+
+    def _worker_config(self, config, rank):
+        worker_config = copy.deepcopy(config)
+        worker_config["distributed"] = True
+        worker_config["dist_url"] = self._dist_url
+        worker_config["world_size"] = len(self.procs)
+        worker_config["rank"] = rank
+        return worker_config
+
+    def _create_workers(self, config):
+        """
+        Create one ray remote process for each GPU/process
+        """
+        world_size, num_cpus, num_gpus = self._worker_resources(config)
 
         self._process_config(config)
 
@@ -208,16 +318,12 @@ class ImagenetTrainable(Trainable):
             ip = ray.get(self.procs[0].get_node_ip.remote())
             port = ray.get(self.procs[0].get_free_port.remote())
             port = config.get("dist_port", port)
-            dist_url = "tcp://{}:{}".format(ip, port)
+            self._dist_url = "tcp://{}:{}".format(ip, port)
 
             # Configure each process in the group
             status = []
             for rank, w in enumerate(self.procs):
-                worker_config = copy.deepcopy(config)
-                worker_config["distributed"] = True
-                worker_config["dist_url"] = dist_url
-                worker_config["world_size"] = world_size
-                worker_config["rank"] = rank
+                worker_config = self._worker_config(config, rank)
                 status.append(w.setup_experiment.remote(worker_config))
                 self.logger.debug(
                     f"_create_workers: rank={rank}, "
@@ -251,6 +357,8 @@ class ImagenetTrainable(Trainable):
 
     def _stop(self):
         self.logger.debug(f"_stop: {self._trial_info.trial_name}({self.iteration})")
+        self._wait_for_checkpoint()
+        self._checkpoint_writer.shutdown()
         try:
             status = [w.stop_experiment.remote() for w in self.procs]
             # wait until all remote workers stop
@@ -54,14 +54,16 @@ class ComplexLoss(object):
                     "Mixed precision requires NVIDA APEX."
                     "Please install apex from https://www.github.com/nvidia/apex")
 
-        t0 = time.time()
+        step_timer = self.step_timer
+        now = time.time if step_timer is None else step_timer.now
+        t0 = now()
         for batch_idx, (data, target) in enumerate(self.train_loader):
             if batch_idx >= self.batches_in_epoch:
                 break
 
             num_images = len(target)
             data = data.to(self.device, non_blocking=async_gpu)
-            t1 = time.time()
+            t1 = now()
 
             if pre_batch_callback is not None:
                 pre_batch_callback(model=self.model, batch_idx=batch_idx)
@@ -71,16 +73,16 @@ class ComplexLoss(object):
             loss, output = self.calculate_batch_loss(data, target, async_gpu=async_gpu)
             del output
 
-            t2 = time.time()
+            t2 = now()
             if use_amp:
                 with amp.scale_loss(loss, self.optimizer) as scaled_loss:
                     scaled_loss.backward()
             else:
                 loss.backward()
 
-            t3 = time.time()
+            t3 = now()
             self.optimizer.step()
-            t4 = time.time()
+            t4 = now()
 
             if post_batch_callback is not None:
                 time_string = ("Data: {:.3f}s, forward: {:.3f}s, backward: {:.3f}s,"
@@ -89,8 +91,10 @@ class ComplexLoss(object):
                 post_batch_callback(model=self.model, loss=loss.detach(),
                                     batch_idx=batch_idx, num_images=num_images,
                                     time_string=time_string)
+            if step_timer is not None:
+                step_timer.record(num_images, t1 - t0, t2 - t1, t3 - t2, t4 - t3)
             del loss
-            t0 = time.time()
+            t0 = now()
 
     def calculate_batch_loss(self, data, target, async_gpu=True):
         """
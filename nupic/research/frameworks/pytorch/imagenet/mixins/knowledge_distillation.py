@@ -19,8 +19,21 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn.functional as F
+from torch.utils.data import DataLoader, IterableDataset, Subset
+
+from nupic.research.frameworks.pytorch.dataset_utils import IndexedDataset
+from nupic.research.frameworks.pytorch.imagenet.auto_augment import ImageNetPolicy
 
 
 class KnowledgeDistillation(object):
@@ -42,6 +55,33 @@ class KnowledgeDistillation(object):
                              based on initial kd_factor_init and kd_factor_end.
                              Value should be float between 0 and 1.
                              If None, no decay is applied. Defaults to None.
+            - kd_cache_dir: Directory of a memory mapped cache of the teacher
+                            softmax of each training sample. Samples found in
+                            the cache skip the teacher forward pass. The cache
+                            is filled lazily on the first epoch and reused by
+                            later epochs and experiments using the same
+                            dataset. The teacher, classes and dataset are
+                            stored with the cache, which refuses to open for
+                            a different one. The teacher softmax is cached
+                            for the augmentation drawn on the first epoch and
+                            reused by every later epoch, trading the teacher
+                            forward pass for targets that no longer match the
+                            random crops and flips the student sees. A warning
+                            is logged when the training data is randomly
+                            augmented. If None, the cache is disabled.
+                            Defaults to None.
+            - kd_cache_augmented: Whether the cache is intentionally used with
+                                  randomly augmented training data, silencing
+                                  the warning above. Defaults to False.
+            - kd_cache_top_k: Number of teacher probabilities kept per sample,
+                              the remaining probability is spread uniformly
+                              over the other classes. Defaults to 10.
+            - kd_cache_warmup_workers: Number of processes filling the cache
+                                       before training. If 0, the cache is only
+                                       filled lazily. Defaults to 0.
+            - kd_cache_warmup_devices: List of devices used by the warm-up
+                                       processes, assigned round robin.
+                                       Defaults to the experiment device.
         """
         super().setup_experiment(config)
 
@@ -67,6 +107,72 @@ class KnowledgeDistillation(object):
             self.kd_factor = self.kd_factor_init
         self.logger.info(f"KD factor: {self.kd_factor_init} {self.kd_factor_end}")
 
+        # Teacher softmax cache
+        self.teacher_cache = None
+        cache_dir = config.get("kd_cache_dir", None)
+        if cache_dir is not None:
+            dataset = self.train_loader.dataset
+            if not isinstance(dataset, IndexedDataset):
+                raise ValueError("kd_cache_dir requires an IndexedDataset")
+            random_transforms = _random_transforms(
+                getattr(dataset.dataset, "transform", None))
+            if config.get("batch_augment", False):
+                random_transforms.append("BatchAugment")
+            if random_transforms and not config.get("kd_cache_augmented", False):
+                self.logger.warning(
+                    "KD teacher cache used with random augmentation "
+                    f"{random_transforms}: cached teacher targets only match "
+                    "the augmentation of the first epoch. Set "
+                    "kd_cache_augmented=True to silence this warning")
+            classes = (getattr(dataset.dataset, "classes", None)
+                       or getattr(dataset.dataset, "_classes", None))
+            metadata = dict(
+                teacher=_teacher_identity(teacher_model_class),
+                classes=list(classes) if classes is not None else None,
+                dataset=_dataset_fingerprint(dataset.dataset),
+            )
+            cache_args = dict(path=cache_dir, num_samples=len(dataset),
+                              num_classes=config.get("num_classes", 1000),
+                              top_k=config.get("kd_cache_top_k", 10),
+                              metadata=metadata)
+            # The first process creates the cache and warms it up
+            if self.rank == 0:
+                self.teacher_cache = TeacherCache(**cache_args)
+                num_workers = config.get("kd_cache_warmup_workers", 0)
+                if num_workers > 0:
+                    warm_up_teacher_cache(
+                        teacher_model_class, dataset.dataset, cache_args,
+                        num_workers=num_workers,
+                        batch_size=config.get("batch_size", 1),
+                        devices=config.get("kd_cache_warmup_devices",
+                                           [str(self.device)]))
+            if self.distributed:
+                dist.barrier()
+            if self.rank != 0:
+                self.teacher_cache = TeacherCache(**cache_args)
+            self.logger.info(f"KD teacher cache: {cache_dir}, "
+                             f"{self.teacher_cache.num_cached()} cached samples")
+
+    @classmethod
+    def create_train_dataloader(cls, config):
+        """
+        Add the sample indices to the targets when the teacher cache is enabled
+        """
+        loader = super().create_train_dataloader(config)
+        if config.get("kd_cache_dir", None) is None:
+            return loader
+
+        if isinstance(loader.dataset, IterableDataset):
+            raise ValueError("kd_cache_dir requires a map-style dataset")
+        return DataLoader(
+            dataset=IndexedDataset(loader.dataset),
+            batch_size=loader.batch_size,
+            sampler=loader.sampler,
+            num_workers=loader.num_workers,
+            pin_memory=loader.pin_memory,
+            drop_last=loader.drop_last,
+        )
+
     def _train_model(self):
         """Private train model that has access to Experiment attributes
         """
@@ -87,11 +193,17 @@ class KnowledgeDistillation(object):
         :param async_gpu: define whether or not to use
                           asynchronous GPU copies when the memory is pinned
         """
+        if self.teacher_cache is not None:
+            target, indices = target[:, 0], target[:, 1]
+
         # knowlege distillation training
         output = self.model(data)
         with torch.no_grad():
             # target is linear combination of teacher and target softmaxes
-            softmax_output_teacher = F.softmax(self.teacher_model(data))
+            if self.teacher_cache is not None:
+                softmax_output_teacher = self.cached_teacher_softmax(data, indices)
+            else:
+                softmax_output_teacher = F.softmax(self.teacher_model(data))
             if self.kd_factor < 1:
                 target = target.to(self.device, non_blocking=async_gpu)
                 one_hot_target = F.one_hot(target, num_classes=output.shape[-1])
@@ -106,10 +218,27 @@ class KnowledgeDistillation(object):
         del softmax_output_teacher, combined_target
         return loss, output
 
+    def cached_teacher_softmax(self, data, indices):
+        """
+        Teacher softmax read from the cache when all the samples are cached,
+        otherwise computed by the teacher and added to the cache
+        """
+        indices = indices.cpu()
+        cached = self.teacher_cache.is_cached(indices)
+        if cached.all():
+            return self.teacher_cache.get(indices, device=self.device)
+
+        softmax = F.softmax(self.teacher_model(data), dim=1)
+        missing = torch.from_numpy(~cached)
+        self.teacher_cache.put(indices[missing], softmax[missing.to(self.device)])
+        return softmax
+
     @classmethod
     def get_execution_order(cls):
         eo = super().get_execution_order()
         eo["setup_experiment"].append("Knowledge Distillation initialization")
+        eo["create_train_dataloader"].append(
+            "KnowledgeDistillation add indices to targets")
         eo["calculate_batch_loss"] = [
             "KnowledgeDistillation.calculate_batch_loss"
         ]
@@ -117,6 +246,186 @@ class KnowledgeDistillation(object):
         return eo
 
 
+class TeacherCache(object):
+    """
+    Memory mapped cache of the teacher softmax of each sample of a dataset,
+    keeping the `top_k` largest probabilities and spreading the remaining
+    probability uniformly over the other classes. The cache is stored in
+    `path` as numpy files, shared by all the processes opening it, along with
+    a `metadata.json` file describing the teacher and the dataset.
+
+    :param path: Cache directory, created if needed
+    :param num_samples: Number of samples in the dataset
+    :param num_classes: Number of classes predicted by the teacher
+    :param top_k: Number of probabilities kept per sample
+    :param metadata: JSON serializable dictionary identifying the teacher and
+                     the dataset. Opening an existing cache with different
+                     metadata raises a ValueError
+    """
+
+    def __init__(self, path, num_samples, num_classes, top_k=10, metadata=None):
+        self.path = path
+        self.num_samples = num_samples
+        self.num_classes = num_classes
+        self.top_k = min(top_k, num_classes)
+        self.metadata = dict(metadata or {}, num_samples=num_samples,
+                             num_classes=num_classes, top_k=self.top_k)
+        # Compare the metadata as read back from the json file
+        self.metadata = json.loads(json.dumps(self.metadata))
+
+        os.makedirs(path, exist_ok=True)
+        filename = os.path.join(path, "metadata.json")
+        if os.path.exists(filename):
+            with open(filename) as f:
+                cached_metadata = json.load(f)
+            if cached_metadata != self.metadata:
+                raise ValueError(f"{path} was created for a different teacher or "
+                                 f"dataset: {cached_metadata}. Remove it or use "
+                                 "another cache directory")
+        else:
+            with open(filename, "w") as f:
+                json.dump(self.metadata, f, indent=2)
+
+        shapes = dict(
+            probs=((num_samples, self.top_k), np.float16),
+            classes=((num_samples, self.top_k), np.int32),
+            cached=((num_samples,), np.bool_),
+        )
+        self.arrays = {}
+        for name, (shape, dtype) in shapes.items():
+            filename = os.path.join(path, f"{name}.npy")
+            if os.path.exists(filename):
+                array = np.load(filename, mmap_mode="r+")
+                if array.shape != shape or array.dtype != dtype:
+                    raise ValueError(f"{filename} does not match the dataset: "
+                                     f"{array.shape} {array.dtype}")
+            else:
+                array = np.lib.format.open_memmap(filename, mode="w+",
+                                                  dtype=dtype, shape=shape)
+            self.arrays[name] = array
+
+    def num_cached(self):
+        return int(self.arrays["cached"].sum())
+
+    def is_cached(self, indices):
+        """
+        :return: numpy boolean array, True for the cached samples
+        """
+        return np.asarray(self.arrays["cached"][indices.cpu().numpy()])
+
+    def get(self, indices, device):
+        """
+        :return: teacher softmax of the given samples on the device
+        """
+        indices = indices.cpu().numpy()
+        probs = np.asarray(self.arrays["probs"][indices], dtype=np.float32)
+        classes = np.asarray(self.arrays["classes"][indices], dtype=np.int64)
+        probs = torch.from_numpy(probs)
+        classes = torch.from_numpy(classes)
+        probs = probs.to(device, non_blocking=True)
+        classes = classes.to(device, non_blocking=True)
+
+        num_others = max(self.num_classes - self.top_k, 1)
+        others = (1 - probs.sum(dim=1, keepdim=True)).clamp(min=0) / num_others
+        softmax = others.expand(len(indices), self.num_classes).clone()
+        return softmax.scatter_(1, classes, probs)
+
+    def put(self, indices, softmax):
+        """
+        Add the teacher softmax of the given samples to the cache
+        """
+        probs, classes = softmax.topk(self.top_k, dim=1)
+        indices = indices.cpu().numpy()
+        self.arrays["probs"][indices] = probs.cpu().numpy()
+        self.arrays["classes"][indices] = classes.cpu().numpy()
+        self.arrays["cached"][indices] = True
+
+
+def _teacher_identity(teacher_model_class):
+    """
+    Name of the teacher model class, with the arguments of partial functions
+    """
+    if isinstance(teacher_model_class, functools.partial):
+        return dict(
+            func=_teacher_identity(teacher_model_class.func),
+            args=repr(teacher_model_class.args),
+            keywords=repr(sorted(teacher_model_class.keywords.items())),
+        )
+    module = getattr(teacher_model_class, "__module__", None)
+    name = getattr(teacher_model_class, "__qualname__", repr(teacher_model_class))
+    return f"{module}.{name}"
+
+
+def _dataset_fingerprint(dataset):
+    """
+    Hash of the sample list of the dataset, or None when it is not available
+    """
+    samples = getattr(dataset, "samples", None) or getattr(dataset, "_images", None)
+    if samples is None:
+        return None
+    return hashlib.sha1(repr(samples).encode()).hexdigest()
+
+
+def _random_transforms(transform):
+    """
+    Names of the random augmentation transforms found in `transform`
+    """
+    if transform is None:
+        return []
+    if hasattr(transform, "transforms"):
+        return [name for t in transform.transforms for name in _random_transforms(t)]
+    name = type(transform).__name__
+    if name.startswith("Random") or isinstance(transform, ImageNetPolicy):
+        return [name]
+    return []
+
+
+def _warm_up_teacher_cache(teacher_model_class, dataset, indices, cache_args,
+                           batch_size, device):
+    cache = TeacherCache(**cache_args)
+    teacher_model = teacher_model_class()
+    teacher_model.eval()
+    teacher_model.to(device)
+    loader = DataLoader(Subset(dataset, indices), batch_size=batch_size)
+    start = 0
+    with torch.no_grad():
+        for data, _ in loader:
+            softmax = F.softmax(teacher_model(data.to(device)), dim=1)
+            cache.put(torch.as_tensor(indices[start:start + len(data)]), softmax)
+            start += len(data)
+    for array in cache.arrays.values():
+        array.flush()
+    return start
+
+
+def warm_up_teacher_cache(teacher_model_class, dataset, cache_args, num_workers,
+                          batch_size, devices=("cpu",)):
+    """
+    Fill the teacher cache with the samples not cached yet, splitting them
+    among `num_workers` processes, each running its own copy of the teacher
+
+    :param teacher_model_class: Class of the teacher model
+    :param dataset: Dataset returning (data, target), without indices
+    :param cache_args: :class:`TeacherCache` arguments
+    :param num_workers: Number of processes
+    :param batch_size: Teacher batch size
+    :param devices: Devices used by the processes, assigned round robin
+    :return: Number of samples added to the cache
+    """
+    cache = TeacherCache(**cache_args)
+    missing = np.flatnonzero(~cache.arrays["cached"])
+    chunks = [c for c in np.array_split(missing, num_workers) if len(c) > 0]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(num_workers, mp_context=context) as executor:
+        futures = [
+            executor.submit(_warm_up_teacher_cache, teacher_model_class, dataset,
+                            chunk, cache_args, batch_size,
+                            devices[i % len(devices)])
+            for i, chunk in enumerate(chunks)
+        ]
+        return sum(f.result() for f in futures)
+
+
 def soft_cross_entropy(output, target, size_average=True):
     """ Cross entropy that accepts soft targets
     Args:
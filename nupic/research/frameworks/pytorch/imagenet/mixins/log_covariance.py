@@ -19,13 +19,19 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
-import torch
+from torch.nn import DataParallel
+from torch.nn.parallel import DistributedDataParallel
+
+from nupic.research.frameworks.pytorch.streaming_covariance import (
+    StreamingCovariance,
+)
 
 
 class LogCovariance(object):
     """
     During testing, record the covariance of unit activations within each
-    specified layer.
+    specified layer. The covariance is accumulated batch by batch on the device
+    and merged across the distributed processes.
     """
     def setup_experiment(self, config):
         super().setup_experiment(config)
@@ -33,31 +39,35 @@ class LogCovariance(object):
                                                     ())
 
     def validate(self, *args, **kwargs):
-        activations = {layername: []
+        covariances = {layername: StreamingCovariance()
                        for layername in self.log_covariance_layernames}
 
         def accumulator(layername):
             def accumulate_activation(module, x, y):
-                activations[layername].append(y)
+                covariances[layername].update(y)
 
             return accumulate_activation
 
-        hooks = [getattr(self.module, layername)
+        model = self.model
+        if isinstance(model, (DataParallel, DistributedDataParallel)):
+            model = model.module
+        hooks = [getattr(model, layername)
                  .register_forward_hook(accumulator(layername))
                  for layername in self.log_covariance_layernames]
         result = super().validate(*args, **kwargs)
         for hook in hooks:
             hook.remove()
 
-        for layername, layer_activations in activations.items():
-            H = torch.cat(layer_activations) # NOQA N806
-            H -= torch.mean(H, dim=0)
-            cov = H.t().mm(H) / H.shape[0]
+        for layername, covariance in covariances.items():
+            if self.distributed:
+                covariance.merge_distributed(self.device)
+            if covariance.count == 0:
+                # i.e. epochs without validation
+                continue
+            cov = covariance.covariance()
             var = cov.diag()
-            # Mask out the diagonal
-            cov *= (1 - torch.eye(cov.shape[0]).to(self.device))
             result["{}/covariance_sum_of_squares".format(layername)] = \
-                (cov.pow(2).sum() / 2).item()
+                ((cov.pow(2).sum() - var.pow(2).sum()) / 2).item()
             result["{}/variance_sum".format(layername)] = var.sum().item()
 
         return result
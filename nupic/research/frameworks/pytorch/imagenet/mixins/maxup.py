@@ -34,6 +34,21 @@ class MaxupStandard(object):
 
     Requires ComplexLoss Mixin
     """
+    def setup_experiment(self, config):
+        """
+        :param config:
+            - maxup_batched: Whether to score all the replicas in a single
+                             inference pass selecting the worst replica on the
+                             device, without synchronizing with the host.
+                             Default: False
+            - maxup_chunk_size: Number of replicas scored per inference pass in
+                                batched mode, bounding the memory used by the
+                                scoring. Default: None (all replicas)
+        """
+        super().setup_experiment(config)
+        self.maxup_batched = config.get("maxup_batched", False)
+        self.maxup_chunk_size = config.get("maxup_chunk_size", None)
+
     def calculate_batch_loss(self, data, target, async_gpu=True):
         """
         :param data: input to the training function, as specified by dataloader
@@ -47,6 +62,18 @@ class MaxupStandard(object):
 
         target = target.to(self.device, non_blocking=async_gpu)
 
+        if self.maxup_batched:
+            losses = replica_losses(self.model, data, target,
+                                    chunk_size=self.maxup_chunk_size)
+            # choose the replica with max mean loss on the device
+            max_loss_dim = torch.argmax(losses.mean(dim=1))
+            data_variant = data.index_select(1, max_loss_dim.view(1)).squeeze(1)
+            output = self.model(data_variant)
+            loss = self.loss_function(output, target)
+
+            del data, data_variant, target, losses, max_loss_dim
+            return loss, output
+
         # calculate loss for all the different variants of the batch
         losses = []
         replicas_per_sample = data.shape[1]
@@ -70,6 +97,7 @@ class MaxupStandard(object):
     @classmethod
     def get_execution_order(cls):
         eo = super().get_execution_order()
+        eo["setup_experiment"].append("MaxupStandard initialization")
         eo["calculate_batch_loss"] = ["MaxupStandard.calculate_batch_loss"]
         return eo
 
@@ -85,6 +113,21 @@ class MaxupPerSample(object):
 
     Requires ComplexLoss Mixin
     """
+    def setup_experiment(self, config):
+        """
+        :param config:
+            - maxup_batched: Whether to score all the replicas in a single
+                             inference pass selecting the worst replica on the
+                             device, without synchronizing with the host.
+                             Default: False
+            - maxup_chunk_size: Number of replicas scored per inference pass in
+                                batched mode, bounding the memory used by the
+                                scoring. Default: None (all replicas)
+        """
+        super().setup_experiment(config)
+        self.maxup_batched = config.get("maxup_batched", False)
+        self.maxup_chunk_size = config.get("maxup_chunk_size", None)
+
     def calculate_batch_loss(self, data, target, async_gpu=True):
         """
         :param data: input to the training function, as specified by dataloader
@@ -98,6 +141,19 @@ class MaxupPerSample(object):
 
         target = target.to(self.device, non_blocking=async_gpu)
 
+        if self.maxup_batched:
+            losses = replica_losses(self.model, data, target,
+                                    chunk_size=self.maxup_chunk_size)
+            # choose the replica with max loss of each sample on the device
+            max_indices = torch.argmax(losses, dim=0)
+            samples = torch.arange(len(target), device=max_indices.device)
+            data_variant = data[samples, max_indices]
+            output = self.model(data_variant)
+            loss = self.loss_function(output, target)
+
+            del data, data_variant, target, losses, max_indices, samples
+            return loss, output
+
         # calculate loss for all the tranformed versions of the image
         losses = []
         one_hot_target = None
@@ -127,6 +183,7 @@ class MaxupPerSample(object):
     @classmethod
     def get_execution_order(cls):
         eo = super().get_execution_order()
+        eo["setup_experiment"].append("MaxupPerSample initialization")
         eo["calculate_batch_loss"] = ["MaxupPerSample.calculate_batch_loss"]
         return eo
 
@@ -138,3 +195,30 @@ def sample_cross_entropy(output, target):
     :return: cross entropy per sample, not aggregated
     """
     return torch.sum(-target * F.log_softmax(output), dim=1)
+
+
+def replica_losses(model, data, target, chunk_size=None):
+    """ Cross entropy of every replica of every sample, computed without
+    gradients in one inference pass over all the replicas, or in passes of
+    `chunk_size` replicas to bound the memory used. Stays on the device.
+    :param model: model to score
+    :param data: batch of shape (batch size, replicas per sample, ...)
+    :param target: targets of shape (batch size,)
+    :param chunk_size: number of replicas per inference pass. Default: all
+    :return: losses of shape (replicas per sample, batch size)
+    """
+    batch_size, replicas_per_sample = data.shape[:2]
+    chunk_size = chunk_size or replicas_per_sample
+    losses = []
+    one_hot_target = None
+    with torch.no_grad():
+        for start in range(0, replicas_per_sample, chunk_size):
+            # replica major order, matching the repeated targets
+            chunk = data[:, start:start + chunk_size].transpose(0, 1)
+            num_replicas = chunk.shape[0]
+            output = model(chunk.reshape(-1, *data.shape[2:]))
+            if one_hot_target is None:
+                one_hot_target = F.one_hot(target, num_classes=output.shape[-1])
+            loss = sample_cross_entropy(output, one_hot_target.repeat(num_replicas, 1))
+            losses.append(loss.view(num_replicas, batch_size))
+    return torch.cat(losses)
@@ -23,42 +23,117 @@ import cProfile
 import os
 import pstats
 
+from nupic.research.frameworks.pytorch.sampling_profiler import SamplingProfiler
+
 
 class Profile:
     """
-    Save cProfile traces for initialization and each run_epoch.
+    Save cProfile traces for initialization and each run_epoch, or sample the
+    stack with the low overhead :class:`SamplingProfiler` and save Chrome traces
+    with every training batch tagged with its epoch and batch index.
+
+    Only a window of the training batches is profiled when "num_batches" is
+    given. The traces are saved to `logdir` on rank 0.
     """
     def setup_experiment(self, config):
-        self.use_cProfile = (self.rank == 0)
-        if self.use_cProfile:
-            pr = cProfile.Profile()
-            pr.enable()
+        """
+        :param config:
+            - profile_args: Profiling configuration:
+                - mode: "cprofile" to trace every call with cProfile or
+                        "sampling" to sample the stack. Default: "cprofile"
+                - epochs_interval: Only profile every `epochs_interval` epochs.
+                                   Default: 1
+                - skip_batches: Number of training batches to skip before
+                                profiling when `num_batches` is set. Default: 0
+                - num_batches: Number of training batches to profile. When
+                               None, profile the whole `run_epoch`, including
+                               validation. Default: None
+                - sampling_interval: Seconds between samples of the "sampling"
+                                     mode. Default: 0.005
+                - profile_initialization: Whether to profile `setup_experiment`.
+                                          Default: True
+        """
+        profile_args = config.get("profile_args", {})
+        self.profile_mode = profile_args.get("mode", "cprofile")
+        if self.profile_mode not in ("cprofile", "sampling"):
+            raise ValueError(f"Unknown profile mode: {self.profile_mode}")
+        self.profile_epochs_interval = profile_args.get("epochs_interval", 1)
+        self.profile_skip_batches = profile_args.get("skip_batches", 0)
+        self.profile_num_batches = profile_args.get("num_batches", None)
+        self.profile_sampling_interval = profile_args.get("sampling_interval",
+                                                          0.005)
+        self.profiler = None
+        self.profile_epoch = False
+
+        # Only profile from rank 0
+        self.use_profile = (config.get("rank", 0) == 0)
+        profile_initialization = profile_args.get("profile_initialization", True)
+        if self.use_profile and profile_initialization:
+            self._start_profile()
 
         super().setup_experiment(config)
 
-        if self.use_cProfile:
-            pr.disable()
-            filepath = os.path.join(self.logdir,
-                                    f"profile-initialization.profile")
-            pstats.Stats(pr).dump_stats(filepath)
-            self.logger.info(f"Saved {filepath}")
+        if self.profiler is not None:
+            self._stop_profile("profile-initialization")
+
+    def _start_profile(self):
+        if self.profile_mode == "sampling":
+            self.profiler = SamplingProfiler(self.profile_sampling_interval)
+            self.profiler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def _stop_profile(self, name):
+        if self.profile_mode == "sampling":
+            self.profiler.stop()
+            filepath = os.path.join(self.logdir, f"{name}.json")
+            self.profiler.export_chrome_trace(filepath)
+        else:
+            self.profiler.disable()
+            filepath = os.path.join(self.logdir, f"{name}.profile")
+            pstats.Stats(self.profiler).dump_stats(filepath)
+        self.profiler = None
+        self.logger.info(f"Saved {filepath}")
 
     def run_epoch(self):
-        if self.use_cProfile:
-            pr = cProfile.Profile()
-            pr.enable()
+        self.profile_epoch = (
+            self.use_profile
+            and self.current_epoch % self.profile_epochs_interval == 0
+        )
+        if self.profile_epoch and self.profile_num_batches is None:
+            self._start_profile()
 
         result = super().run_epoch()
 
-        if self.use_cProfile:
-            pr.disable()
-            filepath = os.path.join(self.logdir,
-                                    f"profile-epoch{self.current_epoch}.profile")
-            pstats.Stats(pr).dump_stats(filepath)
-            self.logger.info(f"Saved {filepath}")
+        if self.profiler is not None:
+            self._stop_profile(f"profile-epoch{self.current_epoch}")
+        self.profile_epoch = False
 
         return result
 
+    def pre_batch(self, model, batch_idx):
+        if (self.profile_epoch and self.profile_num_batches is not None
+                and batch_idx == self.profile_skip_batches):
+            self._start_profile()
+        if isinstance(self.profiler, SamplingProfiler):
+            self.profiler.begin_step(
+                f"epoch {self.current_epoch} batch {batch_idx}",
+                epoch=self.current_epoch, batch=batch_idx)
+
+        super().pre_batch(model=model, batch_idx=batch_idx)
+
+    def post_batch(self, model, loss, batch_idx, num_images, time_string):
+        super().post_batch(model=model, loss=loss, batch_idx=batch_idx,
+                           num_images=num_images, time_string=time_string)
+
+        if isinstance(self.profiler, SamplingProfiler):
+            self.profiler.end_step()
+        last_batch = self.profile_skip_batches + (self.profile_num_batches or 0) - 1
+        if (self.profiler is not None and self.profile_num_batches is not None
+                and batch_idx == last_batch):
+            self._stop_profile(f"profile-epoch{self.current_epoch}")
+
     @classmethod
     def get_execution_order(cls):
         eo = super().get_execution_order()
@@ -66,4 +141,6 @@ class Profile:
         eo["setup_experiment"].append("Profile end")
         eo["run_epoch"].insert(0, "Profile begin")
         eo["run_epoch"].append("Profile end")
+        eo["pre_batch"].insert(0, "Profile begin window and step")
+        eo["post_batch"].append("Profile end window and step")
         return eo
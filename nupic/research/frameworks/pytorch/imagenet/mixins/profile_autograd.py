@@ -19,27 +19,106 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+import os
+
 import torch.autograd
 
 
 class ProfileAutograd:
     """
-    Use torch's autograd profiler during training.
+    Use torch's autograd profiler during training. Each training batch is
+    tagged with its epoch and batch index, and the traces are saved to `logdir`
+    in Chrome trace format (`chrome://tracing`).
+
+    Only a window of the training batches is profiled when "num_batches" is
+    given, keeping the overhead of the profiler out of the remaining batches.
     """
     def setup_experiment(self, config):
+        """
+        :param config:
+            - profile_autograd_args: Autograd profiler configuration:
+                - epochs_interval: Only profile every `epochs_interval` epochs.
+                                   Default: 1
+                - skip_batches: Number of training batches to skip before
+                                profiling when `num_batches` is set. Default: 0
+                - num_batches: Number of training batches to profile. When
+                               None, profile the whole `train_epoch`.
+                               Default: None
+                - table_rows: Number of rows of the table of the most expensive
+                              operators to log. Default: 20
+        """
         super().setup_experiment(config)
         # Only profile from rank 0
         self.profile_autograd = self.rank == 0
 
-    def train_epoch(self):
-        with torch.autograd.profiler.profile(
-                use_cuda=torch.cuda.is_available(),
-                enabled=self.profile_autograd) as prof:
-            super().train_epoch()
+        profile_args = config.get("profile_autograd_args", {})
+        self.profile_autograd_epochs_interval = profile_args.get(
+            "epochs_interval", 1)
+        self.profile_autograd_skip_batches = profile_args.get("skip_batches", 0)
+        self.profile_autograd_num_batches = profile_args.get("num_batches", None)
+        self.profile_autograd_table_rows = profile_args.get("table_rows", 20)
+        self.autograd_profiler = None
+        self.autograd_profiler_step = None
+        self.profile_autograd_epoch = False
+
+    def _start_autograd_profiler(self):
+        self.autograd_profiler = torch.autograd.profiler.profile(
+            use_cuda=torch.cuda.is_available())
+        self.autograd_profiler.__enter__()
 
-        if self.profile_autograd and prof is not None:
+    def _stop_autograd_profiler(self):
+        prof = self.autograd_profiler
+        prof.__exit__(None, None, None)
+        self.autograd_profiler = None
+
+        filepath = os.path.join(self.logdir,
+                                f"autograd-epoch{self.current_epoch}.json")
+        prof.export_chrome_trace(filepath)
+        self.logger.info(f"Saved {filepath}")
+        if self.profile_autograd_table_rows > 0:
             self.logger.info(prof.key_averages().table(
-                sort_by="self_cpu_time_total"))
+                sort_by="self_cpu_time_total",
+                row_limit=self.profile_autograd_table_rows))
+
+    def train_epoch(self):
+        self.profile_autograd_epoch = (
+            self.profile_autograd
+            and self.current_epoch % self.profile_autograd_epochs_interval == 0
+        )
+        if self.profile_autograd_epoch and self.profile_autograd_num_batches is None:
+            self._start_autograd_profiler()
+
+        super().train_epoch()
+
+        if self.autograd_profiler is not None:
+            self._stop_autograd_profiler()
+        self.profile_autograd_epoch = False
+
+    def pre_batch(self, model, batch_idx):
+        if (self.profile_autograd_epoch
+                and self.profile_autograd_num_batches is not None
+                and batch_idx == self.profile_autograd_skip_batches):
+            self._start_autograd_profiler()
+        if self.autograd_profiler is not None:
+            self.autograd_profiler_step = torch.autograd.profiler.record_function(
+                f"epoch {self.current_epoch} batch {batch_idx}")
+            self.autograd_profiler_step.__enter__()
+
+        super().pre_batch(model=model, batch_idx=batch_idx)
+
+    def post_batch(self, model, loss, batch_idx, num_images, time_string):
+        super().post_batch(model=model, loss=loss, batch_idx=batch_idx,
+                           num_images=num_images, time_string=time_string)
+
+        if self.autograd_profiler_step is not None:
+            self.autograd_profiler_step.__exit__(None, None, None)
+            self.autograd_profiler_step = None
+        if self.autograd_profiler is None or self.profile_autograd_num_batches is None:
+            return
+        last_batch = (self.profile_autograd_skip_batches
+                      + self.profile_autograd_num_batches - 1)
+        if batch_idx == last_batch:
+            self._stop_autograd_profiler()
 
     @classmethod
     def get_execution_order(cls):
@@ -47,4 +126,6 @@ class ProfileAutograd:
         eo["setup_experiment"].append("ProfileAutograd initialization")
         eo["train_epoch"].insert(0, "ProfileAutograd begin")
         eo["train_epoch"].append("ProfileAutograd end")
+        eo["pre_batch"].insert(0, "ProfileAutograd begin window and step")
+        eo["post_batch"].append("ProfileAutograd end window and step")
         return eo
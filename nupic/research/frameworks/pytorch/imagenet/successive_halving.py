@@ -0,0 +1,388 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+import copy
+import math
+import os
+import pickle
+import socket
+import time
+
+import ray
+
+__all__ = [
+    "SuccessiveHalving",
+    "run_local",
+    "run_ray",
+    "run_trial",
+    "shared_device_seconds",
+]
+
+
+def run_trial(config, epochs, checkpoint_file):
+    """
+    Train a trial in the current process until it reaches `epochs` epochs or its
+    stop criteria, resuming from the state saved by `get_state` in
+    `checkpoint_file` if the file exists and saving the new state back to it.
+
+    :param config: Trial config, with the "experiment_class" to train
+    :param epochs: Number of epochs to reach, validating the last one
+    :param checkpoint_file: Path of the pickled experiment state
+
+    :return: dict with the "result" of the last epoch, the "epoch" reached,
+             whether the trial is "done", the "setup_seconds" and
+             "train_seconds" spent, the "start_time" and "end_time" of the
+             trial and the "worker" it ran on, its host and GPUs
+    """
+    t0 = time.time()
+    config = copy.deepcopy(config)
+    experiment = config["experiment_class"]()
+    experiment.setup_experiment(config)
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, "rb") as f:
+            experiment.set_state(pickle.load(f))
+    experiment.epochs_to_validate = list(experiment.epochs_to_validate) + [epochs - 1]
+
+    t1 = time.time()
+    result = None
+    while experiment.current_epoch < epochs and not experiment.should_stop():
+        result = experiment.run_epoch()
+    t2 = time.time()
+
+    with open(checkpoint_file, "wb") as f:
+        pickle.dump(experiment.get_state(), f)
+    experiment.stop_experiment()
+
+    gpu_ids = ray.get_gpu_ids() if ray.is_initialized() else []
+    return dict(
+        result=result,
+        epoch=experiment.current_epoch,
+        done=experiment.should_stop(),
+        setup_seconds=t1 - t0,
+        train_seconds=t2 - t1,
+        start_time=t0,
+        end_time=time.time(),
+        worker=(socket.gethostname(), tuple(gpu_ids)),
+    )
+
+
+def shared_device_seconds(intervals, allocation):
+    """
+    Device time used by trials sharing the same worker, each one using a
+    fraction `allocation` of a device. While `n` trials run at the same time
+    they occupy ceil(n * `allocation`) devices, split evenly among them.
+
+    :param intervals: list with the (start, end) time of each trial
+    :param allocation: Fraction of a device allocated to each trial
+    :return: list with the device seconds of each trial
+    """
+    times = sorted({t for interval in intervals for t in interval})
+    seconds = [0.0] * len(intervals)
+    for start, end in zip(times[:-1], times[1:]):
+        running = [i for i, (t0, t1) in enumerate(intervals)
+                   if t0 <= start and end <= t1]
+        if len(running) == 0:
+            continue
+        devices = max(math.ceil(len(running) * allocation), 1)
+        for i in running:
+            seconds[i] += (end - start) * devices / len(running)
+    return seconds
+
+
+def run_local(jobs):
+    """
+    Run the trials one at a time in the current process. Used to test the
+    scheduler on CPU, the packed trials never share the worker.
+
+    :param jobs: list of dicts with the `run_trial` arguments "config", "epochs"
+                 and "checkpoint_file", and the "num_gpus" and "num_cpus"
+                 allocated to the trial
+    :return: list with the `run_trial` return value of each job
+    """
+    return [
+        run_trial(job["config"], job["epochs"], job["checkpoint_file"])
+        for job in jobs
+    ]
+
+
+def run_ray(jobs):
+    """
+    Run the trials in parallel on ray workers with the resources allocated to
+    each trial. Fractional GPUs pack several trials on the same GPU.
+
+    :param jobs: See `run_local`
+    :return: list with the `run_trial` return value of each job
+    """
+    status = []
+    for job in jobs:
+        # Release the GPU memory after every trial
+        remote = ray.remote(num_cpus=job["num_cpus"], num_gpus=job["num_gpus"],
+                            max_calls=1)(run_trial)
+        status.append(
+            remote.remote(job["config"], job["epochs"], job["checkpoint_file"]))
+    return ray.get(status)
+
+
+class SuccessiveHalving:
+    """
+    Successive halving scheduler over the trials of a `TrialsCollection`.
+
+    Instead of training every trial for its full number of epochs, all the
+    trials are trained for `min_epochs` epochs and only the best
+    1 / `reduction_factor` of them are promoted to `reduction_factor` times more
+    epochs, until the remaining trials are trained for their full "epochs".
+    Promoted trials continue from the state saved by `get_state` at the end of
+    the previous rung, so no epoch is trained twice. As the trials keep their
+    own "epochs", their learning rate schedules are the same as in the full
+    length sweep.
+
+    Trials with at most `pack_num_classes` classes use a fraction
+    1 / `trials_per_worker` of a single GPU (or CPU when "num_gpus" is 0)
+    instead of reserving their whole "num_gpus", packing several small trials
+    on a shared worker. Larger trials keep their "num_gpus" and are trained by
+    a single process with `DataParallel`. Every trial is trained by a single
+    process, so "distributed" trials are not supported.
+
+    The scheduler state and the trials checkpoints are saved in the
+    collection "local_dir" after every rung, and restored on creation.
+
+    :param trials: `TrialsCollection` with the trials to search
+    :param metric: Result used to rank the trials
+    :param mode: Whether the best trials "max"imize or "min"imize `metric`
+    :param min_epochs: Number of epochs of every trial in the first rung
+    :param reduction_factor: Fraction of trials stopped and multiplier of the
+                             epochs at every rung
+    :param pack_num_classes: Maximum "num_classes" of the packed trials
+    :param trials_per_worker: Number of packed trials sharing a worker
+    :param executor: Function running a list of trials, `run_ray` or `run_local`
+    :param restore: Whether or not continue from a previous search
+    """
+
+    def __init__(self, trials, metric="mean_accuracy", mode="max", min_epochs=1,
+                 reduction_factor=3, pack_num_classes=100, trials_per_worker=4,
+                 executor=run_ray, restore=True):
+        assert mode in ("max", "min")
+        assert reduction_factor > 1
+        self.trials = trials
+        self.metric = metric
+        self.mode = mode
+        self.min_epochs = min_epochs
+        self.reduction_factor = reduction_factor
+        self.pack_num_classes = pack_num_classes
+        self.trials_per_worker = trials_per_worker
+        self.executor = executor
+        self.path_state = os.path.join(trials.path, trials.name + "_halving.p")
+
+        if restore and os.path.exists(self.path_state):
+            self.restore()
+        else:
+            self.rung = 0
+            self.records = [
+                self._create_record(trial_id, config)
+                for trial_id, config in enumerate(trials.retrieve())
+            ]
+            self.save()
+
+    def _create_record(self, trial_id, config):
+        if config.get("distributed", False):
+            # The per process batch size and learning rate of the distributed
+            # trials would not match the trials of the full sweep
+            raise ValueError("SuccessiveHalving trains each trial in a single "
+                             "process and does not support distributed trials")
+        num_gpus = config.get("num_gpus", 0)
+        # Count one device per process when training on CPU
+        devices = num_gpus if num_gpus > 0 else config.get("num_cpus", 1)
+        packed = config.get("num_classes", 1000) <= self.pack_num_classes
+        allocation = 1.0 / self.trials_per_worker if packed else devices
+        if num_gpus > 0:
+            resources = dict(num_gpus=allocation,
+                             num_cpus=config.get("workers", 0) * allocation)
+        else:
+            resources = dict(num_gpus=0, num_cpus=allocation)
+
+        checkpoint_file = os.path.join(
+            self.trials.path, f"{self.trials.name}_trial_{trial_id}.p")
+        return dict(
+            trial_id=trial_id,
+            config=config,
+            epochs=config.get("epochs", 1),
+            checkpoint_file=checkpoint_file,
+            packed=packed,
+            devices=devices,
+            allocation=allocation,
+            resources=resources,
+            epoch=0,
+            result=None,
+            history=[],
+            status="running",
+            setup_seconds=0.0,
+            train_seconds=0.0,
+            device_setup_seconds=0.0,
+            device_train_seconds=0.0,
+            gpu_hours=0.0,
+        )
+
+    def save(self):
+        """Save the scheduler state in results folder"""
+        with open(self.path_state, "wb") as f:
+            pickle.dump(dict(rung=self.rung, records=self.records), f)
+
+    def restore(self):
+        """Restore the scheduler state from results folder"""
+        with open(self.path_state, "rb") as f:
+            state = pickle.load(f)
+        self.rung = state["rung"]
+        self.records = state["records"]
+
+    def rung_epochs(self, rung):
+        """Number of epochs of the trials in the given rung"""
+        return self.min_epochs * self.reduction_factor ** rung
+
+    def running(self):
+        """Trials not stopped nor done yet"""
+        return [r for r in self.records if r["status"] == "running"]
+
+    def score(self, record):
+        """Value of the metric of a trial, larger is better"""
+        if record["result"] is None:
+            return -math.inf
+        value = record["result"][self.metric]
+        return value if self.mode == "max" else -value
+
+    def run(self):
+        """
+        Run the remaining rungs
+        :return: See `report`
+        """
+        while len(self.running()) > 0:
+            self.run_rung()
+        return self.report()
+
+    def run_rung(self):
+        """
+        Train the running trials to the epochs of the current rung, then stop
+        all but the best 1 / `reduction_factor` of them
+        """
+        epochs = self.rung_epochs(self.rung)
+        running = self.running()
+        print(f"***** Rung {self.rung}: {len(running)} trials, {epochs} epochs")
+
+        jobs, scheduled = [], []
+        for record in running:
+            target = min(epochs, record["epochs"])
+            if record["epoch"] < target:
+                jobs.append(dict(
+                    config=record["config"],
+                    epochs=target,
+                    checkpoint_file=record["checkpoint_file"],
+                    **record["resources"]
+                ))
+                scheduled.append(record)
+
+        results = self.executor(jobs)
+
+        # Device seconds used by each trial. The packed trials running on the
+        # same worker at the same time split its device time
+        device_seconds = [(ret["setup_seconds"] + ret["train_seconds"])
+                          * record["devices"]
+                          for record, ret in zip(scheduled, results)]
+        workers = {}
+        for i, (record, ret) in enumerate(zip(scheduled, results)):
+            if record["packed"]:
+                workers.setdefault(ret["worker"], []).append(i)
+        for indices in workers.values():
+            shared = shared_device_seconds(
+                [(results[i]["start_time"], results[i]["end_time"])
+                 for i in indices],
+                1.0 / self.trials_per_worker)
+            for i, seconds in zip(indices, shared):
+                device_seconds[i] = seconds
+
+        for record, ret, seconds in zip(scheduled, results, device_seconds):
+            # Split the device time between the setup and the training
+            fraction = ret["setup_seconds"] / max(
+                ret["setup_seconds"] + ret["train_seconds"], 1e-9)
+            record["device_setup_seconds"] += seconds * fraction
+            record["device_train_seconds"] += seconds * (1 - fraction)
+            record["gpu_hours"] += seconds / 3600
+            record["setup_seconds"] += ret["setup_seconds"]
+            record["train_seconds"] += ret["train_seconds"]
+            record["epoch"] = ret["epoch"]
+            if ret["result"] is not None:
+                record["result"] = ret["result"]
+            record["history"].append((ret["epoch"], record["result"]))
+            if ret["done"] or record["epoch"] >= record["epochs"]:
+                record["status"] = "done"
+
+        # Promote the best trials to the next rung
+        running = sorted(self.running(), key=self.score, reverse=True)
+        num_promoted = max(int(math.ceil(len(running) / self.reduction_factor)), 1)
+        for record in running[num_promoted:]:
+            record["status"] = "stopped"
+            if os.path.exists(record["checkpoint_file"]):
+                os.remove(record["checkpoint_file"])
+
+        for record in scheduled:
+            if record["status"] != "running":
+                self.trials.mark_completed(record["config"], save=False)
+        for record in running[num_promoted:]:
+            if record not in scheduled:
+                self.trials.mark_completed(record["config"], save=False)
+        self.trials.save()
+
+        self.rung += 1
+        self.save()
+        self.trials.report_progress()
+
+    def report(self):
+        """
+        Summary of the search and the GPU hours saved against training all the
+        trials for their full epochs. The GPU hours of every trial are the
+        device time it occupied: its wall time times its "num_gpus", or its
+        share of the worker for the packed trials. The cost of the full length
+        trials is estimated from the device time of their setup and epochs, so
+        the savings only come from the stopped trials. Trials without GPUs
+        count one device per CPU process.
+
+        :return: dict with the "best" trial record, the "trials" records, the
+                 "gpu_hours" used, the "flat_gpu_hours" of the full sweep and
+                 the "saved_gpu_hours"
+        """
+        gpu_hours = 0.0
+        flat_gpu_hours = 0.0
+        for record in self.records:
+            gpu_hours += record["gpu_hours"]
+            if record["epoch"] > 0:
+                runs = len(record["history"])
+                epoch_seconds = record["device_train_seconds"] / record["epoch"]
+                seconds = (record["device_setup_seconds"] / runs
+                           + epoch_seconds * record["epochs"])
+                flat_gpu_hours += seconds / 3600
+
+        best = max(self.records, key=self.score)
+        print(f"***** Best trial {best['trial_id']}: {best['result']}")
+        print(f"***** GPU hours: {gpu_hours:.3f}, full sweep: {flat_gpu_hours:.3f}")
+
+        return dict(
+            best=best,
+            trials=self.records,
+            gpu_hours=gpu_hours,
+            flat_gpu_hours=flat_gpu_hours,
+            saved_gpu_hours=flat_gpu_hours - gpu_hours,
+        )
@@ -19,10 +19,17 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 import gzip
+import io
+import mmap
+import os
 import pickle
 import random
+import struct
 import sys
 import time
+import warnings
+from collections import OrderedDict
+from collections.abc import Mapping
 
 import numpy as np
 import torch
@@ -41,6 +48,7 @@ def train_model(
     pre_batch_callback=None,
     post_batch_callback=None,
     progress_bar=None,
+    step_timer=None,
 ):
     """Train the given model by iterating through mini batches. An epoch ends
     after one pass through the training set, or if the number of mini batches
@@ -72,6 +80,9 @@ def train_model(
     :param progress_bar: Optional :class:`tqdm` progress bar args.
                          None for no progress bar
     :type progress_bar: dict or None
+    :param step_timer: Optional :class:`StepTimer` recording the duration of
+                       each phase of every batch
+    :type step_timer: :class:`StepTimer` or None
 
     :return: mean loss for epoch
     :rtype: float
@@ -97,7 +108,8 @@ def train_model(
                 "Mixed precision requires NVIDA APEX."
                 "Please install apex from https://www.github.com/nvidia/apex")
 
-    t0 = time.time()
+    now = time.time if step_timer is None else step_timer.now
+    t0 = now()
     for batch_idx, (data, target) in enumerate(loader):
         if batch_idx >= batches_in_epoch:
             break
@@ -105,7 +117,7 @@ def train_model(
         num_images = len(target)
         data = data.to(device, non_blocking=async_gpu)
         target = target.to(device, non_blocking=async_gpu)
-        t1 = time.time()
+        t1 = now()
 
         if pre_batch_callback is not None:
             pre_batch_callback(model=model, batch_idx=batch_idx)
@@ -115,7 +127,7 @@ def train_model(
         loss = criterion(output, target)
         del data, target, output
 
-        t2 = time.time()
+        t2 = now()
         if use_amp:
             with amp.scale_loss(loss, optimizer) as scaled_loss:
                 scaled_loss.backward()
@@ -129,9 +141,9 @@ def train_model(
                     param_indices = param[1]
                     param_module.grad[param_indices, :] = 0.0
 
-        t3 = time.time()
+        t3 = now()
         optimizer.step()
-        t4 = time.time()
+        t4 = now()
 
         if post_batch_callback is not None:
             time_string = ("Data: {:.3f}s, forward: {:.3f}s, backward: {:.3f}s,"
@@ -139,8 +151,10 @@ def train_model(
                                                               t4 - t3)
             post_batch_callback(model=model, loss=loss.detach(), batch_idx=batch_idx,
                                 num_images=num_images, time_string=time_string)
+        if step_timer is not None:
+            step_timer.record(num_images, t1 - t0, t2 - t1, t3 - t2, t4 - t3)
         del loss
-        t0 = time.time()
+        t0 = now()
 
     if progress_bar is not None:
         loader.n = loader.total
@@ -297,12 +311,15 @@ def serialize_state_dict(fileobj, state_dict, compresslevel=3):
 
 def deserialize_state_dict(fileobj, device=None):
     """
-    Deserialize state dict saved via :func:`_serialize_state_dict` from
-    the given file object
+    Deserialize state dict saved via :func:`_serialize_state_dict` or
+    :func:`serialize_flat_state_dict` from the given file object
     :param fileobj: file-like object such as :class:`io.BytesIO`
     :param device: Device to map tensors to
     :return: the state dict stored in the file object
     """
+    if is_flat_state_dict(fileobj):
+        return load_flat_state_dict(fileobj, device).to_dict()
+
     try:
         with gzip.GzipFile(fileobj=fileobj, mode="rb") as fin:
             state_dict = torch.load(fin, map_location=device)
@@ -310,3 +327,190 @@ def deserialize_state_dict(fileobj, device=None):
         # FIXME: Backward compatibility with old uncompressed checkpoints
         state_dict = torch.load(fileobj, map_location=device)
     return state_dict
+
+
+# Flat, uncompressed state dict format:
+#   magic | index size (uint64) | pickled index | padding | tensor data
+# The index holds the pickled value of every key, with its tensors replaced by
+# references into the tensor data section, so tensors can be mapped in place.
+FLAT_STATE_DICT_MAGIC = b"NTAFLAT1"
+_FLAT_HEADER = struct.Struct("<8sQ")
+_FLAT_ALIGNMENT = 64
+
+
+def _align(offset):
+    return -(-offset // _FLAT_ALIGNMENT) * _FLAT_ALIGNMENT
+
+
+def serialize_flat_state_dict(fileobj, state_dict):
+    """
+    Serialize the state dict to file object using the flat, uncompressed format.
+    Tensor data is written as-is, without pickling or compression, so it can later
+    be memory mapped and loaded lazily, one key at a time, with
+    :func:`load_flat_state_dict`.
+    :param fileobj: file-like object such as :class:`io.BytesIO`
+    :param state_dict: state dict to serialize. Usually the dict returned by
+                       module.state_dict() but it can be any state dict.
+    """
+    tensors = []
+    table = []
+    offset = 0
+
+    def persistent_id(obj):
+        nonlocal offset
+        if not torch.is_tensor(obj) or obj.is_sparse:
+            return None
+        tensor = obj.detach().cpu().contiguous()
+        try:
+            dtype = tensor.numpy().dtype.str
+        except TypeError:
+            # No numpy equivalent (i.e. bfloat16). Pickle it with the index.
+            return None
+        table.append((dtype, tuple(tensor.shape), offset, str(obj.device)))
+        tensors.append(tensor)
+        offset = _align(offset + tensor.numel() * tensor.element_size())
+        return len(table) - 1
+
+    values = OrderedDict()
+    for key, value in state_dict.items():
+        with io.BytesIO() as buffer:
+            pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = persistent_id
+            pickler.dump(value)
+            values[key] = buffer.getvalue()
+
+    index = pickle.dumps(
+        dict(
+            values=values,
+            tensors=table,
+            metadata=getattr(state_dict, "_metadata", None),
+        ),
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    header_size = _FLAT_HEADER.size + len(index)
+    fileobj.write(_FLAT_HEADER.pack(FLAT_STATE_DICT_MAGIC, len(index)))
+    fileobj.write(index)
+    fileobj.write(bytes(_align(header_size) - header_size))
+
+    position = 0
+    for (_, _, tensor_offset, _), tensor in zip(table, tensors):
+        fileobj.write(bytes(tensor_offset - position))
+        data = memoryview(tensor.numpy()).cast("B")
+        fileobj.write(data)
+        position = tensor_offset + len(data)
+
+
+def is_flat_state_dict(fileobj):
+    """
+    Check whether the file object holds a state dict serialized with
+    :func:`serialize_flat_state_dict`. The file position is not changed.
+    """
+    position = fileobj.tell()
+    magic = fileobj.read(len(FLAT_STATE_DICT_MAGIC))
+    fileobj.seek(position)
+    return magic == FLAT_STATE_DICT_MAGIC
+
+
+def load_flat_state_dict(source, device=None):
+    """
+    Load a state dict saved via :func:`serialize_flat_state_dict`.
+
+    Nothing but the index is read upfront. When `source` is a path or a file
+    backed file object, the file is memory mapped (copy-on-write) and the CPU
+    tensors are views into the mapping. When `source` is a buffer, such as a
+    `bytes` or a numpy array from the ray object store, the CPU tensors are
+    views into the buffer, and must not be modified in place if it is read-only.
+    Otherwise the data is read into a single buffer that the tensors share.
+    :param source: path, buffer, or file-like object positioned at the start of
+                   the state
+    :param device: Device to map tensors to. Default: the device they were saved
+                   from
+    :return: :class:`FlatStateDict` that loads its values on access
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fileobj:
+            return load_flat_state_dict(fileobj, device)
+
+    if isinstance(source, (bytes, bytearray, memoryview, np.ndarray)):
+        view = memoryview(source).cast("B")
+        magic, index_size = _FLAT_HEADER.unpack_from(view)
+        if magic != FLAT_STATE_DICT_MAGIC:
+            raise ValueError("Not a flat state dict")
+        index = pickle.loads(view[_FLAT_HEADER.size:_FLAT_HEADER.size + index_size])
+        data_offset = _align(_FLAT_HEADER.size + index_size)
+        return FlatStateDict(index, view, data_offset, device)
+
+    start = source.tell()
+    magic, index_size = _FLAT_HEADER.unpack(source.read(_FLAT_HEADER.size))
+    if magic != FLAT_STATE_DICT_MAGIC:
+        raise ValueError("Not a flat state dict")
+    index = pickle.loads(source.read(index_size))
+    data_offset = _align(_FLAT_HEADER.size + index_size)
+
+    try:
+        fileno = source.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        fileno = None
+
+    if fileno is not None:
+        buffer = mmap.mmap(fileno, 0, access=mmap.ACCESS_COPY)
+        data_offset += start
+    else:
+        source.seek(start + data_offset)
+        buffer = bytearray(source.read())
+        data_offset = 0
+
+    return FlatStateDict(index, buffer, data_offset, device)
+
+
+class FlatStateDict(Mapping):
+    """
+    Read-only mapping over a state dict saved via :func:`serialize_flat_state_dict`.
+    Values are only unpickled, and their tensors created, when accessed.
+    """
+
+    def __init__(self, index, buffer, data_offset, device=None):
+        self._values = index["values"]
+        self._tensors = index["tensors"]
+        self._metadata = index["metadata"]
+        self._buffer = buffer
+        self._data_offset = data_offset
+        self._device = None if device is None else torch.device(device)
+
+    def _load_tensor(self, tensor_id):
+        dtype, shape, offset, saved_device = self._tensors[tensor_id]
+        dtype = np.dtype(dtype)
+        array = np.frombuffer(
+            self._buffer,
+            dtype=dtype,
+            count=int(np.prod(shape)),
+            offset=self._data_offset + offset,
+        )
+        with warnings.catch_warnings():
+            # Tensors of read-only buffers are only read by `load_state_dict`
+            warnings.simplefilter("ignore", UserWarning)
+            tensor = torch.from_numpy(array).view(shape)
+        device = self._device or torch.device(saved_device)
+        return tensor if device.type == "cpu" else tensor.to(device)
+
+    def __getitem__(self, key):
+        with io.BytesIO(self._values[key]) as buffer:
+            unpickler = pickle.Unpickler(buffer)
+            unpickler.persistent_load = self._load_tensor
+            return unpickler.load()
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def to_dict(self):
+        """
+        Load all values into an :class:`OrderedDict`, which can be passed to
+        `load_state_dict`
+        """
+        state_dict = OrderedDict((key, self[key]) for key in self)
+        if self._metadata is not None:
+            state_dict._metadata = self._metadata
+        return state_dict
@@ -0,0 +1,134 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+import collections
+import time
+
+import torch
+
+__all__ = [
+    "PrefetchLoader",
+]
+
+
+def _to_device(obj, device, non_blocking):
+    if isinstance(obj, torch.Tensor):
+        return obj.to(device, non_blocking=non_blocking)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_device(o, device, non_blocking) for o in obj)
+    return obj
+
+
+def _tensors(obj):
+    if isinstance(obj, torch.Tensor):
+        yield obj
+    elif isinstance(obj, (list, tuple)):
+        for o in obj:
+            yield from _tensors(o)
+
+
+class PrefetchLoader(object):
+    """
+    Wraps a data loader, keeping the next `num_prefetch` batches staged on the
+    device. On CUDA devices the host to device copies, and the optional batch
+    `transform`, run on a side stream overlapping the computation on the
+    current stream. On other devices the batches are simply moved to the
+    device. Other attributes (`dataset`, `sampler`, `pin_memory`, ...) are the
+    ones of the wrapped loader, so it can replace the loader passed to
+    :func:`train_model` and :func:`evaluate_model`.
+
+    :class:`ImagenetExperiment` wraps its loaders when the `prefetch_batches`
+    config is set. Other experiments have to wrap their loaders themselves.
+
+    The host time spent waiting for each batch is kept in `wait_time`, and its
+    sum over the last iteration of the loader in `total_wait_time`.
+
+    :param loader: Data loader returning (data, target) batches. Pin its memory
+                   to make the copies asynchronous
+    :param device: Device where the batches are moved
+    :param num_prefetch: Number of batches staged ahead of the current batch
+    :param transform: Optional function applied to the data on the device,
+                      i.e. :class:`BatchAugment`
+    """
+
+    def __init__(self, loader, device, num_prefetch=2, transform=None):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.num_prefetch = num_prefetch
+        self.transform = transform
+        self.wait_time = 0.0
+        self.total_wait_time = 0.0
+
+    def _move(self, batch, non_blocking):
+        data, target = _to_device(batch, self.device, non_blocking)
+        if self.transform is not None:
+            data = self.transform(data)
+        return data, target
+
+    def _stage(self, batch, stream):
+        non_blocking = getattr(self.loader, "pin_memory", False)
+        if stream is None:
+            return self._move(batch, non_blocking), None
+
+        with torch.cuda.stream(stream):
+            batch = self._move(batch, non_blocking)
+            event = torch.cuda.Event()
+            event.record(stream)
+        return batch, event
+
+    def __iter__(self):
+        stream = None
+        if self.device.type == "cuda" and torch.cuda.is_available():
+            stream = torch.cuda.Stream(self.device)
+
+        self.total_wait_time = 0.0
+        loader_iter = iter(self.loader)
+        staged = collections.deque()
+        exhausted = False
+        t0 = time.time()
+        while True:
+            # Keep the current batch and the next `num_prefetch` batches staged
+            while not exhausted and len(staged) <= self.num_prefetch:
+                try:
+                    staged.append(self._stage(next(loader_iter), stream))
+                except StopIteration:
+                    exhausted = True
+            if len(staged) == 0:
+                break
+
+            batch, event = staged.popleft()
+            if event is not None:
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_event(event)
+                # Do not reuse the memory until the current stream is done
+                for tensor in _tensors(batch):
+                    tensor.record_stream(current_stream)
+
+            self.wait_time = time.time() - t0
+            self.total_wait_time += self.wait_time
+            yield batch
+            t0 = time.time()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
@@ -0,0 +1,144 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+import json
+import os
+import sys
+import threading
+import time
+
+__all__ = [
+    "SamplingProfiler",
+]
+
+
+class SamplingProfiler(object):
+    """
+    Low overhead statistical profiler. A background thread samples the Python
+    stack of the profiled thread every `interval` seconds instead of tracing
+    every function call like :mod:`cProfile`. The samples are saved in Chrome
+    trace format (`chrome://tracing` or https://ui.perfetto.dev) as a flame
+    chart, along with the steps marked by :meth:`begin_step` and
+    :meth:`end_step`.
+
+    :param interval: Sampling interval in seconds
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._samples = []
+        self._steps = []
+        self._start_time = 0.0
+
+    @property
+    def enabled(self):
+        return self._thread is not None
+
+    def start(self):
+        """
+        Start sampling the calling thread
+        """
+        if self.enabled:
+            return
+        self._samples = []
+        self._steps = []
+        self._start_time = time.perf_counter()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(threading.get_ident(),),
+                                        name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def begin_step(self, name, **args):
+        """
+        Mark the beginning of a step, i.e. a training batch. The optional `args`
+        are shown with the step in the trace viewer
+        """
+        if self.enabled:
+            self._steps.append(("B", time.perf_counter(), name, args))
+
+    def end_step(self):
+        if self.enabled:
+            self._steps.append(("E", time.perf_counter(), None, None))
+
+    def _run(self, thread_id):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            self._samples.append((time.perf_counter(), tuple(reversed(stack))))
+
+    def _timestamp(self, t):
+        # Chrome trace timestamps are in microseconds
+        return (t - self._start_time) * 1e6
+
+    def export_chrome_trace(self, path):
+        """
+        Save the samples and steps recorded by the last :meth:`start` to `path`
+        in Chrome trace format
+        """
+        pid = os.getpid()
+        events = [
+            dict(ph="M", pid=pid, tid=0, name="thread_name",
+                 args=dict(name="steps")),
+            dict(ph="M", pid=pid, tid=1, name="thread_name",
+                 args=dict(name="python samples")),
+        ]
+        for ph, t, name, args in self._steps:
+            event = dict(ph=ph, pid=pid, tid=0, ts=self._timestamp(t))
+            if ph == "B":
+                event.update(name=name, cat="step", args=args)
+            events.append(event)
+
+        # Consecutive samples sharing the same frames become a single event
+        names = {}
+        previous = ()
+        t = self._start_time
+        for t, stack in self._samples:
+            common = 0
+            while (common < min(len(stack), len(previous))
+                   and stack[common] is previous[common]):
+                common += 1
+            ts = self._timestamp(t)
+            for _ in previous[common:]:
+                events.append(dict(ph="E", pid=pid, tid=1, ts=ts))
+            for code in stack[common:]:
+                if code not in names:
+                    names[code] = (f"{code.co_name} "
+                                   f"({code.co_filename}:{code.co_firstlineno})")
+                events.append(dict(ph="B", pid=pid, tid=1, ts=ts, name=names[code],
+                                   cat="python"))
+            previous = stack
+        ts = self._timestamp(t)
+        for _ in previous:
+            events.append(dict(ph="E", pid=pid, tid=1, ts=ts))
+
+        with open(path, "w") as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f)
@@ -0,0 +1,183 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+import time
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+__all__ = [
+    "StepTimer",
+]
+
+
+class StepTimer(object):
+    """
+    Record the time spent loading data, in the forward pass, in the backward
+    pass and in the optimizer step of every training batch, as well as the
+    images per second, and summarize them as histograms. Pass it to
+    :func:`train_model` as `step_timer`.
+
+    All histograms use fixed log spaced bins (`SECONDS_BINS` for the times,
+    `IMAGES_PER_SEC_BINS` for the throughput) so they can be merged across
+    epochs and distributed workers by adding the counts.
+
+    :param cuda_sync: Whether to synchronize CUDA before reading the time, so
+                      the times include the GPU work of each phase instead of
+                      the time taken to queue it. Slows training down.
+    """
+    TIME_KEYS = ("data", "forward", "backward", "optimizer")
+    SECONDS_BINS = np.logspace(-6, 3, 73)
+    IMAGES_PER_SEC_BINS = np.logspace(-1, 6, 57)
+
+    def __init__(self, cuda_sync=False):
+        self.cuda_sync = cuda_sync and torch.cuda.is_available()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all recorded steps. Call at the beginning of every epoch
+        """
+        self._times = {k: [] for k in self.TIME_KEYS}
+        self._images = []
+
+    def now(self):
+        """
+        Current time in seconds, after waiting for the GPU if `cuda_sync`
+        """
+        if self.cuda_sync:
+            torch.cuda.synchronize()
+        return time.time()
+
+    def record(self, num_images, data, forward, backward, optimizer):
+        """
+        Record the duration in seconds of each phase of one training step
+        """
+        self._times["data"].append(data)
+        self._times["forward"].append(forward)
+        self._times["backward"].append(backward)
+        self._times["optimizer"].append(optimizer)
+        self._images.append(num_images)
+
+    def summary(self, distributed=False, device=None):
+        """
+        Summarize the recorded steps. When `distributed`, the histograms of all
+        the processes are merged, which must all call this method.
+
+        :return: dict mapping "data", "forward", "backward", "optimizer" and
+                 "images_per_sec" to a dict with the "count", "mean", "min",
+                 "max", "p50", "p90", "p99", per rank mean ("rank_mean") and
+                 "histogram" of the step values. Also includes the overall
+                 "epoch_images_per_sec" of all processes.
+        """
+        step_times = np.sum([self._times[k] for k in self.TIME_KEYS], axis=0)
+        images = np.asarray(self._images, dtype=np.float64)
+        values = {k: np.asarray(self._times[k], dtype=np.float64)
+                  for k in self.TIME_KEYS}
+        values["images_per_sec"] = images / np.maximum(step_times, 1e-9)
+
+        # Per key: count, sum, min, max, histogram counts
+        stats = {}
+        for key, value in values.items():
+            bins = self.IMAGES_PER_SEC_BINS if key == "images_per_sec" \
+                else self.SECONDS_BINS
+            hist = np.histogram(np.clip(value, bins[0], bins[-1]), bins=bins)[0]
+            stats[key] = (
+                len(value), value.sum(),
+                value.min() if len(value) > 0 else np.inf,
+                value.max() if len(value) > 0 else -np.inf,
+                hist,
+            )
+        totals = np.array([images.sum(), step_times.sum()])
+
+        rank_means = {k: [s[1] / max(s[0], 1)] for k, s in stats.items()}
+        if distributed and dist.is_initialized():
+            stats, totals, rank_means = self._merge(stats, totals, rank_means, device)
+
+        summary = {}
+        for key, (count, total, minimum, maximum, hist) in stats.items():
+            bins = self.IMAGES_PER_SEC_BINS if key == "images_per_sec" \
+                else self.SECONDS_BINS
+            summary[key] = dict(
+                count=int(count),
+                mean=float(total / max(count, 1)),
+                min=float(minimum) if count > 0 else 0.0,
+                max=float(maximum) if count > 0 else 0.0,
+                p50=self._percentile(hist, bins, 0.5),
+                p90=self._percentile(hist, bins, 0.9),
+                p99=self._percentile(hist, bins, 0.99),
+                rank_mean=[float(m) for m in rank_means[key]],
+                histogram=[int(c) for c in hist],
+            )
+
+        # Images processed by all processes over the slowest process time
+        summary["epoch_images_per_sec"] = float(totals[0] / max(totals[1], 1e-9))
+        return summary
+
+    @staticmethod
+    def _percentile(hist, bins, q):
+        """
+        Approximate percentile: geometric center of the bin holding it
+        """
+        count = hist.sum()
+        if count == 0:
+            return 0.0
+        idx = int(np.searchsorted(np.cumsum(hist), q * count))
+        idx = min(idx, len(hist) - 1)
+        return float(np.sqrt(bins[idx] * bins[idx + 1]))
+
+    def _merge(self, stats, totals, rank_means, device):
+        keys = list(stats.keys())
+        world_size = dist.get_world_size()
+
+        # Count, sum and histogram of every key followed by the total images
+        sums = np.concatenate(
+            [np.concatenate(([stats[k][0], stats[k][1]], stats[k][4])) for k in keys]
+            + [totals[:1]])
+        sums = torch.tensor(sums, dtype=torch.float64, device=device)
+        maximums = torch.tensor([stats[k][3] for k in keys] + [totals[1]],
+                                dtype=torch.float64, device=device)
+        minimums = torch.tensor([stats[k][2] for k in keys],
+                                dtype=torch.float64, device=device)
+        means = torch.tensor([rank_means[k][0] for k in keys],
+                             dtype=torch.float64, device=device)
+        gathered = [torch.zeros_like(means) for _ in range(world_size)]
+
+        dist.all_reduce(sums, op=dist.ReduceOp.SUM)
+        dist.all_reduce(maximums, op=dist.ReduceOp.MAX)
+        dist.all_reduce(minimums, op=dist.ReduceOp.MIN)
+        dist.all_gather(gathered, means)
+
+        sums = sums.cpu().numpy()
+        maximums = maximums.cpu().numpy()
+        minimums = minimums.cpu().numpy()
+        gathered = torch.stack(gathered).cpu().numpy()
+
+        merged = {}
+        offset = 0
+        for i, key in enumerate(keys):
+            num_bins = len(stats[key][4])
+            count, total = sums[offset], sums[offset + 1]
+            hist = sums[offset + 2:offset + 2 + num_bins].astype(np.int64)
+            merged[key] = (count, total, minimums[i], maximums[i], hist)
+            offset += 2 + num_bins
+        merged_totals = np.array([sums[offset], maximums[-1]])
+        merged_means = {k: gathered[:, i].tolist() for i, k in enumerate(keys)}
+        return merged, merged_totals, merged_means
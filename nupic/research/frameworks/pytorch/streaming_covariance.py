@@ -0,0 +1,121 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+import torch
+import torch.distributed as dist
+
+__all__ = [
+    "StreamingCovariance",
+]
+
+
+class StreamingCovariance(object):
+    """
+    Covariance of a stream of batches of activations, using O(D^2) memory for
+    D units no matter the number of samples.
+
+    Keeps the number of samples, the mean and the sum of products of the
+    deviations from the mean, updated with every batch as in Welford's
+    algorithm, combining the statistics of the batch with the running ones
+    (Chan et al. parallel update).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, x):
+        """
+        Add a batch of activations, one row per sample
+        """
+        batch_count = x.size(0)
+        if batch_count == 0:
+            return
+        x = x.detach().reshape(batch_count, -1)
+        batch_mean = x.mean(dim=0)
+        centered = x - batch_mean
+        batch_m2 = centered.t().mm(centered)
+
+        if self.mean is None:
+            self.count, self.mean, self.m2 = batch_count, batch_mean, batch_m2
+            return
+
+        count = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.m2 += batch_m2
+        self.m2.addr_(delta, delta, alpha=self.count * batch_count / count)
+        self.mean += delta * (batch_count / count)
+        self.count = count
+
+    def merge_distributed(self, device=None):
+        """
+        Combine the statistics of all the distributed processes, which must all
+        call this method. Processes without samples contribute zeros.
+
+        :param device: Device of the reduced tensors. Defaults to the device of
+                       the running statistics, or the CPU without samples
+        """
+        if not (dist.is_available() and dist.is_initialized()):
+            return
+        if device is None:
+            device = "cpu" if self.mean is None else self.mean.device
+
+        count = torch.tensor([float(self.count)], device=device)
+        dist.all_reduce(count, op=dist.ReduceOp.SUM)
+        if count.item() == 0:
+            return
+        num_units = 0 if self.mean is None else self.mean.numel()
+        num_units = torch.tensor([num_units], device=device)
+        dist.all_reduce(num_units, op=dist.ReduceOp.MAX)
+        num_units = int(num_units.item())
+
+        # Reduce in double precision, the dtype of the processes without
+        # samples is unknown
+        dtype = torch.get_default_dtype()
+        if self.mean is None:
+            local_mean = torch.zeros(num_units, dtype=torch.float64, device=device)
+            local_m2 = torch.zeros(num_units, num_units, dtype=torch.float64,
+                                   device=device)
+        else:
+            dtype = self.mean.dtype
+            local_mean = self.mean.to(device, torch.float64)
+            local_m2 = self.m2.to(device, torch.float64)
+
+        count = count.double()
+        mean = local_mean * self.count
+        dist.all_reduce(mean, op=dist.ReduceOp.SUM)
+        mean /= count
+
+        # Move the deviations of every process to the global mean
+        m2 = local_m2
+        if self.count > 0:
+            delta = local_mean - mean
+            m2 = m2.addr(delta, delta, alpha=float(self.count))
+        dist.all_reduce(m2, op=dist.ReduceOp.SUM)
+
+        self.count, self.mean, self.m2 = int(count.item()), mean.to(dtype), m2.to(dtype)
+
+    def covariance(self):
+        """
+        Population covariance matrix of the activations
+        """
+        if self.count == 0:
+            raise ValueError("No activations were added to the covariance")
+        return self.m2 / self.count
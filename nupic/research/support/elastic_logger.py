@@ -17,13 +17,20 @@
 #
 #  http://numenta.org/licenses/
 #
+import functools
+import logging
 import os
+import queue
 import re
 import subprocess
+import threading
+import time
 from datetime import datetime
 
 from elasticsearch import Elasticsearch, helpers
 from elasticsearch.client.xpack import SqlClient
+from elasticsearch.exceptions import ConnectionError as ElasticConnectionError
+from elasticsearch.exceptions import TransportError
 from elasticsearch.helpers import BulkIndexError
 from pandas import DataFrame
 from pandas.io.json import json_normalize
@@ -60,6 +67,212 @@ def create_elastic_client(**kwargs):
     return Elasticsearch(**elasticsearch_args)
 
 
+# Sentinel queued by flush to send the documents queued before it
+_FLUSH = object()
+
+# Sentinel queued by close to send the documents queued before it and stop
+_CLOSE = object()
+
+
+@functools.lru_cache(maxsize=None)
+def git_info():
+    """
+    Git information of the current repository. Computed once per process.
+
+    :return: dict with the "remote", "branch", "sha", "user" and "root" of the
+             repository
+    """
+    def git(*args):
+        return subprocess.check_output(["git"] + list(args)).decode("ascii").strip()
+
+    return dict(
+        remote=git("ls-remote", "--get-url"),
+        branch=git("rev-parse", "--abbrev-ref", "HEAD"),
+        sha=git("rev-parse", "HEAD"),
+        user=git("log", "-n", "1", "--pretty=format:%an"),
+        root=git("rev-parse", "--show-toplevel"),
+    )
+
+
+class BulkSender(object):
+    """
+    Index documents in elasticsearch from a background thread.
+
+    Documents are added to a bounded queue and sent with the bulk API in
+    batches of up to `batch_size` documents, or after `flush_interval` seconds.
+    Connection failures and overloaded clusters are retried with exponential
+    backoff. Batches still failing after `max_retries` retries, and documents
+    that don't fit in the queue within `put_timeout` seconds, are appended to
+    the `spill_file` as JSON lines. The spilled documents are sent again when
+    a sender is created with the same spill file.
+
+    :param client: Configured elasticsearch client
+    :param index: Index name
+    :param doc_type: Document type
+    :param max_queue_size: Maximum number of queued documents
+    :param batch_size: Maximum number of documents per bulk request
+    :param flush_interval: Maximum time in seconds a document waits to be sent
+    :param max_retries: Number of retries of a failed bulk request
+    :param backoff: Time in seconds before the first retry, doubled every retry
+    :param max_backoff: Maximum time in seconds between retries
+    :param put_timeout: Maximum time in seconds :meth:`put` waits for the
+                        queue before spilling the document
+    :param spill_file: Path of the file used when the cluster is unreachable
+    """
+    RETRY_STATUS = (429, 502, 503, 504)
+
+    def __init__(self, client, index, doc_type=None, max_queue_size=10000,
+                 batch_size=500, flush_interval=5.0, max_retries=5, backoff=1.0,
+                 max_backoff=60.0, put_timeout=1.0, spill_file=None):
+        self.client = client
+        self.index = index
+        self.doc_type = doc_type
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.put_timeout = put_timeout
+        self.spill_file = spill_file
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        # Number of documents sent, spilled, and rejected by elasticsearch
+        self.num_sent = 0
+        self.num_spilled = 0
+        self.errors = []
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._spill_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="BulkSender")
+        self._thread.start()
+
+    def put(self, doc):
+        """
+        Queue a document, waiting at most `put_timeout` seconds for space in the
+        queue before spilling it
+        """
+        try:
+            self._queue.put(doc, timeout=self.put_timeout)
+        except queue.Full:
+            self._spill([doc])
+
+    def flush(self):
+        """
+        Send the queued documents without waiting for the flush interval.
+        Does not block.
+        """
+        try:
+            self._queue.put_nowait(_FLUSH)
+        except queue.Full:
+            # The next batch is already full
+            pass
+
+    def close(self, timeout=None):
+        """
+        Send the queued documents and stop the background thread, spilling the
+        documents not sent within `timeout` seconds
+        """
+        self._stop_event.set()
+        try:
+            self._queue.put(_CLOSE, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._spill(self._drain())
+
+    def _drain(self):
+        docs = []
+        while True:
+            try:
+                doc = self._queue.get_nowait()
+            except queue.Empty:
+                return docs
+            if doc is not _FLUSH and doc is not _CLOSE:
+                docs.append(doc)
+
+    def _run(self):
+        self._replay_spill_file()
+        stopping = False
+        while not stopping:
+            # Wait for a full batch, the flush interval, a flush or close
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = None
+                if deadline is not None:
+                    timeout = max(deadline - time.time(), 0)
+                try:
+                    doc = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if doc is _FLUSH:
+                    break
+                if doc is _CLOSE:
+                    stopping = True
+                    break
+                batch.append(doc)
+                if deadline is None:
+                    deadline = time.time() + self.flush_interval
+
+            if len(batch) > 0:
+                try:
+                    self._send(batch)
+                except Exception as e:
+                    # i.e. documents that can't be serialized
+                    self.logger.exception("Failed to send %s document(s)",
+                                          len(batch))
+                    self.errors.append(e)
+
+    def _send(self, batch):
+        delay = self.backoff
+        for retry in range(self.max_retries + 1):
+            try:
+                success, errors = helpers.bulk(
+                    client=self.client, actions=batch, index=self.index,
+                    doc_type=self.doc_type, chunk_size=len(batch),
+                    raise_on_error=False)
+                self.num_sent += success
+                self.errors += errors
+                return
+            except TransportError as e:
+                retryable = (isinstance(e, ElasticConnectionError)
+                             or e.status_code in self.RETRY_STATUS)
+                if not retryable or retry == self.max_retries:
+                    self.logger.warning("Failed to send %s document(s): %s",
+                                        len(batch), e)
+                    break
+                # Don't wait when closing, spill the batch instead
+                if self._stop_event.wait(delay):
+                    break
+                delay = min(delay * 2, self.max_backoff)
+        self._spill(batch)
+
+    def _spill(self, docs):
+        if len(docs) == 0:
+            return
+        if self.spill_file is None:
+            self.logger.warning("Dropping %s document(s)", len(docs))
+            return
+        serializer = self.client.transport.serializer
+        with self._spill_lock, open(self.spill_file, "a") as f:
+            for doc in docs:
+                f.write(serializer.dumps(doc) + "\n")
+        self.num_spilled += len(docs)
+
+    def _replay_spill_file(self):
+        if self.spill_file is None or not os.path.exists(self.spill_file):
+            return
+        serializer = self.client.transport.serializer
+        with self._spill_lock:
+            with open(self.spill_file) as f:
+                docs = [serializer.loads(line) for line in f if line.strip()]
+            os.remove(self.spill_file)
+        for i in range(0, len(docs), self.batch_size):
+            self._send(docs[i:i + self.batch_size])
+
+
 class ElasticsearchLogger(Logger):
     """
     Elasticsearch Logging interface for `ray.tune`.
@@ -68,6 +281,11 @@ class ElasticsearchLogger(Logger):
     In addition to the regular ray tune log entry, this logger will add the
     the last git commit information and the current `logdir` to the results.
 
+    The results are sent by a :class:`BulkSender` from a background thread,
+    so the Tune event loop never waits for the cluster. Results that could not
+    be sent are kept in "elasticsearch_spill.jsonl" in the trial directory, and
+    sent the next time the logger of the trial starts.
+
     The following environment variables are used to configure the
     :class:`elasticsearch.Elasticsearch` client:
 
@@ -83,6 +301,9 @@ class ElasticsearchLogger(Logger):
     The elasticsearch index name is based on the current results root path. You
     may override this behavior and use a specific index name for your experiment
     using the configuration key `elasticsearch_index`.
+
+    The background sender is configured with the "elasticsearch_sender"
+    configuration key, a dict of :class:`BulkSender` parameters.
     """
 
     def _init(self):
@@ -91,23 +312,18 @@ class ElasticsearchLogger(Logger):
         self.client = create_elastic_client(**elasticsearch_args)
 
         # Save git information
-        self.git_remote = subprocess.check_output(
-            ["git", "ls-remote", "--get-url"]).decode("ascii").strip()
-        self.git_branch = subprocess.check_output(
-            ["git", "rev-parse", "--abbrev-ref", "HEAD"]).decode("ascii").strip()
-        self.git_sha = subprocess.check_output(
-            ["git", "rev-parse", "HEAD"]).decode("ascii").strip()
-        self.git_user = subprocess.check_output(
-            ["git", "log", "-n", "1", "--pretty=format:%an"]).decode("ascii").strip()
+        git = git_info()
+        self.git_remote = git["remote"]
+        self.git_branch = git["branch"]
+        self.git_sha = git["sha"]
+        self.git_user = git["user"]
 
         # Check for elasticsearch index name in configuration
         index_name = self.config.get("elasticsearch_index")
         if index_name is None:
             # Create default index name based on log path and git repo name
-            git_root = subprocess.check_output(
-                ["git", "rev-parse", "--show-toplevel"]).decode("ascii").strip()
             repo_name = os.path.basename(self.git_remote).rstrip(".git")
-            path_name = os.path.relpath(self.config["path"], git_root)
+            path_name = os.path.relpath(self.config["path"], git["root"])
             index_name = os.path.join(repo_name, path_name)
 
             # slugify index name
@@ -115,12 +331,17 @@ class ElasticsearchLogger(Logger):
 
         self.index_name = index_name
 
+        sender_args = dict(spill_file=os.path.join(self.logdir,
+                                                   "elasticsearch_spill.jsonl"))
+        sender_args.update(self.config.get("elasticsearch_sender", {}))
+
         self.logdir = os.path.basename(self.logdir)
         self.experiment_name = self.config["name"]
-        self.buffer = []
+        self.sender = BulkSender(self.client, self.index_name,
+                                 self.experiment_name, **sender_args)
 
     def on_result(self, result):
-        """Given a result, appends it to the existing log."""
+        """Given a result, queues it to be sent."""
         log_entry = {
             "git": {
                 "remote": self.git_remote,
@@ -135,23 +356,17 @@ class ElasticsearchLogger(Logger):
         result["timestamp"] = datetime.utcfromtimestamp(timestamp).isoformat()
 
         log_entry.update(result)
-        self.buffer.append(log_entry)
+        self.sender.put(log_entry)
 
     def close(self):
-        self.flush()
+        self.sender.close()
+        if self.sender.errors:
+            raise BulkIndexError("{} document(s) failed to index.".
+                                 format(len(self.sender.errors)),
+                                 self.sender.errors)
 
     def flush(self):
-        if len(self.buffer) > 0:
-            results = helpers.parallel_bulk(client=self.client,
-                                            actions=self.buffer,
-                                            index=self.index_name,
-                                            doc_type=self.experiment_name)
-            errors = [status for success, status in results if not success]
-            if errors:
-                raise BulkIndexError("{} document(s) failed to index.".
-                                     format(len(errors)), errors)
-
-            self.buffer.clear()
+        self.sender.flush()
 
 
 def elastic_dsl(client, dsl, index, **kwargs):
@@ -25,7 +25,7 @@ from ray.tune.trial_runner import _TuneFunctionDecoder
 
 
 def load_ray_tune_experiments(
-    experiment_path, load_results=False
+    experiment_path, load_results=False, index=None
 ):
     """Load multiple ray tune experiment states. This is useful if you want
     to collect the results from multiple runs into one collection
@@ -34,6 +34,9 @@ def load_ray_tune_experiments(
     :type experiment_path: str
     :param load_results: Whether or not to load experiment results
     :type load_results: bool
+    :param index: Optional index used to load the results, only reading the
+                  results added since the last load
+    :type index: :class:`nupic.research.support.results_index.ResultsIndex`
 
     :return: list of dictionaries with ray tune experiment state results
     :rtype: list(dict)
@@ -45,7 +48,7 @@ def load_ray_tune_experiments(
         raise RuntimeError("No experiment state found: " + experiment_path)
 
     experiment_states = [
-        load_ray_tune_experiment(experiment_path, filename, load_results)
+        load_ray_tune_experiment(experiment_path, filename, load_results, index)
         for filename in experiment_state_paths
     ]
 
@@ -53,7 +56,7 @@ def load_ray_tune_experiments(
 
 
 def load_ray_tune_experiment(
-    experiment_path, experiment_filename=None, load_results=False
+    experiment_path, experiment_filename=None, load_results=False, index=None
 ):
     """Load ray tune experiment state.
 
@@ -63,6 +66,9 @@ def load_ray_tune_experiment(
     :type experiment_filename: str
     :param load_results: Whether or not to load experiment results
     :type load_results: bool
+    :param index: Optional index used to load the results, only reading the
+                  results added since the last load
+    :type index: :class:`nupic.research.support.results_index.ResultsIndex`
 
     :return: dictionary with ray tune experiment state results
     :rtype: dict
@@ -84,6 +90,9 @@ def load_ray_tune_experiment(
     if "checkpoints" not in experiment_state:
         raise RuntimeError("Experiment state is invalid; no checkpoints found!")
 
+    if load_results and index is not None:
+        index.update(experiment_path)
+
     all_experiments = experiment_state["checkpoints"]
     for experiment in all_experiments:
         # Make logs relative to experiment path
@@ -91,7 +100,13 @@ def load_ray_tune_experiment(
         logpath = os.path.join(experiment_path, os.path.basename(logdir))
         experiment["results"] = None
 
-        if load_results:
+        if load_results and index is not None:
+            results = index.results(os.path.abspath(os.path.expanduser(logpath)))
+            if not results:
+                print("No data for experiment:", experiment["experiment_tag"])
+                continue
+            experiment["results"] = results
+        elif load_results:
             # Load results
             result_file = os.path.join(logpath, "result.json")
             if not result_file:
@@ -0,0 +1,365 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+import csv
+import glob
+import io
+import json
+import os
+import sqlite3
+from collections import defaultdict
+
+import pandas as pd
+
+__all__ = [
+    "ResultsIndex",
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, mtime REAL, size INTEGER, offset INTEGER,
+    num_rows INTEGER, header TEXT
+);
+CREATE TABLE IF NOT EXISTS trials (
+    trial_id TEXT PRIMARY KEY, experiment_path TEXT, params TEXT
+);
+CREATE TABLE IF NOT EXISTS state_trials (
+    experiment_state TEXT, position INTEGER, trial_id TEXT, experiment_tag TEXT,
+    PRIMARY KEY (experiment_state, position)
+);
+CREATE TABLE IF NOT EXISTS params (
+    trial_id TEXT, key TEXT, value, PRIMARY KEY (trial_id, key)
+);
+CREATE INDEX IF NOT EXISTS params_key_value ON params (key, value);
+CREATE TABLE IF NOT EXISTS progress (
+    trial_id TEXT, name TEXT, chunk INTEGER, "values" TEXT,
+    PRIMARY KEY (trial_id, name, chunk)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS results (
+    trial_id TEXT, row INTEGER, data TEXT, PRIMARY KEY (trial_id, row)
+) WITHOUT ROWID;
+"""
+
+_OPERATORS = ("=", "!=", "<", "<=", ">", ">=", "in")
+
+
+def _flatten(params, prefix=""):
+    flat = {}
+    for key, value in params.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + "/"))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def _param_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return json.dumps(value)
+
+
+def _csv_value(value):
+    if value == "":
+        return None
+    if value in ("True", "False"):
+        return value == "True"
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+class ResultsIndex(object):
+    """
+    Local SQLite index of Ray Tune experiment directories.
+
+    :meth:`update` ingests the `experiment_state*.json`, `params.json`,
+    `progress.csv` and `result.json` files of an experiment. The files are
+    keyed by path, modification time and size: unchanged files are skipped and
+    only the rows appended to `progress.csv` and `result.json` since the last
+    update are read.
+
+    The `progress.csv` values are stored by trial and column, as a JSON array
+    per column and update, so only the requested trials and columns are read
+    by :meth:`progress`. The trials can be
+    filtered by their parameters with :meth:`trial_ids`, which runs the filters
+    in the database.
+
+    Example::
+
+        index = ResultsIndex("~/nta/results/index.sqlite")
+        index.update("~/nta/results/my_experiment")
+        trial_ids = index.trial_ids(where={"lr": ("<", 0.1), "network": "GSC"})
+        progress = index.progress(trial_ids, columns=["val_acc"])
+
+    :param path: Path of the database, created if needed
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, experiment_path):
+        """
+        Ingest the new and modified files of an experiment
+
+        :param experiment_path: ray tune experiment directory
+        :return: number of new progress and result rows
+        """
+        experiment_path = os.path.abspath(os.path.expanduser(experiment_path))
+        num_rows = 0
+        with self.connection:
+            for state_file in sorted(glob.glob(
+                    os.path.join(experiment_path, "experiment_state*.json"))):
+                self._update_state(experiment_path, state_file)
+
+            trial_ids = [row[0] for row in self.connection.execute(
+                "SELECT trial_id FROM trials WHERE experiment_path = ?",
+                (experiment_path,))]
+            for trial_id in trial_ids:
+                self._update_params(trial_id)
+                num_rows += self._update_progress(trial_id)
+                num_rows += self._update_results(trial_id)
+        return num_rows
+
+    def experiment_states(self, experiment_path):
+        """
+        Experiment state files of an experiment and their trials, with newer
+        experiment states last
+
+        :return: list of tuples (experiment state path, list of tuples
+                 (trial_id, experiment_tag))
+        """
+        experiment_path = os.path.abspath(os.path.expanduser(experiment_path))
+        states = defaultdict(list)
+        for state_file, trial_id, tag in self.connection.execute(
+                "SELECT s.experiment_state, s.trial_id, s.experiment_tag "
+                "FROM state_trials s JOIN trials t ON s.trial_id = t.trial_id "
+                "WHERE t.experiment_path = ? "
+                "ORDER BY s.experiment_state, s.position", (experiment_path,)):
+            states[state_file].append((trial_id, tag))
+        return sorted(states.items())
+
+    def trial_ids(self, experiment_path=None, where=None):
+        """
+        Trials matching all the parameter filters
+
+        :param experiment_path: Only trials of this experiment
+        :param where: dict mapping flattened parameter names ("model/lr") to a
+                      value, or to a tuple (operator, value) with one of the
+                      operators "=", "!=", "<", "<=", ">", ">=" or "in"
+        :return: list of trial ids
+        """
+        sql = "SELECT trial_id FROM trials WHERE 1"
+        args = []
+        if experiment_path is not None:
+            sql += " AND experiment_path = ?"
+            args.append(os.path.abspath(os.path.expanduser(experiment_path)))
+        for key, condition in (where or {}).items():
+            op, value = condition if isinstance(condition, tuple) else ("=", condition)
+            if op not in _OPERATORS:
+                raise ValueError(f"Unknown operator {op}, expected one of {_OPERATORS}")
+            if op == "in":
+                values = [_param_value(v) for v in value]
+                test = "value IN ({})".format(", ".join("?" * len(values)))
+            else:
+                values = [_param_value(value)]
+                test = f"value {op} ?"
+            sql += (" AND trial_id IN (SELECT trial_id FROM params "
+                    f"WHERE key = ? AND {test})")
+            args += [key] + values
+        return [row[0] for row in self.connection.execute(sql + " ORDER BY trial_id",
+                                                          args)]
+
+    def params(self, trial_id):
+        """
+        Contents of the `params.json` of a trial
+        """
+        row = self.connection.execute(
+            "SELECT params FROM trials WHERE trial_id = ?", (trial_id,)).fetchone()
+        return None if row is None or row[0] is None else json.loads(row[0])
+
+    def progress(self, trial_ids, columns=None):
+        """
+        Contents of the `progress.csv` of trials, reading only the `columns`
+
+        :return: dict mapping the trial ids with progress to a
+                 :class:`pandas.DataFrame`
+        """
+        progress = {}
+        for trial_id in trial_ids:
+            sql = 'SELECT name, "values" FROM progress WHERE trial_id = ?'
+            args = [trial_id]
+            if columns is not None:
+                sql += " AND name IN ({})".format(", ".join("?" * len(columns)))
+                args += list(columns)
+            data = defaultdict(list)
+            for name, values in self.connection.execute(sql + " ORDER BY chunk",
+                                                        args):
+                data[name] += json.loads(values)
+            if len(data) == 0:
+                continue
+            header = self._header(os.path.join(trial_id, "progress.csv"))
+            names = [n for n in header if n in data]
+            progress[trial_id] = pd.DataFrame(
+                {name: data[name] for name in names}).infer_objects()
+        return progress
+
+    def results(self, trial_id):
+        """
+        Rows of the `result.json` of a trial
+        """
+        return [json.loads(data) for (data,) in self.connection.execute(
+            "SELECT data FROM results WHERE trial_id = ? ORDER BY row",
+            (trial_id,))]
+
+    def _header(self, path):
+        row = self.connection.execute(
+            "SELECT header FROM files WHERE path = ?", (path,)).fetchone()
+        return None if row is None or row[0] is None else json.loads(row[0])
+
+    def _changed(self, path):
+        """
+        :return: None if the file is unchanged or missing, otherwise tuple
+                 (stat, offset, num_rows, header) of the previous update, reset
+                 when the file was rewritten
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        row = self.connection.execute(
+            "SELECT mtime, size, offset, num_rows, header FROM files WHERE path = ?",
+            (path,)).fetchone()
+        if row is None:
+            return stat, 0, 0, None
+        mtime, size, offset, num_rows, header = row
+        if mtime == stat.st_mtime and size == stat.st_size:
+            return None
+        if stat.st_size < offset:
+            # Rewritten, ingest again
+            return stat, 0, 0, None
+        return stat, offset, num_rows, None if header is None else json.loads(header)
+
+    def _save_file(self, path, stat, offset, num_rows, header=None):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (path, stat.st_mtime, stat.st_size, offset, num_rows,
+             None if header is None else json.dumps(header)))
+
+    @staticmethod
+    def _read_lines(path, offset):
+        # Only complete lines, the last line may still be written
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        return data[:end].decode(), offset + end
+
+    def _update_state(self, experiment_path, state_file):
+        changed = self._changed(state_file)
+        if changed is None:
+            return
+        with open(state_file) as f:
+            experiment_state = json.load(f)
+
+        self.connection.execute(
+            "DELETE FROM state_trials WHERE experiment_state = ?", (state_file,))
+        position = 0
+        for checkpoint in experiment_state.get("checkpoints", []):
+            logdir = checkpoint.get("logdir")
+            if logdir is None:
+                continue
+            trial_id = os.path.join(experiment_path, os.path.basename(logdir))
+            self.connection.execute(
+                "INSERT OR IGNORE INTO trials (trial_id, experiment_path) "
+                "VALUES (?, ?)", (trial_id, experiment_path))
+            self.connection.execute(
+                "INSERT INTO state_trials VALUES (?, ?, ?, ?)",
+                (state_file, position, trial_id, checkpoint.get("experiment_tag")))
+            position += 1
+        self._save_file(state_file, changed[0], changed[0].st_size, position)
+
+    def _update_params(self, trial_id):
+        path = os.path.join(trial_id, "params.json")
+        changed = self._changed(path)
+        if changed is None:
+            return
+        with open(path) as f:
+            params = json.load(f)
+
+        self.connection.execute(
+            "UPDATE trials SET params = ? WHERE trial_id = ?",
+            (json.dumps(params), trial_id))
+        self.connection.execute("DELETE FROM params WHERE trial_id = ?", (trial_id,))
+        self.connection.executemany(
+            "INSERT INTO params VALUES (?, ?, ?)",
+            [(trial_id, key, _param_value(value))
+             for key, value in _flatten(params).items()])
+        self._save_file(path, changed[0], changed[0].st_size, 1)
+
+    def _update_progress(self, trial_id):
+        path = os.path.join(trial_id, "progress.csv")
+        changed = self._changed(path)
+        if changed is None:
+            return 0
+        stat, offset, num_rows, header = changed
+        if offset == 0:
+            self.connection.execute(
+                "DELETE FROM progress WHERE trial_id = ?", (trial_id,))
+
+        text, offset = self._read_lines(path, offset)
+        rows = [row for row in csv.reader(io.StringIO(text)) if row]
+        if header is None and len(rows) > 0:
+            header, rows = rows[0], rows[1:]
+        if len(rows) > 0:
+            # One chunk per column with the new rows, starting at num_rows
+            self.connection.executemany(
+                "INSERT INTO progress VALUES (?, ?, ?, ?)",
+                [(trial_id, name, num_rows,
+                  json.dumps([_csv_value(row[i]) if i < len(row) else None
+                              for row in rows]))
+                 for i, name in enumerate(header)])
+        self._save_file(path, stat, offset, num_rows + len(rows), header)
+        return len(rows)
+
+    def _update_results(self, trial_id):
+        path = os.path.join(trial_id, "result.json")
+        changed = self._changed(path)
+        if changed is None:
+            return 0
+        stat, offset, num_rows, _ = changed
+        if offset == 0:
+            self.connection.execute(
+                "DELETE FROM results WHERE trial_id = ?", (trial_id,))
+
+        text, offset = self._read_lines(path, offset)
+        rows = [line for line in text.splitlines() if line.strip()]
+        self.connection.executemany(
+            "INSERT INTO results VALUES (?, ?, ?)",
+            [(trial_id, num_rows + i, row) for i, row in enumerate(rows)])
+        self._save_file(path, stat, offset, num_rows + len(rows))
+        return len(rows)
@@ -0,0 +1,184 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+"""
+Compare the training step time and activation memory of the fused local
+reparameterization forward with the previous two-convolution forward, on the
+VDrop and LocalReparamBinaryGated variants of the ResNet and AlexNet networks.
+
+Memory is the peak CUDA memory on GPU, otherwise the size of the tensors saved
+for the backward pass (requires torch >= 1.10).
+"""
+import argparse
+import time
+from functools import partial
+
+import torch
+import torch.nn.functional as F
+from tabulate import tabulate
+from torch import nn
+
+from nupic.research.frameworks.backprop_structure.modules import (
+    VDropConv2d,
+    VDropLinear,
+)
+from nupic.research.frameworks.backprop_structure.modules.binary_layers import (
+    LocalReparamBinaryGatedConv2d,
+    LocalReparamBinaryGatedLinear,
+)
+from nupic.research.frameworks.backprop_structure.networks import (
+    gsc_alexnet,
+    resnet50_fixedvdrop_imagenet,
+)
+from nupic.research.frameworks.backprop_structure.networks.resnet import (
+    BasicBlock,
+    ResNet,
+    imagenet_stem,
+)
+
+
+def replace_layers(model, conv_class, linear_class):
+    """
+    Replace the nn.Conv2d and nn.Linear layers of the model
+    """
+    for name, child in model.named_children():
+        if isinstance(child, nn.Conv2d):
+            layer = conv_class(child.in_channels, child.out_channels,
+                               child.kernel_size, stride=child.stride,
+                               padding=child.padding, dilation=child.dilation,
+                               groups=child.groups, bias=child.bias is not None)
+        elif isinstance(child, nn.Linear):
+            layer = linear_class(child.in_features, child.out_features,
+                                 bias=child.bias is not None)
+        else:
+            replace_layers(child, conv_class, linear_class)
+            continue
+        setattr(model, name, layer)
+    return model
+
+
+def vdrop_conv(in_planes, out_planes, stride=1, groups=1, dilation=1,
+               kernel_size=3):
+    return VDropConv2d(in_planes, out_planes, kernel_size, stride=stride,
+                       padding=dilation * (kernel_size // 2), dilation=dilation,
+                       groups=groups, bias=False)
+
+
+def resnet18_vdrop(num_classes):
+    return ResNet(block=BasicBlock, layers=[2, 2, 2, 2], num_classes=num_classes,
+                  stem_layer=imagenet_stem,
+                  conv1x1_layer=partial(vdrop_conv, kernel_size=1),
+                  conv3x3_layer=partial(vdrop_conv, kernel_size=3))
+
+
+NETWORKS = {
+    "resnet18_vdrop": (lambda: resnet18_vdrop(num_classes=1000), (3, 224, 224)),
+    "resnet50_fixedvdrop": (lambda: resnet50_fixedvdrop_imagenet(num_classes=1000),
+                            (3, 224, 224)),
+    "alexnet_vdrop": (lambda: replace_layers(gsc_alexnet(), VDropConv2d,
+                                             VDropLinear),
+                      (1, 32, 32)),
+    "alexnet_localreparam": (
+        lambda: replace_layers(gsc_alexnet(), LocalReparamBinaryGatedConv2d,
+                               LocalReparamBinaryGatedLinear),
+        (1, 32, 32)),
+}
+
+
+def set_fused(model, fused):
+    for module in model.modules():
+        if hasattr(module, "fused"):
+            module.fused = fused
+
+
+def saved_tensors_bytes(step):
+    """
+    Size of the tensors kept for the backward pass by `step`
+    """
+    hooks = getattr(torch.autograd.graph, "saved_tensors_hooks", None)
+    if hooks is None:
+        return float("nan")
+    saved = {}
+
+    def pack(tensor):
+        saved[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+        return tensor
+
+    with hooks(pack, lambda tensor: tensor):
+        step()
+    return sum(saved.values())
+
+
+def benchmark(name, batch_size, steps, device):
+    create_model, input_size = NETWORKS[name]
+    model = create_model().to(device)
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+    x = torch.rand(batch_size, *input_size, device=device)
+    num_classes = model(x[:2]).shape[-1]
+    target = torch.randint(0, num_classes, (batch_size,), device=device)
+
+    def step():
+        optimizer.zero_grad()
+        F.cross_entropy(model(x), target).backward()
+        optimizer.step()
+
+    rows = []
+    for fused in (False, True):
+        set_fused(model, fused)
+        step()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_max_memory_allocated(device)
+            step()
+            memory = torch.cuda.max_memory_allocated(device)
+        else:
+            memory = saved_tensors_bytes(lambda: F.cross_entropy(model(x), target))
+
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(steps):
+            step()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        step_time = (time.perf_counter() - start) / steps
+        rows.append([name, "fused" if fused else "two convs", step_time,
+                     memory / 2 ** 20])
+    return rows
+
+
+def main(args):
+    device = torch.device(args.device)
+    rows = []
+    for name in args.networks:
+        rows.extend(benchmark(name, args.batch_size, args.steps, device))
+    print(tabulate(rows, headers=["network", "forward", "step (s)", "memory (MB)"],
+                   floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--networks", nargs="+", default=list(NETWORKS.keys()),
+                        choices=list(NETWORKS.keys()))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available()
+                        else "cpu")
+    main(parser.parse_args())
@@ -0,0 +1,124 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2019, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+# Microbenchmark: batched DSLinear coactivation update vs. the per-sample
+# torch.ger loop it replaced.
+#
+#   python benchmark_linear_coactivations.py [--device cuda] [--repeats 20]
+
+import argparse
+import itertools
+from time import perf_counter
+
+import torch
+from tabulate import tabulate
+
+from nupic.research.frameworks.dynamic_sparse.networks import DSLinear
+
+
+def loop_coactivations(x, y, binary=True):
+    """Reference implementation: one outer product per sample."""
+    if binary:
+        prev_act, curr_act = (x > 0).float(), (y > 0).float()
+    else:
+        prev_act, curr_act = x.float(), y.float()
+    outer = 0
+    for s in range(x.shape[0]):
+        outer += torch.ger(curr_act[s], prev_act[s])
+    return outer
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def time_it(fn, device, repeats):
+    fn()
+    synchronize(device)
+    t0 = perf_counter()
+    for _ in range(repeats):
+        fn()
+    synchronize(device)
+    return (perf_counter() - t0) / repeats
+
+
+def main(args):
+    device = torch.device(args.device)
+    rows = []
+    for batch_size, features, binary in itertools.product(
+        args.batch_sizes, args.features, (True, False)
+    ):
+        layer = DSLinear(features, features).to(device)
+        # Set directly: a falsy value in the config falls back to the default.
+        layer.use_binary_coactivations = binary
+        layer.init_coactivation_tracking()
+        x = torch.randn(batch_size, features, device=device)
+        with torch.no_grad():
+            y = layer(x)
+        layer.reset_coactivations()
+
+        expected = loop_coactivations(x, y, binary=binary)
+        layer._update_coactivations(x, y)
+        max_err = float((layer.coactivations - expected).abs().max())
+
+        t_loop = time_it(lambda: loop_coactivations(x, y, binary), device, args.repeats)
+        t_batch = time_it(
+            lambda: layer._update_coactivations(x, y), device, args.repeats
+        )
+        rows.append(
+            [
+                batch_size,
+                features,
+                "binary" if binary else "real",
+                t_loop * 1000,
+                t_batch * 1000,
+                t_loop / t_batch,
+                max_err,
+            ]
+        )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "batch",
+                "features",
+                "mode",
+                "loop (ms)",
+                "batched (ms)",
+                "speedup",
+                "max abs err",
+            ],
+            floatfmt=".3f",
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark batched vs. per-sample DSLinear coactivations"
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 128, 1024])
+    parser.add_argument("--features", type=int, nargs="+", default=[64, 512, 2048])
+    main(parser.parse_args())
@@ -0,0 +1,128 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+# Benchmark: time spent in the end-of-epoch prune/grow step of DSNN models
+# (`_reinitialize_weights`) for GSC- and ResNet-sized networks.
+#
+#   python benchmark_prune_grow.py [--device cuda] [--epochs 5]
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import torch
+from tabulate import tabulate
+
+from nupic.research.frameworks.dynamic_sparse.models import DSNNMixedHeb, SET
+from nupic.research.frameworks.dynamic_sparse.networks import (
+    gsc_sparse_cnn,
+    resnet18,
+    resnet50,
+)
+
+NETWORKS = {
+    "gsc": lambda: gsc_sparse_cnn({}),
+    "resnet18": lambda: resnet18(config=dict(num_classes=1000)),
+    "resnet50": lambda: resnet50(config=dict(num_classes=1000)),
+}
+
+MODELS = {
+    "SET": (SET, dict(weight_prune_perc=0.3)),
+    "DSNNMixedHeb": (
+        DSNNMixedHeb,
+        dict(weight_prune_perc=0.3, hebbian_prune_perc=0.3),
+    ),
+    "DSNNMixedHeb (hebbian grow)": (
+        DSNNMixedHeb,
+        dict(weight_prune_perc=0.3, hebbian_prune_perc=0.3, hebbian_grow=True),
+    ),
+}
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def main(args):
+    device = torch.device(args.device)
+    rows = []
+    for network_name in args.networks:
+        for model_name, (model_class, config) in MODELS.items():
+            network = NETWORKS[network_name]()
+            model = model_class(
+                network, config=dict(device=args.device, on_perc=0.1, **config)
+            )
+            model.setup()
+            num_params = sum(np.prod(m.shape) for m in model.sparse_modules)
+
+            times = []
+            for _ in range(args.epochs):
+                # Stand-in for a training epoch: new weights and coactivations.
+                with torch.no_grad():
+                    for module in model.sparse_modules:
+                        module.m.weight.normal_().mul_(module.mask)
+                        if module.hebbian_prune:
+                            module.m.coactivations.uniform_()
+
+                synchronize(device)
+                t0 = perf_counter()
+                model._reinitialize_weights()
+                synchronize(device)
+                times.append(perf_counter() - t0)
+
+            rows.append(
+                [
+                    network_name,
+                    model_name,
+                    len(model.sparse_modules),
+                    num_params / 1e6,
+                    np.mean(times) * 1000,
+                    np.max(times) * 1000,
+                ]
+            )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "network",
+                "model",
+                "sparse modules",
+                "params (M)",
+                "mean (ms/epoch)",
+                "max (ms/epoch)",
+            ],
+            floatfmt=".2f",
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the prune/grow step of DSNN models"
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument(
+        "--networks", nargs="+", default=list(NETWORKS), choices=list(NETWORKS)
+    )
+    main(parser.parse_args())
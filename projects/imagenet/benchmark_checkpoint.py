@@ -0,0 +1,116 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+"""
+Compare save/restore throughput of the gzip and flat checkpoint formats on
+ResNet-50 plus SGD optimizer state, as saved by `ImagenetExperiment.get_state`.
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import torch
+from tabulate import tabulate
+from torchvision.models import resnet50
+
+from nupic.research.frameworks.pytorch.model_utils import (
+    deserialize_state_dict,
+    load_flat_state_dict,
+    serialize_flat_state_dict,
+    serialize_state_dict,
+)
+
+
+def create_state():
+    model = resnet50()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+    model(torch.rand(2, 3, 64, 64)).sum().backward()
+    optimizer.step()
+    return model, optimizer
+
+
+def timed(func, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = func()
+    return (time.perf_counter() - start) / repeats, result
+
+
+def save_bytes(serialize, model, optimizer):
+    state = {}
+    for name, obj in (("model", model), ("optimizer", optimizer)):
+        with io.BytesIO() as buffer:
+            serialize(buffer, obj.state_dict())
+            state[name] = buffer.getvalue()
+    return state
+
+
+def restore_bytes(state, model, optimizer):
+    for name, obj in (("model", model), ("optimizer", optimizer)):
+        with io.BytesIO(state[name]) as buffer:
+            obj.load_state_dict(deserialize_state_dict(buffer))
+
+
+def main(repeats):
+    model, optimizer = create_state()
+    size_mb = sum(
+        t.numel() * t.element_size() for t in model.state_dict().values()
+    ) * 2 / 2 ** 20
+
+    rows = []
+    for name, serialize in (("gzip", serialize_state_dict),
+                            ("flat", serialize_flat_state_dict)):
+        save_time, state = timed(
+            lambda: save_bytes(serialize, model, optimizer), repeats)
+        restore_time, _ = timed(
+            lambda: restore_bytes(state, model, optimizer), repeats)
+        checkpoint_mb = sum(len(v) for v in state.values()) / 2 ** 20
+        rows.append([name, checkpoint_mb, save_time, restore_time,
+                     size_mb / save_time, size_mb / restore_time])
+
+    # Flat file, memory mapped and loaded lazily: read a single key
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "model.flat")
+
+        def save_file():
+            with open(path, "wb") as fileobj:
+                serialize_flat_state_dict(fileobj, model.state_dict())
+
+        save_time, _ = timed(save_file, repeats)
+        lazy_time, _ = timed(
+            lambda: load_flat_state_dict(path)["fc.weight"], repeats)
+        restore_time, _ = timed(
+            lambda: model.load_state_dict(load_flat_state_dict(path).to_dict()),
+            repeats)
+        rows.append(["flat file (model only)", os.path.getsize(path) / 2 ** 20,
+                     save_time, restore_time, size_mb / 2 / save_time,
+                     size_mb / 2 / restore_time])
+        print(f"Lazy load of a single key from the mapped file: {lazy_time:.4f}s")
+
+    print(tabulate(rows, headers=["format", "size (MB)", "save (s)", "restore (s)",
+                                  "save (MB/s)", "restore (MB/s)"],
+                   floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, default=3)
+    main(parser.parse_args().repeats)
@@ -0,0 +1,109 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+"""
+Compare the time to the end of the first training batch of a sequence of short
+trials creating new experiment workers for every trial, as `ImagenetTrainable`
+does by default, against reusing a pool of workers reset in place with
+`reset_experiment`, as `ImagenetTrainable` does with `reuse_actors=True`.
+"""
+import argparse
+import time
+
+import numpy as np
+import ray
+import torch
+from tabulate import tabulate
+from torchvision.models import resnet50
+
+from nupic.research.frameworks.pytorch.imagenet import ImagenetExperiment
+from nupic.research.frameworks.pytorch.imagenet.experiment_utils import get_free_port
+from nupic.research.frameworks.pytorch.test_utils import TempFakeSavedData
+
+
+def trial_config(data, lr, world_size):
+    return dict(
+        data=data.dataset_path,
+        num_classes=data.train_num_classes,
+        batch_size=16,
+        batches_in_epoch=1,
+        epochs_to_validate=[],
+        model_class=resnet50,
+        model_args=dict(num_classes=data.train_num_classes),
+        optimizer_class=torch.optim.SGD,
+        optimizer_args=dict(lr=lr, momentum=0.9),
+        distributed=True,
+        backend="gloo",
+        world_size=world_size,
+        log_level="WARNING",
+    )
+
+
+def create_workers(world_size):
+    experiment = ray.remote(num_cpus=1)(ImagenetExperiment)
+    return [experiment.remote() for _ in range(world_size)]
+
+
+def run_first_batch(workers, config, method):
+    dist_url = f"tcp://127.0.0.1:{get_free_port()}"
+    status = []
+    for rank, w in enumerate(workers):
+        worker_config = dict(config, rank=rank, dist_url=dist_url)
+        status.append(getattr(w, method).remote(worker_config))
+    ray.get(status)
+    ray.get([w.run_epoch.remote() for w in workers])
+
+
+def main(num_trials, world_size):
+    ray.init(num_cpus=world_size)
+    learning_rates = np.logspace(-3, -1, num_trials)
+    with TempFakeSavedData(train_size=64, val_size=16, num_classes=10) as data:
+        new_workers = []
+        for lr in learning_rates:
+            start = time.perf_counter()
+            workers = create_workers(world_size)
+            run_first_batch(workers, trial_config(data, lr, world_size),
+                            "setup_experiment")
+            new_workers.append(time.perf_counter() - start)
+            ray.get([w.stop_experiment.remote() for w in workers])
+            for w in workers:
+                ray.kill(w)
+
+        pool = create_workers(world_size)
+        pooled_workers = []
+        for i, lr in enumerate(learning_rates):
+            start = time.perf_counter()
+            run_first_batch(pool, trial_config(data, lr, world_size),
+                            "setup_experiment" if i == 0 else "reset_experiment")
+            pooled_workers.append(time.perf_counter() - start)
+    ray.shutdown()
+
+    rows = [[i, new, pooled] for i, (new, pooled)
+            in enumerate(zip(new_workers, pooled_workers))]
+    rows.append(["mean", np.mean(new_workers), np.mean(pooled_workers)])
+    print(tabulate(rows, headers=["trial", "new workers (s)", "worker pool (s)"],
+                   floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-trials", type=int, default=4)
+    parser.add_argument("--world-size", type=int, default=2)
+    args = parser.parse_args()
+    main(args.num_trials, args.world_size)
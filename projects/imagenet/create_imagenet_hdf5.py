@@ -17,16 +17,14 @@
 #
 #  http://numenta.org/licenses/
 #
-import multiprocessing
-from concurrent.futures import ProcessPoolExecutor
-from functools import partial
 from pathlib import Path
 
-import h5py
 import numpy as np
 from PIL import Image
 from tqdm import tqdm
 
+from nupic.research.frameworks.pytorch.dataset_utils import BatchedHDF5DataSaver
+
 TRAIN_DIR = "train"
 VAL_DIR = "val"
 # TRAIN_DIR = "sz/160/train"
@@ -50,45 +48,27 @@ def resize(sz, image_path):
     return resized_img
 
 
-def hdf5_save(group_name, lock, image_path):
+def read_image(image_path):
     """
-    Save imagenet images to HDF5
+    Read the raw image file bytes. Executed by the saver worker processes
 
-    :param group_name: top level group name ("train", "val", etc)
-    :param lock: Lock object used to control write access to hdf5 file
     :param image_path: Path object for the image file
     """
-    image_name = image_path.name
-    wnid = image_path.parent.name
-    image_data = image_path.read_bytes()
-
-    lock.acquire()
-    hdf5_file = h5py.File(name=HDF5_FILE, mode="a")
-    try:
-        main_group = hdf5_file.require_group(group_name)
-        wnid_group = main_group.require_group(wnid)
-        wnid_group.create_dataset(image_name, data=np.void(image_data))
-    finally:
-        hdf5_file.close()
-        lock.release()
-
-    return image_name
+    return np.void(image_path.read_bytes())
 
 
 def main():
-    with ProcessPoolExecutor(multiprocessing.cpu_count()) as executor, \
-            multiprocessing.Manager() as manager:
-
-        lock = manager.Lock()
-        hdf5_val = partial(hdf5_save, VAL_DIR, lock)
-        results = executor.map(hdf5_val, VAL_FILES)
-        for _ in tqdm(results, desc="Saving validation dataset"):
-            pass
-
-        hdf5_train = partial(hdf5_save, TRAIN_DIR, lock)
-        results = executor.map(hdf5_train, TRAIN_FILES)
-        for _ in tqdm(results, desc="Saving training dataset"):
-            pass
+    # Images are read in worker processes and written in batches, updating the
+    # HDF5Dataset image index as they are saved
+    with BatchedHDF5DataSaver(HDF5_FILE, to_bytes_func=read_image,
+                              batch_size=1024) as saver:
+        for image_path in tqdm(VAL_FILES, desc="Saving validation dataset"):
+            saver.append(image_path, image_path.name, VAL_DIR,
+                         image_path.parent.name)
+
+        for image_path in tqdm(TRAIN_FILES, desc="Saving training dataset"):
+            saver.append(image_path, image_path.name, TRAIN_DIR,
+                         image_path.parent.name)
 
 
 if __name__ == "__main__":
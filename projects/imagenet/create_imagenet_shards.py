@@ -0,0 +1,44 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2019, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+"""
+Convert the imagenet HDF5 file created by `create_imagenet_hdf5.py` into packed
+shards read sequentially by `ShardedDataset`. Use the output directory as the
+experiment "data" config to train from the shards.
+"""
+import argparse
+from pathlib import Path
+
+from nupic.research.frameworks.pytorch.dataset_utils import convert_hdf5_to_shards
+
+DATA_PATH = Path("~/nta/data/imagenet").expanduser()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--hdf5-file", default=str(DATA_PATH / "imagenet.hdf5"))
+    parser.add_argument("--output-dir", default=str(DATA_PATH / "shards"))
+    parser.add_argument("--groups", nargs="+", default=["train", "val"])
+    parser.add_argument("--shard-size-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    for group in args.groups:
+        shard_dir = convert_hdf5_to_shards(
+            hdf5_file=args.hdf5_file, root=group, output_dir=args.output_dir,
+            shard_size=args.shard_size_mb * 2 ** 20)
+        print("Saved {} shards to {}".format(group, shard_dir))
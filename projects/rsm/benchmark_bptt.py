@@ -0,0 +1,136 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+"""
+Compare the training throughput (tokens/sec, one token being a single timestep of
+a single sequence of the batch) of the RSM step loop, one optimizer step per
+timestep as in `RSMExperiment` with bptt=1, against truncated BPTT windows run by
+`RSMNet.forward_sequence`. The models follow the default PTB and sequence-MNIST
+configurations of ptb_experiments.cfg and mnist_experiments.cfg, trained on
+random inputs of the same shapes.
+"""
+import argparse
+import time
+
+import torch
+
+from rsm import RSMNet, RSMPredictor
+
+CONFIGS = {
+    "ptb": dict(
+        d_in=28, m=600, n=8, k=20, gamma=0.8, eps=0.85, predictor_output_size=10000
+    ),
+    "smnist": dict(
+        d_in=28 * 28, m=200, n=6, k=25, gamma=0.5, eps=0.0, predictor_output_size=4
+    ),
+}
+
+
+def create_model(config, device):
+    torch.manual_seed(18)
+    model = RSMNet(
+        d_in=config["d_in"],
+        d_out=config["d_in"],
+        m=config["m"],
+        n=config["n"],
+        k=config["k"],
+        gamma=config["gamma"],
+        eps=config["eps"],
+        boost_strength=1.0,
+    ).to(device)
+    predictor = RSMPredictor(
+        d_in=config["m"] * config["n"],
+        d_out=config["predictor_output_size"],
+        hidden_size=1200,
+    ).to(device)
+    return model, predictor
+
+
+def train(config, batch_size, num_steps, bptt, device):
+    """
+    Train on `num_steps` timesteps in windows of `bptt` timesteps
+    :return: tokens per second
+    """
+    model, predictor = create_model(config, device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.0005)
+    pred_optimizer = torch.optim.Adam(predictor.parameters(), lr=0.0005)
+    loss_fn = torch.nn.MSELoss()
+    pred_loss_fn = torch.nn.CrossEntropyLoss(reduction="sum")
+
+    inputs = torch.randn(num_steps + 1, batch_size, config["d_in"], device=device)
+    pred_targets = torch.randint(
+        config["predictor_output_size"], (num_steps, batch_size), device=device
+    )
+    hidden = model.init_hidden(batch_size)
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for t in range(0, num_steps, bptt):
+        hidden = tuple([h.detach() for h in hs] for hs in hidden)
+        optimizer.zero_grad()
+        pred_optimizer.zero_grad()
+
+        x = inputs[t : t + bptt]
+        if bptt == 1:
+            output, hidden = model(x[0], hidden)
+            x_b = hidden[0][0]
+        else:
+            output, x_b_seq, hidden = model.forward_sequence(x, hidden)
+            output = [o.flatten(0, 1) for o in output]
+            x_b = x_b_seq[0].flatten(0, 1)
+        targets = inputs[t + 1 : t + 1 + bptt].flatten(0, 1)
+        loss = loss_fn(output[0], targets)
+        loss.backward()
+        optimizer.step()
+        loss.item()
+
+        _, logits = predictor(x_b.detach())
+        pred_loss = pred_loss_fn(logits, pred_targets[t : t + bptt].flatten())
+        pred_loss.backward()
+        pred_optimizer.step()
+        pred_loss.item()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return num_steps * batch_size / (time.perf_counter() - start)
+
+
+def main(datasets, batch_size, num_steps, windows):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    for dataset in datasets:
+        config = CONFIGS[dataset]
+        # Warm up
+        train(config, batch_size, 2, 1, device)
+        step_loop = train(config, batch_size, num_steps, 1, device)
+        print("%s step loop: %.0f tokens/sec" % (dataset, step_loop))
+        for bptt in windows:
+            tokens_sec = train(config, batch_size, num_steps, bptt, device)
+            print(
+                "%s bptt=%d: %.0f tokens/sec (%.2fx)"
+                % (dataset, bptt, tokens_sec, tokens_sec / step_loop)
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--datasets", nargs="+", default=["ptb", "smnist"])
+    parser.add_argument("--batch-size", type=int, default=300)
+    parser.add_argument("--num-steps", type=int, default=70)
+    parser.add_argument("--windows", nargs="+", type=int, default=[5, 35])
+    args = parser.parse_args()
+    main(args.datasets, args.batch_size, args.num_steps, args.windows)
@@ -151,51 +151,43 @@ class RSMNet(torch.nn.Module):
                 mod._register_hooks()
         self.hooks_registered = True
 
-    def forward(self, x_a_batch, hidden):
+    def _step(self, x_a_batch, hidden, z_in=None):
         """
-        Each layer takes input (image batch from time sequence for first layer,
-        batch of hidden states from prior layer otherwise), and generates both:
-            - a prediction for the next input it will see
-            - a hidden state which is passed to the next layer
+        Update the hidden state of every layer for one timestep, without decoding
+        the predictions. See `forward` for the arguments.
 
-        Arguments:
-            x_a_batch: (bsz, d_in)
-            hidden: Tuple (x_b, phi, psi), each Tensor (n_layers, bsz, total_cells)
-                - x_b is (possibly normalized) winners without hysteresis/decayed memory
+        :param z_in: Precomputed `_input_activation` of x_a_batch in the first layer
 
         Returns:
-            output_by_layer: List of tensors
-                (n_layers, bsz, dim (total_cells or d_in for first layer))
+            y_by_layer: List of tensors (bsz, total_cells)
             new_hidden: Tuple of tensors (n_layers, bsz, total_cells)
         """
-        output_by_layer = []
+        y_by_layer = []
 
         new_x_b = []
         new_phi = []
         new_psi = []
 
         x_b, phi, psi = hidden
-        layer_input = x_a_batch
+        layers = list(self.children())
 
-        lid = 0
-        for (_layer_name, layer), lay_phi, lay_psi in zip(
-            self.named_children(), phi, psi
-        ):
-            last_layer = lid == len(phi) - 1
-            lay_above = list(self.children())[lid + 1] if not last_layer else None
-            lay_x_b = x_b[lid]
-            lay_x_above = x_b[lid + 1] if not last_layer else None
+        # Update memory psi with prior step winners and apply decay as per config,
+        # once per layer as the layer below also receives it as feedback
+        memory = [
+            layer._decay_memory(lay_psi, lay_x_b)
+            for layer, lay_x_b, lay_psi in zip(layers, x_b, psi)
+        ]
 
-            # Update memory psi with prior step winners and apply decay as per config
-            if lay_x_above is not None:
-                psi_above = psi[lid + 1]
-                lay_x_above = lay_above._decay_memory(psi_above, lay_x_above)
-            if lay_x_b is not None:
-                lay_x_b = layer._decay_memory(lay_psi, lay_x_b)
+        layer_input = x_a_batch
+        for lid, layer in enumerate(layers):
+            last_layer = lid == len(layers) - 1
+            lay_x_above = memory[lid + 1] if not last_layer else None
 
-            hidden_in = (lay_x_b, lay_x_above, lay_phi, lay_psi)
+            hidden_in = (memory[lid], lay_x_above, phi[lid], psi[lid])
 
-            pred_output, hidden = layer(layer_input, hidden_in)
+            y, hidden = layer._step(
+                layer_input, hidden_in, z_in=z_in if lid == 0 else None
+            )
 
             # If layers > 1, higher layers predict lower layer's phi
             # phi has hysteresis (if decay active), x_b is just winners
@@ -205,14 +197,76 @@ class RSMNet(torch.nn.Module):
             new_phi.append(hidden[1])
             new_psi.append(hidden[2])
 
-            output_by_layer.append(pred_output)
-
-            lid += 1
+            y_by_layer.append(y)
 
         new_hidden = (new_x_b, new_phi, new_psi)
 
+        return (y_by_layer, new_hidden)
+
+    def forward(self, x_a_batch, hidden):
+        """
+        Each layer takes input (image batch from time sequence for first layer,
+        batch of hidden states from prior layer otherwise), and generates both:
+            - a prediction for the next input it will see
+            - a hidden state which is passed to the next layer
+
+        Arguments:
+            x_a_batch: (bsz, d_in)
+            hidden: Tuple (x_b, phi, psi), each Tensor (n_layers, bsz, total_cells)
+                - x_b is (possibly normalized) winners without hysteresis/decayed memory
+
+        Returns:
+            output_by_layer: List of tensors
+                (n_layers, bsz, dim (total_cells or d_in for first layer))
+            new_hidden: Tuple of tensors (n_layers, bsz, total_cells)
+        """
+        y_by_layer, new_hidden = self._step(x_a_batch, hidden)
+        output_by_layer = [
+            layer._decode_prediction(y) for layer, y in zip(self.children(), y_by_layer)
+        ]
         return (output_by_layer, new_hidden)
 
+    def forward_sequence(self, x_a_seq, hidden):
+        """
+        Run a whole window of timesteps (e.g. a truncated BPTT window) in a single
+        call, same as calling `forward` on every timestep. The feedforward input of
+        the first layer and the decoding of the predictions are computed once for
+        all the timesteps, only the recurrent updates run step by step.
+
+        Arguments:
+            x_a_seq: (seq_len, bsz, d_in)
+            hidden: See `forward`, state before the first timestep
+
+        Returns:
+            output_by_layer: List of tensors (seq_len, bsz, dim) by layer
+            x_b_by_layer: List of tensors (seq_len, bsz, total_cells) by layer, the
+                x_b hidden state after every timestep
+            new_hidden: Hidden state after the last timestep
+        """
+        seq_len, bsz = x_a_seq.shape[:2]
+        layers = list(self.children())
+        z_in_seq = layers[0]._input_activation(x_a_seq)
+
+        y_seq = [[] for _ in layers]
+        x_b_seq = [[] for _ in layers]
+        for t in range(seq_len):
+            z_in = tuple(z[t] for z in z_in_seq)
+            y_by_layer, hidden = self._step(x_a_seq[t], hidden, z_in=z_in)
+            for lid, (y, x_b) in enumerate(zip(y_by_layer, hidden[0])):
+                y_seq[lid].append(y)
+                x_b_seq[lid].append(x_b)
+
+        output_by_layer = []
+        x_b_by_layer = []
+        for layer, ys, x_bs in zip(layers, y_seq, x_b_seq):
+            # Decode all the timesteps in a single batch
+            y = torch.stack(ys)
+            output = layer._decode_prediction(y.view(seq_len * bsz, -1))
+            output_by_layer.append(output.view(seq_len, bsz, -1))
+            x_b_by_layer.append(y if not layer.x_b_norm else torch.stack(x_bs))
+
+        return (output_by_layer, x_b_by_layer, hidden)
+
     def _post_train_epoch(self, epoch):
         for mod in self.children():
             mod._post_epoch(epoch)
@@ -355,6 +409,8 @@ class RSMLayer(torch.nn.Module):
         self.debug = debug
         self.visual_debug = visual_debug
         self.debug_log_names = debug_log_names
+        # Skip building the logged tensors dicts altogether when logging is off
+        self.log_enabled = debug or visual_debug
 
         self._build_layers_and_kwinners()
 
@@ -588,21 +644,34 @@ class RSMLayer(torch.nn.Module):
         """
         return activity.view(-1, self.m, self.n).max(dim=2).values
 
-    def _fc_weighted_ave(self, x_a, x_b, x_b_above=None):
+    def _input_activation(self, x_a):
+        """
+        Feedforward activation of the columns (and of the integrating partition)
+        from the input, which does not depend on the recurrent state. x_a may have
+        any number of leading dimensions, e.g. (seq_len, bsz, d_in).
+        """
+        if self.fpartition and self._partition_sizes()[1]:
+            return (self.linear_a(x_a), self.linear_a_int(x_a))
+        return (self.linear_a(x_a),)
+
+    def _fc_weighted_ave(self, x_a, x_b, x_b_above=None, z_in=None):
         """
         Compute sigma (weighted sum for each cell j in group i (mxn))
+
+        :param z_in: Precomputed `_input_activation` of x_a
         """
+        if z_in is None:
+            z_in = self._input_activation(x_a)
         if self.fpartition:
             m_ff, m_int, m_rec = self._partition_sizes()
-            sigma = torch.zeros_like(x_b)
             # Integrate partitioned memory.
             # Pack as 1xm: [ ... m_ff ... ][ ... m_int ... ][ ... m_rec ... ]
             # If m_int non-zero, these cells receive sum of FF & recurrent input
-            z_a = self.linear_a(x_a)  # bsz x (m_ff)
+            z_a = z_in[0]  # bsz x (m_ff)
             z_log = {"z_a": z_a}
             if m_int:
                 z_b = self.linear_b(x_b)  # bsz x m_rec
-                z_int_ff = self.linear_a_int(x_a)
+                z_int_ff = z_in[1]
                 # NOTE: Testing from only int/rec portion of mem (no ff)
                 z_int_rec = self.linear_b_int(x_b)
                 z_int = (
@@ -616,8 +685,8 @@ class RSMLayer(torch.nn.Module):
                 z_log["z_b"] = z_b
                 sigma = torch.cat((z_a, z_b), 1)  # bsz x m
         else:
-            # Col activation from inputs repeated for each cell
-            z_a = self.linear_a(x_a).repeat_interleave(self.n, 1)
+            # Col activation from inputs, broadcast to each cell (bsz x m x 1)
+            z_a = z_in[0].unsqueeze(2)
 
             sigma = z_a
             z_log = {"z_a": z_a}
@@ -628,7 +697,11 @@ class RSMLayer(torch.nn.Module):
                 if self.col_output_cells:
                     z_b_in = torch.cat((z_b_in, self._group_max(x_b)), dim=1)
                 z_b = self.linear_b(z_b_in)
-                sigma = sigma * z_b if self.mult_integration else sigma + z_b
+                z_b_cells = z_b.view(-1, self.m, self.n)
+                if self.mult_integration:
+                    sigma = sigma * z_b_cells
+                else:
+                    sigma = sigma + z_b_cells
                 z_log["z_b"] = z_b
             # Activation from recurrent (feedback) input
             if self.feedback_conn:
@@ -636,23 +709,30 @@ class RSMLayer(torch.nn.Module):
                     # Cell activation from recurrent input from layer above (apical)
                     z_b_above = self.linear_b_above(x_b_above)
                     z_log["z_b_above"] = z_b_above
+                    z_b_above = z_b_above.view(-1, self.m, self.n)
                     if self.mult_integration:
                         sigma = sigma * z_b_above
                     else:
                         sigma = sigma + z_b_above
-        self._debug_log(z_log)
+            sigma = sigma.expand(-1, self.m, self.n).reshape(-1, self.total_cells)
+        if self.log_enabled:
+            self._debug_log(z_log)
 
         return sigma  # total_cells
 
     def _update_duty_cycle(self, winners):
         """
         For tracking layer entropy (across both inhibition/boosting approaches)
+
+        :param winners: column winners mask (bsz x m x 1)
         """
         batch_size = winners.shape[0]
         self.learning_iterations += batch_size
         period = min(1000, self.learning_iterations)
         self.duty_cycle.mul_(period - batch_size)
-        self.duty_cycle.add_(winners.gt(0).sum(dim=0, dtype=torch.float))
+        # Every cell of a winning column is counted active
+        col_active = winners.gt(0).sum(dim=0, dtype=torch.float)
+        self.duty_cycle.add_(col_active.expand(self.m, self.n).reshape(-1))
         self.duty_cycle.div_(period)
 
     def _k_winners(self, sigma, pi):
@@ -665,31 +745,26 @@ class RSMLayer(torch.nn.Module):
             lambda_ = pi
 
         # Cell-level mask: Make a bsz x total_cells binary mask of top 1 cell / column
-        if self.n == self.k_winner_cells:
-            # Usually just in flattened case, no need to choose winners
-            m_pi = torch.ones(bsz, self.total_cells, device=sigma.device)
-        else:
+        # Usually just in flattened case, no need to choose winners
+        m_pi = None
+        y_pre_act = sigma
+        if self.n != self.k_winner_cells:
             mask = topk_mask(pi.view(bsz * self.m, self.n), self.k_winner_cells)
             m_pi = mask.view(bsz, self.total_cells).detach()
+            y_pre_act = m_pi * y_pre_act
 
         if self.boost_strat == "rsm_inhibition":
             # Standard RSM-style inhibition via phi matrix
 
-            self._debug_log({"lambda_": lambda_})
-
-            # Column-level mask: Make a bsz x total_cells binary mask of top k columns
-            mask = topk_mask(lambda_, self.k)
-            m_lambda = (
-                mask.view(bsz, self.m, 1)
-                .repeat(1, 1, self.n)
-                .view(bsz, self.total_cells)
-                .detach()
-            )
-            col_winners = m_lambda
+            if self.log_enabled:
+                self._debug_log({"lambda_": lambda_})
 
-            self._debug_log({"m_pi": m_pi, "m_lambda": m_lambda})
+            # Column-level mask: Make a bsz x m x 1 binary mask of top k columns,
+            # broadcast to the cells of each column
+            m_lambda = topk_mask(lambda_, self.k).view(bsz, self.m, 1).detach()
 
-            y_pre_act = m_pi * m_lambda * sigma
+            if self.log_enabled:
+                self._debug_log({"m_pi": m_pi, "m_lambda": m_lambda})
 
         elif self.boost_strat == "col_boosting":
             # HTM style boosted k-winner
@@ -707,21 +782,17 @@ class RSMLayer(torch.nn.Module):
                     winners.append(winners_rec)
                 m_lambda = (torch.cat(winners, 1).abs() > 0).float()
             else:
-                winning_cols = (
-                    self.kwinners_col(lambda_).view(bsz, self.m, 1).abs() > 0
-                ).float()
-                m_lambda = winning_cols.repeat(1, 1, self.n).view(bsz, self.total_cells)
-                col_winners = winning_cols
+                m_lambda = (self.kwinners_col(lambda_).abs() > 0).float()
+            m_lambda = m_lambda.view(bsz, self.m, 1)
 
-            self._debug_log({"m_lambda": m_lambda})
-            y_pre_act = m_pi * m_lambda * sigma
+            if self.log_enabled:
+                self._debug_log({"m_lambda": m_lambda})
 
-        self._update_duty_cycle(col_winners.squeeze())
+        y_pre_act = m_lambda * y_pre_act.view(bsz, self.m, self.n)
 
-        del m_pi
-        del m_lambda
+        self._update_duty_cycle(m_lambda)
 
-        return y_pre_act
+        return y_pre_act.view(bsz, self.total_cells)
 
     def _inhibited_winners(self, sigma, phi):
         """
@@ -730,7 +801,8 @@ class RSMLayer(torch.nn.Module):
         # Apply inhibition to non-neg shifted sigma
         inh = (1 - phi) if self.boost_strat == "rsm_inhibition" else 1
         pi = inh * (sigma - sigma.min() + 1)
-        self._debug_log({"pi": pi})
+        if self.log_enabled:
+            self._debug_log({"pi": pi})
 
         pi = pi.detach()  # Prevent gradients from flowing through inhibition/masking
 
@@ -763,40 +835,36 @@ class RSMLayer(torch.nn.Module):
         if self.decode_activation_fn:
             activation = RSMLayer.ACT_FNS[self.decode_activation_fn]
             output = activation(output)
+        if self.log_enabled:
+            self._debug_log({"y": y, "output": output})
         return output
 
-    def forward(self, x_a_batch, hidden):
+    def _step(self, x_a_batch, hidden, z_in=None):
         """
-        :param x_a_batch: Input batch of batch_size items from
-        generating process (batch_size, d_in)
-        :param hidden:
-            x_b: Memory at same layer at t-1 (possibly with decayed/hysteresis memory
-                from prior time steps)
-            x_b_above: memory state at layer above at t-1
-            phi: inhibition state (used only for boost_strat=='rsm_inhibition')
-            psi: memory state at t-1, inclusive of hysteresis
+        Update the layer state for one timestep, without decoding the prediction.
+        See `forward` for the arguments.
 
-        Note that RSMLayer takes a 4-tuple that includes the feedback state
-        from the layer above, x_c, while the RSMNet takes only 3-tuple for
-        hidden state.
+        :param z_in: Precomputed `_input_activation` of x_a_batch
+
+        :return: y (batch_size, total_cells), and the new hidden (x_b, phi, psi)
         """
         x_b, x_b_above, phi, psi = hidden
-        x_b_in = x_b.clone()
 
         phi, psi = self._do_forgetting(phi, psi)
 
-        self._debug_log({"x_b": x_b, "x_a_batch": x_a_batch})
+        if self.log_enabled:
+            self._debug_log({"x_b": x_b, "x_a_batch": x_a_batch})
 
-        sigma = self._fc_weighted_ave(x_a_batch, x_b, x_b_above=x_b_above)
-        self._debug_log({"sigma": sigma})
+        sigma = self._fc_weighted_ave(x_a_batch, x_b, x_b_above=x_b_above, z_in=z_in)
+        if self.log_enabled:
+            self._debug_log({"sigma": sigma})
 
         y = self._inhibited_winners(sigma, phi)
 
-        phi, psi = self._update_memory_and_inhibition(y, phi, psi, x_b=x_b_in)
-        self._debug_log({"phi": phi, "psi": psi})
-
-        output = self._decode_prediction(y)
-        self._debug_log({"y": y, "output": output})
+        # x_b is never modified in place, psi can share it
+        phi, psi = self._update_memory_and_inhibition(y, phi, psi, x_b=x_b)
+        if self.log_enabled:
+            self._debug_log({"phi": phi, "psi": psi})
 
         # Update recurrent input / output x_b
         if self.x_b_norm:
@@ -806,7 +874,25 @@ class RSMLayer(torch.nn.Module):
         else:
             x_b = y
 
-        hidden = (x_b, phi, psi)
+        return (y, (x_b, phi, psi))
+
+    def forward(self, x_a_batch, hidden):
+        """
+        :param x_a_batch: Input batch of batch_size items from
+        generating process (batch_size, d_in)
+        :param hidden:
+            x_b: Memory at same layer at t-1 (possibly with decayed/hysteresis memory
+                from prior time steps)
+            x_b_above: memory state at layer above at t-1
+            phi: inhibition state (used only for boost_strat=='rsm_inhibition')
+            psi: memory state at t-1, inclusive of hysteresis
+
+        Note that RSMLayer takes a 4-tuple that includes the feedback state
+        from the layer above, x_c, while the RSMNet takes only 3-tuple for
+        hidden state.
+        """
+        y, hidden = self._step(x_a_batch, hidden)
+        output = self._decode_prediction(y)
         return (output, hidden)
 
 
@@ -49,8 +49,6 @@ from util import (
     print_epoch_values,
 )
 
-torch.autograd.set_detect_anomaly(True)
-
 
 class RSMExperiment(object):
     """
@@ -75,6 +73,8 @@ class RSMExperiment(object):
         self.model_kind = config.get("model_kind", "rsm")
         self.debug = config.get("debug", False)
         self.visual_debug = config.get("visual_debug", False)
+        if self.debug:
+            torch.autograd.set_detect_anomaly(True)
 
         # Instrumentation
         self.instrumentation = config.get("instrumentation", False)
@@ -91,6 +91,10 @@ class RSMExperiment(object):
         self.batches_in_first_epoch = config.get(
             "batches_in_first_epoch", self.batches_in_epoch
         )
+        # Timesteps (batches) per truncated BPTT window. Windows of more than one
+        # timestep run through RSMNet.forward_sequence with one optimizer step
+        # per window, 1 trains on every timestep separately.
+        self.bptt = config.get("bptt", 1)
         self.eval_batches_in_epoch = config.get(
             "eval_batches_in_epoch", self.batches_in_epoch
         )
@@ -463,6 +467,34 @@ class RSMExperiment(object):
             # Decay
             self.word_cache = self.word_cache * self.word_cache_decay
 
+    def _train_batches(self):
+        """
+        Training batches (inputs, targets, pred_targets) cropped to the batch size.
+        With `bptt` > 1, consecutive batches are stacked in windows of up to `bptt`
+        timesteps, each tensor with shape (seq_len, batch_size, ...)
+        """
+        bsz = self.batch_size
+        window = []
+        for inputs, targets, pred_targets, _input_labels in self.train_loader:
+            # Inputs are of shape (batch, input_size)
+            if inputs.size(0) > bsz:
+                # Crop to smaller first epoch batch size
+                inputs = inputs[:bsz]
+                targets = targets[:bsz]
+                pred_targets = pred_targets[:bsz]
+            if self.bptt <= 1:
+                yield inputs, targets, pred_targets
+                continue
+            if window and inputs.size(0) != window[0][0].size(0):
+                yield tuple(torch.stack(t) for t in zip(*window))
+                window = []
+            window.append((inputs, targets, pred_targets))
+            if len(window) == self.bptt:
+                yield tuple(torch.stack(t) for t in zip(*window))
+                window = []
+        if window:
+            yield tuple(torch.stack(t) for t in zip(*window))
+
     def _get_prediction_and_loss_inputs(self, hidden):
         # hidden is (x_b, phi, psi)
         x_b = hidden[0]
@@ -798,21 +830,15 @@ class RSMExperiment(object):
             "total_interp_loss": 0.0,
         }
 
-        bsz = self.batch_size
-
         hidden = self.train_hidden_buffer[-1] if self.train_hidden_buffer else None
         if hidden is None:
             hidden = self._init_hidden(self.batch_size)
 
-        for batch_idx, (inputs, targets, pred_targets, _input_labels) in enumerate(
-            self.train_loader
-        ):
-            # Inputs are of shape (batch, input_size)
-            if inputs.size(0) > bsz:
-                # Crop to smaller first epoch batch size
-                inputs = inputs[:bsz]
-                targets = targets[:bsz]
-                pred_targets = pred_targets[:bsz]
+        # Index of the last timestep trained
+        batch_idx = -1
+        for inputs, targets, pred_targets in self._train_batches():
+            seq_len = inputs.size(0) if self.bptt > 1 else 1
+            batch_idx += seq_len
 
             hidden = self._repackage_hidden(hidden)
 
@@ -825,9 +851,18 @@ class RSMExperiment(object):
             targets = targets.to(self.device)
             pred_targets = pred_targets.to(self.device)
 
-            output, hidden = self.model(inputs, hidden)
-
-            x_b, pred_input = self._get_prediction_and_loss_inputs(hidden)
+            if self.bptt > 1:
+                output, x_b_seq, hidden = self.model.forward_sequence(inputs, hidden)
+                # Flatten the window timesteps into the batch dimension
+                output = [o.flatten(0, 1) for o in output]
+                targets = targets.flatten(0, 1)
+                pred_targets = pred_targets.flatten(0, 1)
+                x_b, pred_input = self._get_prediction_and_loss_inputs(
+                    ([x.flatten(0, 1) for x in x_b_seq],)
+                )
+            else:
+                output, hidden = self.model(inputs, hidden)
+                x_b, pred_input = self._get_prediction_and_loss_inputs(hidden)
 
             self.train_hidden_buffer.append(hidden)
 
@@ -835,7 +870,7 @@ class RSMExperiment(object):
             loss_targets = (targets, x_b)
             loss = self._compute_loss(output, loss_targets)
             if loss is not None:
-                total_loss += loss.item()
+                total_loss += loss.item() * seq_len
                 if not self.model_learning_paused:
                     self._backward_and_optimize(loss)
 
@@ -48,8 +48,7 @@ effect of scaling on the match probabilities.
 
 isort:skip_file
 """
-import time
-from multiprocessing import Pool
+import warnings
 
 import matplotlib
 matplotlib.use("Agg")
@@ -59,6 +58,25 @@ import torch  # noqa E402
 from matplotlib.figure import figaspect  # noqa E402
 
 
+def random_sparse_vectors(batch_shape, k, n, low, high, device="cpu"):
+    """
+    Return a batch of random vectors of dimensionality n, each with k non-zero
+    components uniform in [low, high] at random positions.
+
+    :param batch_shape: shape of the batch, the vectors have shape
+                        batch_shape + (n,)
+    """
+    vectors = torch.zeros(*batch_shape, n, device=device)
+    if k >= n:
+        return vectors.uniform_(low, high)
+
+    # The k smallest of n random keys are a uniform random subset of positions
+    indices = torch.rand(*batch_shape, n, device=device).topk(
+        k, dim=-1, largest=False, sorted=False).indices
+    values = torch.empty(*batch_shape, k, device=device).uniform_(low, high)
+    return vectors.scatter_(-1, indices, values)
+
+
 def get_sparse_tensor(num_nonzeros, input_size, output_size,
                       only_positive=False,
                       fixed_range=1.0 / 24):
@@ -66,55 +84,28 @@ def get_sparse_tensor(num_nonzeros, input_size, output_size,
     Return a random tensor that is initialized like a weight matrix
     Size is outputSize X inputSize, where weightSparsity% of each row is non-zero
     """
-    # Initialize weights in the typical fashion.
-    w = torch.Tensor(output_size, input_size, )
-
-    if only_positive:
-        w.data.uniform_(0, fixed_range)
-    else:
-        w.data.uniform_(-fixed_range, fixed_range)
+    low = 0.0 if only_positive else -fixed_range
+    return random_sparse_vectors((output_size,), num_nonzeros, input_size,
+                                 low, fixed_range)
 
-    # Zero out weights for sparse weight matrices
-    if num_nonzeros < input_size:
-        num_zeros = input_size - num_nonzeros
 
-        output_indices = np.arange(output_size)
-        input_indices = np.array([np.random.permutation(input_size)[:num_zeros]
-                                 for _ in output_indices], dtype=np.long)
-
-        # Create tensor indices for all non-zero weights
-        zero_indices = np.empty((output_size, num_zeros, 2), dtype=np.long)
-        zero_indices[:, :, 0] = output_indices[:, None]
-        zero_indices[:, :, 1] = input_indices
-        zero_indices = torch.LongTensor(zero_indices.reshape(-1, 2))
-
-        zero_weights = (zero_indices[:, 0], zero_indices[:, 1])
-        w.data[zero_weights] = 0.0
-
-    return w
-
-
-def get_permuted_tensors(w, kw, n, m2, noise_pct):
+def drop_components(values, num_copies, number_to_zero):
     """
-    Generate m2 noisy versions of W. Noisy
-    version of W is generated by randomly permuting noisePct of the non-zero
-    components to other components.
+    Generate noisy copies of a batch of vectors by setting a random subset of
+    number_to_zero of their components to zero.
 
-    :param w:
-    :param n:
-    :param m2:
-    :param noise_pct:
+    :param values: batch of vectors, shape (batch, k)
+    :param num_copies: number of noisy copies of each vector
 
-    :return:
+    :return: noisy copies, shape (batch, num_copies, k)
     """
-    w2 = w.repeat(m2, 1)
-    nz = w[0].nonzero()
-    number_to_zero = int(round(noise_pct * kw))
-    for i in range(m2):
-        indices = np.random.permutation(kw)[0:number_to_zero]
-        for j in indices:
-            w2[i, nz[j]] = 0
-    return w2
+    batch, k = values.shape
+    copies = values.unsqueeze(1).repeat(1, num_copies, 1)
+    if number_to_zero > 0:
+        indices = torch.rand(batch, num_copies, k, device=values.device).topk(
+            number_to_zero, dim=-1, largest=False, sorted=False).indices
+        copies.scatter_(-1, indices, 0.0)
+    return copies
 
 
 def plot_dot(dot, title="Histogram of dot products",
@@ -132,10 +123,8 @@ def get_theta(k, n_trials=100000):
     """
     Estimate a reasonable value of theta for this k.
     """
-    the_dots = np.zeros(n_trials)
     w1 = get_sparse_tensor(k, k, n_trials, fixed_range=1.0 / k)
-    for i in range(n_trials):
-        the_dots[i] = w1[i].dot(w1[i])
+    the_dots = (w1 * w1).sum(dim=1).numpy()
 
     dot_mean = the_dots.mean()
     print("k=", k, "min/mean/max diag of w dot products",
@@ -147,125 +136,199 @@ def get_theta(k, n_trials=100000):
     return theta, the_dots
 
 
-def return_matches(kw, kv, n, theta, input_scaling=1.0):
+def trials_per_chunk(vector_size, max_elements=2 ** 24):
+    """
+    Number of trials generated at a time, so that a chunk of trials holds at most
+    max_elements vector components
+    """
+    return max(1, max_elements // vector_size)
+
+
+def estimate_probability(sample, max_trials, chunk_size, rel_error=None,
+                         z=1.96, min_trials=10):
+    """
+    Estimate the probability of an event from chunks of random trials.
+
+    Trials are run in chunks of chunk_size until max_trials trials have run or,
+    if rel_error is given, until the half-width of the confidence interval is at
+    most rel_error times the estimate. The comparisons within a trial share
+    their vectors, so the confidence interval is computed from the variance of
+    the frequency of events across trials.
+
+    :param sample: function of a number of trials returning the number of events
+                   of each trial, and the number of comparisons per trial
+    :param max_trials: maximum number of trials
+    :param chunk_size: number of trials run at a time
+    :param rel_error: target relative half-width of the confidence interval
+    :param z: z-score of the confidence interval, 1.96 for 95%
+    :param min_trials: minimum number of trials before stopping on rel_error
+
+    :return: probability, number of events, number of comparisons, half-width of
+             the confidence interval
+    """
+    num_events = 0
+    sum_squares = 0.0
+    num_trials = 0
+    while num_trials < max_trials:
+        events, comparisons = sample(min(chunk_size, max_trials - num_trials))
+        events = events.double()
+        num_events += int(events.sum().item())
+        sum_squares += (events ** 2).sum().item()
+        num_trials += len(events)
+
+        p = num_events / float(num_trials * comparisons)
+        variance = 0.0
+        if num_trials > 1:
+            variance = (sum_squares / comparisons ** 2 - num_trials * p ** 2) / (
+                num_trials - 1)
+        half_width = z * np.sqrt(max(variance, 0.0) / num_trials)
+        if (rel_error is not None and num_trials >= min_trials
+                and num_events > 0 and half_width <= rel_error * p):
+            break
+
+    return p, num_events, num_trials * comparisons, half_width
+
+
+def return_matches(kw, kv, n, theta, input_scaling=1.0, num_trials=1):
     """
     :param kw: k for the weight vectors
     :param kv: k for the input vectors
     :param n:  dimensionality of input vector
     :param theta: threshold for matching after dot product
+    :param num_trials: number of trials, generated and matched as one batch
 
-    :return: percent that matched, number that matched, total match comparisons
+    :return: percent that matched, number that matched, total match comparisons,
+             number that matched in each trial
     """
-    # How many weight vectors and input vectors to generate at a time
+    # How many weight vectors and input vectors to generate for each trial
     m1 = 4
     m2 = 1000
 
-    weights = get_sparse_tensor(kw, n, m1, fixed_range=1.0 / kw)
+    weights = random_sparse_vectors((num_trials, m1), kw, n,
+                                    -1.0 / kw, 1.0 / kw)
 
     # Initialize random input vectors using given scaling and see how many match
-    input_vectors = get_sparse_tensor(kv, n, m2,
-                                      only_positive=True,
-                                      fixed_range=2 * input_scaling / kw,
-                                      )
-    dot = input_vectors.matmul(weights.t())
-    num_matches = ((dot >= theta).sum()).item()
-    percent_matches = num_matches / float(m1 * m2)
+    input_vectors = random_sparse_vectors((num_trials, m2), kv, n,
+                                          0.0, 2 * input_scaling / kw)
+    dot = torch.bmm(input_vectors, weights.transpose(1, 2))
+    matches = (dot >= theta).sum(dim=(1, 2))
+    num_matches = matches.sum().item()
+    total = num_trials * m1 * m2
 
-    return percent_matches, num_matches, m1 * m2
+    return num_matches / float(total), num_matches, total, matches
 
 
-def return_false_negatives(kw, noise_percent, n, theta):
+def return_false_negatives(kw, noise_percent, n, theta, num_trials=1):
     """
-    Generate a weight vector W, with kw non-zero components. Generate 1000
+    Generate a weight vector W, with kw non-zero components. Generate 10
     noisy versions of W and return the match statistics. Noisy version of W is
     generated by randomly setting noisePct of the non-zero components to zero.
 
+    Only the kw non-zero components of W contribute to the dot products, so the
+    vectors are generated over those components and n has no effect.
+
     :param kw: k for the weight vectors
     :param noise_percent: percent noise, from 0 to 1
     :param n:  dimensionality of input vector
     :param theta: threshold for matching after dot product
+    :param num_trials: number of trials, generated and matched as one batch
 
-    :return: percent that matched, number that matched, total match comparisons
+    :return: percent that matched, number that matched, total match comparisons,
+             number that matched in each trial
     """
-    w = get_sparse_tensor(kw, n, 1, fixed_range=1.0 / kw)
+    w = torch.empty(num_trials, kw).uniform_(-1.0 / kw, 1.0 / kw)
 
-    # Get permuted versions of W and see how many match
+    # Get noisy versions of W and see how many match
     m2 = 10
-    input_vectors = get_permuted_tensors(w, kw, n, m2, noise_percent)
-    dot = input_vectors.matmul(w.t())
+    input_vectors = drop_components(w, m2, int(round(noise_percent * kw)))
+    dot = torch.bmm(input_vectors, w.unsqueeze(2))
 
-    num_matches = ((dot >= theta).sum()).item()
-    percent_matches = num_matches / float(m2)
+    matches = (dot >= theta).sum(dim=(1, 2))
+    num_matches = matches.sum().item()
+    total = num_trials * m2
 
-    return percent_matches, num_matches, m2
+    return num_matches / float(total), num_matches, total, matches
 
 
 def compute_false_negatives(args):
+    """
+    Estimate the probability of false negatives given the parameters.
+
+    :param args is a dictionary containing the following keys:
+
+    kw: k for the weight vectors
+
+    n:  dimensionality of input vector
+
+    noisePct: percent of the components of the noisy copies set to zero
+
+    num_trials: maximum number of trials to run
+
+    relError: optional target relative half-width of the 95% confidence
+      interval, to stop before num_trials trials
+
+    :return: args updated with the percent of false negatives and the half-width
+      of its confidence interval
+    """
     n = args["n"]
     kw = args["kw"]
     noise_pct = args["noisePct"]
-    num_trials = args["num_trials"]
 
     theta, _ = get_theta(kw)
 
-    num_matches = 0
-    total_comparisons = 0
-    for _ in range(num_trials):
-        pct, num, total = return_false_negatives(kw, noise_pct, n, theta)
-        num_matches += num
-        total_comparisons += total
+    def sample(num_trials):
+        _, _, total, matches = return_false_negatives(kw, noise_pct, n, theta,
+                                                      num_trials)
+        comparisons = total // num_trials
+        return comparisons - matches, comparisons
 
-    pct_false_negatives = 1.0 - float(num_matches) / total_comparisons
+    pct_false_negatives, num_false_negatives, total_comparisons, error = \
+        estimate_probability(sample, args["num_trials"],
+                             trials_per_chunk(10 * kw),
+                             rel_error=args.get("relError"))
     print("kw, n, noise:", kw, n, noise_pct,
-          ", matches:", num_matches,
+          ", matches:", total_comparisons - num_false_negatives,
           ", comparisons:", total_comparisons,
-          ", pct false negatives:", pct_false_negatives)
+          ", pct false negatives:", pct_false_negatives,
+          "+/-", error)
 
     args.update({
-        "pctFalse": pct_false_negatives})
+        "pctFalse": pct_false_negatives,
+        "pctFalseError": error})
 
     return args
 
 
-def compute_false_negatives_parallel(
+def _warn_num_workers(num_workers):
+    if num_workers is not None:
+        warnings.warn("num_workers is deprecated and ignored, each point runs "
+                      "its trials in batches using torch's intra-op threads",
+                      DeprecationWarning, stacklevel=3)
+
+
+def compute_false_negative_probabilities(
     list_of_noise=None,
     kw=24,
-    num_workers=8,
     num_trials=1000,
     n=500,
+    rel_error=None,
 ):
     if list_of_noise is None:
         list_of_noise = [0.1, 0.2, 0.3, 0.4, 0.45, 0.5, 0.55, 0.6, 0.7, 0.8]
     print("Computing match probabilities for kw=", kw)
 
-    # Create arguments for the possibilities we want to test
-    args = []
+    # Create arguments for the possibilities we want to test. Each one runs its
+    # trials in batches using all the cores
+    result = []
     for ni, noise in enumerate(list_of_noise):
-        args.append({
+        result.append(compute_false_negatives({
             "kw": kw,
             "n": n,
             "noisePct": noise,
             "num_trials": num_trials,
+            "relError": rel_error,
             "errorIndex": ni,
-        })
-
-    num_experiments = len(args)
-    if num_workers > 1:
-        pool = Pool(processes=num_workers)
-        rs = pool.map_async(compute_false_negatives, args, chunksize=1)
-        while not rs.ready():
-            remaining = rs._number_left
-            pct_done = 100.0 - (100.0 * remaining) / num_experiments
-            print("    =>", remaining,
-                  "experiments remaining, percent complete=", pct_done)
-            time.sleep(5)
-        pool.close()  # No more work
-        pool.join()
-        result = rs.get()
-    else:
-        result = []
-        for arg in args:
-            result.append(compute_false_negatives(arg))
+        }))
 
     # Read out results and store in numpy array for plotting
     errors = np.zeros(len(list_of_noise))
@@ -280,8 +343,8 @@ def compute_false_negatives_parallel(
 
 def compute_match_probability(args):
     """
-    Runs a number of trials of returnMatches() and returns an overall probability
-    of matches given the parameters.
+    Estimates the probability of matches given the parameters, from trials of
+    returnMatches() run in batches.
 
     :param args is a dictionary containing the following keys:
 
@@ -293,12 +356,16 @@ def compute_match_probability(args):
 
     theta: threshold for matching after dot product
 
-    num_trials: number of trials to run
+    num_trials: maximum number of trials to run
+
+    relError: optional target relative half-width of the 95% confidence
+      interval, to stop before num_trials trials
 
     inputScaling: scale factor for the input vectors. 1.0 means the scaling
       is the same as the stored weight vectors.
 
-    :return: args updated with the percent that matched
+    :return: args updated with the percent that matched and the half-width of
+      its confidence interval
     """
     kv = args["k"]
     n = args["n"]
@@ -308,54 +375,70 @@ def compute_match_probability(args):
     if kv == -1:
         kv = int(round(n / 2.0))
 
-    num_matches = 0
-    total_comparisons = 0
-    for _ in range(args["num_trials"]):
-        pct, num, total = return_matches(kw, kv, n, theta, args["inputScaling"])
-        num_matches += num
-        total_comparisons += total
+    def sample(num_trials):
+        _, _, total, matches = return_matches(kw, kv, n, theta,
+                                              args["inputScaling"], num_trials)
+        return matches, total // num_trials
 
-    pct_matches = float(num_matches) / total_comparisons
+    pct_matches, num_matches, total_comparisons, error = estimate_probability(
+        sample, args["num_trials"], trials_per_chunk(1000 * n),
+        rel_error=args.get("relError"))
     print("kw, kv, n, s:", kw, kv, n, args["inputScaling"],
           ", matches:", num_matches,
           ", comparisons:", total_comparisons,
-          ", pct matches:", pct_matches)
+          ", pct matches:", pct_matches,
+          "+/-", error)
 
     args.update({
-        "pctMatches": pct_matches})
+        "pctMatches": pct_matches,
+        "pctMatchesError": error})
 
     return args
 
 
-def compute_match_probability_parallel(args, num_workers=8):
-    num_experiments = len(args)
-    if num_workers > 1:
-        pool = Pool(processes=num_workers)
-        rs = pool.map_async(compute_match_probability, args, chunksize=1)
-        while not rs.ready():
-            remaining = rs._number_left
-            pct_done = 100.0 - (100.0 * remaining) / num_experiments
-            print("    =>", remaining,
-                  "experiments remaining, percent complete=", pct_done)
-            time.sleep(5)
-        pool.close()  # No more work
-        pool.join()
-        result = rs.get()
-    else:
-        result = []
-        for arg in args:
-            result.append(compute_match_probability(arg))
-
-    return result
+def compute_match_probability_list(args):
+    # Each parameter point runs its trials in batches using all the cores
+    return [compute_match_probability(arg) for arg in args]
+
+
+def compute_match_probability_parallel(args, num_workers=None):
+    """
+    Deprecated alias of :func:`compute_match_probability_list`. num_workers is
+    ignored.
+    """
+    _warn_num_workers(num_workers)
+    return compute_match_probability_list(args)
+
+
+def compute_false_negatives_parallel(
+    list_of_noise=None,
+    kw=24,
+    num_workers=None,
+    num_trials=1000,
+    n=500,
+    rel_error=None,
+):
+    """
+    Deprecated alias of :func:`compute_false_negative_probabilities`.
+    num_workers is ignored.
+    """
+    _warn_num_workers(num_workers)
+    compute_false_negative_probabilities(list_of_noise, kw, num_trials, n,
+                                         rel_error)
 
 
 def compute_match_probabilities(list_of_k_values=None,
                                 list_of_n_values=None,
                                 input_scale=1.0,
                                 kw=24,
-                                num_workers=10,
+                                num_workers=None,
                                 num_trials=1000,
+                                rel_error=None,
                                 ):
+    """
+    :param num_workers: Deprecated and ignored
+    """
+    _warn_num_workers(num_workers)
     if list_of_k_values is None:
         list_of_k_values = [64, 128, 256, -1]
     if list_of_n_values is None:
@@ -373,11 +456,12 @@ def compute_match_probabilities(list_of_k_values=None,
                 "n": n,
                 "theta": theta,
                 "num_trials": num_trials,
+                "relError": rel_error,
                 "inputScaling": input_scale,
                 "errorIndex": [ki, ni],
             })
 
-    result = compute_match_probability_parallel(args, num_workers)
+    result = compute_match_probability_list(args)
 
     # Read out results and store in numpy array for plotting
     errors = np.zeros((len(list_of_k_values), len(list_of_n_values)))
@@ -395,12 +479,16 @@ def compute_scaled_probabilities(
     list_of_k_values=None,
     kw=32,
     n=1000,
-    num_workers=10,
+    num_workers=None,
     num_trials=1000,
+    rel_error=None,
 ):
     """
     Compute the impact of S on match probabilities for a fixed value of n.
+
+    :param num_workers: Deprecated and ignored
     """
+    _warn_num_workers(num_workers)
     if list_of_scales is None:
         list_of_scales = [1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0]
     if list_of_k_values is None:
@@ -416,11 +504,12 @@ def compute_scaled_probabilities(
                 "n": n,
                 "theta": theta,
                 "num_trials": num_trials,
+                "relError": rel_error,
                 "inputScaling": s,
                 "errorIndex": [ki, si],
             })
 
-    result = compute_match_probability_parallel(args, num_workers)
+    result = compute_match_probability_list(args)
 
     errors = np.zeros((len(list_of_k_values), len(list_of_scales)))
     for r in result:
@@ -629,7 +718,8 @@ def create_pregenerated_graphs():
 
 
 if __name__ == "__main__":
-    # The main graphs (takes about 12-15 mins each)
+    # The main graphs. The runtime grows with num_trials and n, pass rel_error
+    # to stop every point once its estimate is precise enough
     #
     # compute_match_probabilities(kw=32, num_trials=3000)
     # compute_scaled_probabilities(num_trials=3000)
@@ -648,6 +738,6 @@ if __name__ == "__main__":
 
     # plot_theta_distribution(32)
 
-    # compute_false_negatives_parallel(kw=32, num_trials=10000)
-    # compute_false_negatives_parallel(kw=64, num_trials=10000)
-    # compute_false_negatives_parallel(kw=128, num_trials=10000)
+    # compute_false_negative_probabilities(kw=32, num_trials=10000)
+    # compute_false_negative_probabilities(kw=64, num_trials=10000)
+    # compute_false_negative_probabilities(kw=128, num_trials=10000)
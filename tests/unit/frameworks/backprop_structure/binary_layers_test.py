@@ -0,0 +1,82 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import unittest
+
+import torch
+
+from nupic.research.frameworks.backprop_structure.modules.binary_layers import (
+    BinaryGatedConv2d,
+    BinaryGatedLinear,
+    topk_mask,
+)
+
+
+def loop_topk_mask(p1):
+    counts = p1.sum(dim=tuple(range(1, p1.dim()))).round().int()
+    mask = torch.zeros_like(p1)
+    for i in range(p1.size(0)):
+        _, indices = torch.topk(p1[i].flatten(), counts[i].item())
+        mask[i].flatten().scatter_(-1, indices, 1)
+    return mask
+
+
+class BinaryLayersTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+
+    def test_topk_mask(self):
+        p1 = torch.rand(16, 4, 3, 3).clamp(0.1, 0.9)
+        counts = p1.sum(dim=(1, 2, 3)).round()
+        self.assertTrue(torch.equal(topk_mask(p1, counts), loop_topk_mask(p1)))
+
+    def test_inference_mask(self):
+        for layer in (BinaryGatedLinear(20, 10), BinaryGatedConv2d(4, 8, 3)):
+            layer.exc_p1.data.uniform_(-0.5, 1.5)
+            layer.inh_p1.data.uniform_(-0.5, 1.5)
+            exc_p1, inh_p1 = layer.get_gate_probabilities()
+            exc_mask, inh_mask = layer.get_inference_mask()
+            self.assertTrue(torch.equal(exc_mask, loop_topk_mask(exc_p1)))
+            self.assertTrue(torch.equal(inh_mask, loop_topk_mask(inh_p1)))
+
+    def test_cached_inference_weight(self):
+        layer = BinaryGatedConv2d(4, 8, 3, optimize_inference=True)
+        layer.eval()
+        x = torch.rand(2, 4, 8, 8)
+        with torch.no_grad():
+            layer(x)
+            weight = layer.get_inference_weight()
+            self.assertIs(layer.get_inference_weight(), weight)
+
+            # Rebuilt when the gate probabilities change
+            layer.exc_p1.mul_(0.5)
+            self.assertIsNot(layer.get_inference_weight(), weight)
+            exc_mask, inh_mask = layer.get_inference_mask()
+            expected = exc_mask * layer.exc_weight - inh_mask * layer.inh_weight
+            self.assertTrue(torch.equal(layer.get_inference_weight(), expected))
+
+            weight = layer.get_inference_weight()
+            layer.train()
+            layer.eval()
+            self.assertIsNot(layer.get_inference_weight(), weight)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from nupic.research.frameworks.backprop_structure.modules.local_reparam import (
+    NoiseBuffer,
+    local_reparam_conv2d,
+    local_reparam_linear,
+)
+
+
+def reference(y_mu, y_var, noise, epsilon, clamp_gradient):
+    if clamp_gradient:
+        y_var = y_var.clamp(epsilon)
+    else:
+        y_var = y_var.clone()
+        y_var.data.clamp_(epsilon)
+    return y_mu + y_var.sqrt() * noise
+
+
+class LocalReparamTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+
+    def _check(self, fused, unfused, x, w_shape, clamp_gradient):
+        w_mu = torch.randn(w_shape, dtype=torch.double, requires_grad=True)
+        w_var = torch.rand(w_shape, dtype=torch.double)
+        w_var[0] = 0
+        w_var.requires_grad_()
+        bias = torch.randn(w_shape[0], dtype=torch.double, requires_grad=True)
+        inputs = (x, w_mu, w_var, bias)
+
+        noise_buffer = NoiseBuffer()
+        y = fused(*inputs, noise_buffer, clamp_gradient)
+        noise = noise_buffer.tensor.clone()
+        grad_output = torch.randn_like(y)
+        grads = torch.autograd.grad(y, inputs, grad_output)
+
+        # The backward pass redraws the same noise
+        self.assertTrue(torch.equal(noise_buffer.tensor, noise))
+
+        y_mu, y_var = unfused(*inputs)
+        expected_y = reference(y_mu, y_var, noise, 1e-6, clamp_gradient)
+        expected_grads = torch.autograd.grad(expected_y, inputs, grad_output)
+        self.assertTrue(torch.allclose(y, expected_y))
+        for grad, expected in zip(grads, expected_grads):
+            self.assertTrue(torch.allclose(grad, expected))
+
+    def test_conv2d(self):
+        x = torch.randn(4, 4, 9, 9, dtype=torch.double, requires_grad=True)
+        for groups in (1, 2):
+            for clamp_gradient in (False, True):
+                self._check(
+                    lambda x, w_mu, w_var, b, buffer, clamp: local_reparam_conv2d(
+                        x, w_mu, w_var, b, stride=2, padding=1, groups=groups,
+                        epsilon=1e-6, noise_buffer=buffer, clamp_gradient=clamp),
+                    lambda x, w_mu, w_var, b: (
+                        F.conv2d(x, w_mu, b, 2, 1, 1, groups),
+                        F.conv2d(x.pow(2), w_var, None, 2, 1, 1, groups)),
+                    x, (6, 4 // groups, 3, 3), clamp_gradient)
+
+    def test_linear(self):
+        x = torch.randn(3, 5, 7, dtype=torch.double, requires_grad=True)
+        for clamp_gradient in (False, True):
+            self._check(
+                lambda x, w_mu, w_var, b, buffer, clamp: local_reparam_linear(
+                    x, w_mu, w_var, b, epsilon=1e-6, noise_buffer=buffer,
+                    clamp_gradient=clamp),
+                lambda x, w_mu, w_var, b: (F.linear(x, w_mu, b),
+                                           F.linear(x.pow(2), w_var)),
+                x, (6, 7), clamp_gradient)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import unittest
+
+import torch
+from torch import nn
+
+from nupic.research.frameworks.backprop_structure.modules import (
+    BinaryGatedConv2d,
+    BinaryGatedLinear,
+    HardConcreteGatedConv2d,
+    VDropConv2d,
+    VDropLinear,
+)
+from nupic.research.frameworks.backprop_structure.modules.sparse_inference import (
+    KERNELS,
+    SparseInferenceConv2d,
+    SparseInferenceLinear,
+    export_sparse_inference,
+)
+
+
+def sparse_weight(*size, sparsity=0.9):
+    weight = torch.randn(*size)
+    weight[torch.rand(*size) < sparsity] = 0
+    # Prune whole input and output channels
+    weight[0] = 0
+    weight[:, 1] = 0
+    return weight
+
+
+class SparseInferenceTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+
+    def test_kernels(self):
+        weight = sparse_weight(8, 6, 3, 3)
+        bias = torch.randn(8)
+        x = torch.randn(4, 6, 11, 11)
+        expected = nn.functional.conv2d(x, weight, bias, 2, 1)
+        for kernel in KERNELS:
+            layer = SparseInferenceConv2d(weight, bias, stride=2, padding=1,
+                                          kernel=kernel)
+            self.assertTrue(torch.allclose(layer(x), expected, atol=1e-5))
+
+        weight = sparse_weight(10, 20)
+        x = torch.randn(3, 5, 20)
+        expected = nn.functional.linear(x, weight, bias[:1])
+        for kernel in KERNELS:
+            layer = SparseInferenceLinear(weight, bias[:1], kernel=kernel)
+            self.assertTrue(torch.allclose(layer(x), expected, atol=1e-5))
+
+    def test_export(self):
+        model = nn.Sequential(
+            VDropConv2d(3, 8, 3, padding=1),
+            nn.ReLU(),
+            HardConcreteGatedConv2d(8, 8, 3, stride=2),
+            nn.ReLU(),
+            BinaryGatedConv2d(8, 8, 3, use_baseline_bias=True,
+                              optimize_inference=True),
+            nn.Flatten(),
+            nn.Sequential(
+                VDropLinear(8 * 4 * 4, 16),
+                BinaryGatedLinear(16, 4, optimize_inference=True),
+            ),
+        )
+        with torch.no_grad():
+            model[0].w_logvar.uniform_(-10, 10)
+            model[2].loga.uniform_(-3, 3)
+            model[6][0].w_logvar.uniform_(-10, 10)
+        model.eval()
+
+        x = torch.randn(4, 3, 13, 13)
+        exported, report = export_sparse_inference(model, x,
+                                                   sparsity_threshold=0.1,
+                                                   num_repeats=2)
+
+        self.assertEqual([r["name"] for r in report],
+                         ["0", "2", "4", "6.0", "6.1"])
+        for name in ("0", "2", "4"):
+            self.assertIsInstance(exported._modules[name], SparseInferenceConv2d)
+        self.assertIsInstance(exported[6][0], SparseInferenceLinear)
+        self.assertIsInstance(model[0], VDropConv2d)
+        for r in report:
+            self.assertIn(r["kernel"], KERNELS)
+            self.assertEqual(r["saved_bytes"], r["bytes"] - r["exported_bytes"])
+            self.assertGreater(r["saved_bytes"], 0)
+
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(exported(x), model(x), atol=1e-5))
+
+    def test_export_stochastic_gates(self):
+        # The eval forward samples the gates without optimize_inference
+        model = nn.Sequential(BinaryGatedLinear(6, 4))
+        model.eval()
+        with self.assertWarns(UserWarning):
+            export_sparse_inference(model, torch.randn(3, 6), num_repeats=1)
+
+    def test_export_pruned_layer(self):
+        # Fully pruned layers are exported without the "block" kernel
+        model = nn.Sequential(VDropConv2d(3, 4, 3), nn.ReLU(), VDropConv2d(4, 2, 3))
+        with torch.no_grad():
+            model[0].w_logvar.fill_(10)
+        model.eval()
+
+        x = torch.randn(3, 3, 9, 9)
+        exported, report = export_sparse_inference(model, x, num_repeats=2)
+        self.assertEqual(report[0]["sparsity"], 1.0)
+        self.assertIn(report[0]["kernel"], ("dense", "sparse"))
+        with torch.no_grad():
+            self.assertTrue(torch.allclose(exported(x), model(x), atol=1e-5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import unittest
+
+import numpy as np
+import torch
+
+from nupic.research.frameworks.continuous_learning.correlation_metrics import (
+    ClassCorrelations,
+)
+
+
+def loop_matrices(activations):
+    num_classes = len(activations)
+    corr_mat = np.zeros((num_classes, num_classes))
+    dot_mat = np.zeros((num_classes, num_classes))
+    for i, a in enumerate(activations):
+        for j, b in enumerate(activations):
+            with np.errstate(invalid="ignore"):
+                corr = np.corrcoef(a, b)[:len(a), len(a):]
+            if i == j:
+                corr = corr[np.triu_indices(len(a), 1)]
+            corr_mat[i, j] = np.nanmean(corr)
+            dot_mat[i, j] = np.mean([np.dot(x, y) / a.shape[1]
+                                     for x in a for y in b])
+    return corr_mat, dot_mat
+
+
+class ClassCorrelationsTest(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(42)
+        torch.manual_seed(42)
+
+    def test_matrices(self):
+        activations = [torch.rand(5 + i, 3, 4).clamp(0.3) for i in range(4)]
+        # A constant row has no correlation
+        activations[1][0] = 0.3
+
+        metrics = ClassCorrelations(4)
+        # Stream the classes in two batches with mixed labels
+        x = torch.cat(activations)
+        labels = torch.cat([torch.full((len(a),), i, dtype=torch.long)
+                            for i, a in enumerate(activations)])
+        perm = torch.randperm(len(x))
+        metrics.update("layer", x[perm[:10]], labels[perm[:10]])
+        metrics.update("layer", x[perm[10:]], labels[perm[10:]])
+        corr_mat, dot_mat = metrics.matrices("layer")
+
+        expected_corr, expected_dot = loop_matrices(
+            [a.view(len(a), -1).double().numpy() for a in activations])
+        np.testing.assert_allclose(corr_mat, expected_corr, rtol=1e-6)
+        np.testing.assert_allclose(dot_mat, expected_dot, rtol=1e-6)
+
+    def test_shuffle(self):
+        metrics = ClassCorrelations(3)
+        for i in range(3):
+            metrics.update("layer", torch.rand(4, 10), i)
+        corr_mat, dot_mat = metrics.matrices("layer")
+        shuffled_corr, shuffled_dot = metrics.matrices("layer", shuffle=True)
+
+        # Permuting the units of a class doesn't change its own metrics
+        np.testing.assert_allclose(np.diag(shuffled_corr), np.diag(corr_mat))
+        np.testing.assert_allclose(np.diag(shuffled_dot), np.diag(dot_mat))
+        self.assertFalse(np.allclose(shuffled_dot, dot_mat))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -174,6 +174,29 @@ class CoactivationsTest(unittest.TestCase):
         )
         self.assertTrue(conv.coactivations.allclose(coacts, atol=0, rtol=0))
 
+    def test_chunked_matches_grouped_conv(self):
+        """
+        The memory bounded computation should match the grouped conv computation,
+        even when the budget forces a single output row and channel per chunk.
+        """
+        input_tensor = torch.relu(torch.randn(4, 3, 9, 8))
+        for coactivation_test in ["variance", "correlation", "correlation_proxy"]:
+            for budget in [1e9, 1]:
+                conv = DSConv2d(
+                    in_channels=3,
+                    out_channels=5,
+                    kernel_size=3,
+                    stride=2,
+                    padding=1,
+                    config=dict(coactivation_test=coactivation_test),
+                )
+                output_tensor = torch.relu(conv(input_tensor)).detach()
+
+                expected = conv.calc_coactivations(input_tensor, output_tensor)
+                conv.coactivation_memory_budget = budget
+                coacts = conv.calc_coactivations(input_tensor, output_tensor)
+                self.assertTrue(coacts.allclose(expected, atol=1e-4))
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -30,6 +30,7 @@ from nupic.research.frameworks.dynamic_sparse.models import (
     SparseModule,
 )
 from nupic.research.frameworks.dynamic_sparse.networks import MLPHeb
+from nupic.research.frameworks.dynamic_sparse.networks.layers import topk_mask
 
 
 def allclose_boolean(t1, t2):
@@ -267,6 +268,22 @@ class HebbianPruningTest(unittest.TestCase):
         self.zero_idxs = [i for i in self.idxs if self.weight[i] == 0]
         self.num_params = torch.sum(self.weight != 0).item()
 
+    def test_reinitialize_weights_hebbian_grow(self):
+
+        self.sparse_module.on_perc = 0.1
+        self.sparse_module.hebbian_prune = 0.25
+        self.sparse_module.weight_prune = 0.50
+        self.model.sparse_modules = [self.sparse_module]
+        self.model.hebbian_grow = True
+
+        self.model._reinitialize_weights()
+
+        # pruned connections are replaced by the same number of new ones
+        new_mask = self.sparse_module.mask.bool()
+        self.assertEqual(torch.sum(new_mask).item(), self.num_params)
+        self.assertFalse(new_mask[self.mag_hebb_intersection].item())
+        self.assertEqual(torch.sum(self.sparse_module.m.weight[~new_mask]).item(), 0)
+
     def test_partial_magnitude_and_hebbian(self):
 
         self.sparse_module.on_perc = 0.1
@@ -505,5 +522,17 @@ class HebbianPruningTest(unittest.TestCase):
         )
 
 
+class TopKMaskTest(unittest.TestCase):
+    def test_topk_mask(self):
+        tensor = torch.tensor([[0.3, 0.9, 0.1], [0.5, 0.2, 0.7]])
+        self.assertEqual(topk_mask(tensor, 2).tolist(),
+                         [[False, True, False], [False, False, False]])
+        self.assertEqual(topk_mask(tensor, 2, exclusive=False).tolist(),
+                         [[False, True, False], [False, False, True]])
+        self.assertFalse(topk_mask(tensor, 0).any())
+        self.assertFalse(topk_mask(tensor, 0, exclusive=False).any())
+        self.assertTrue(topk_mask(tensor, 6, exclusive=False).all())
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
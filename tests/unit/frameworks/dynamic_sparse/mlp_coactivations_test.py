@@ -24,7 +24,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from nupic.research.frameworks.dynamic_sparse.networks import MLPHeb
+from nupic.research.frameworks.dynamic_sparse.networks import DSLinear, MLPHeb
 from nupic.torch.modules import KWinners
 
 
@@ -218,6 +218,28 @@ class CoactivationsTest(unittest.TestCase):
         network(inp.view(1, 1, 5))
         self.assertAlmostEqual(float((network.coactivations[0] - coact2).sum()), 0.0)
 
+    def test_batched_coactivations_match_outer_products(self):
+        """Batched coactivations should equal the per-sample sum of outer products."""
+        layer = DSLinear(6, 4)
+        layer.init_coactivation_tracking()
+        x = torch.randn((32, 6))
+
+        for binary in [True, False]:
+            layer.use_binary_coactivations = binary
+            layer.reset_coactivations()
+            y = layer(x)
+
+            prev_act = (x > 0).float() if binary else x
+            curr_act = (y > 0).float() if binary else y.detach()
+            expected = torch.zeros((4, 6))
+            for s in range(x.shape[0]):
+                expected += torch.ger(curr_act[s], prev_act[s])
+
+            self.assertTrue(torch.allclose(layer.coactivations, expected, atol=1e-5))
+            self.assertTrue(
+                torch.allclose(layer.calc_coactivations(x, y), expected, atol=1e-5)
+            )
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
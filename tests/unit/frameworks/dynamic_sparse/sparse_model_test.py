@@ -73,6 +73,26 @@ class SparseModelTest(unittest.TestCase):
             "Number of params should be equal to total params * on perc",
         )
 
+    def test_initialize_sparsify_fixed_per_output(self):
+
+        network = self.network1
+
+        on_perc = 0.1
+        model = SparseModel(
+            network=network,
+            config=dict(sparse_type="precise_per_output", on_perc=on_perc),
+        )
+        model.setup()
+
+        for module in model.sparse_modules:
+            weight = module.m.weight.data
+            nonzeros_per_output = (weight != 0).view(weight.shape[0], -1).sum(dim=1)
+            expected = int(on_perc * weight[0].numel())
+            self.assertTrue(
+                (nonzeros_per_output == expected).all(),
+                "Each output should have exactly on perc of its params",
+            )
+
     def test_initialize_sparsify_stochastic(self):
         network = self.network1
 
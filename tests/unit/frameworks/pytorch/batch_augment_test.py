@@ -0,0 +1,107 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import unittest
+
+import numpy as np
+import torch
+from PIL import Image, ImageOps
+
+from nupic.research.frameworks.pytorch.imagenet.batch_augment import (
+    BatchAugment,
+    DecodeToTensor,
+    equalize,
+    posterize,
+)
+
+
+class BatchAugmentTest(unittest.TestCase):
+    def setUp(self):
+        self.images = torch.randint(256, (8, 3, 32, 32), dtype=torch.uint8)
+
+    def _unnormalize(self, batch, augment):
+        return (batch * augment.std + augment.mean) * 255
+
+    def test_identity_crop(self):
+        # Full image crop: only random flips are applied
+        augment = BatchAugment(size=32, scale=(1.0, 1.0), ratio=(1.0, 1.0), seed=42)
+        output = self._unnormalize(augment(self.images), augment).round()
+        images = self.images.float()
+        for x, y in zip(images, output):
+            self.assertTrue(torch.allclose(x, y) or torch.allclose(x.flip(-1), y))
+
+    def test_replicas(self):
+        augment = BatchAugment(size=16, auto_augment=True, replicas_per_sample=3,
+                               seed=42)
+        output = augment(self.images)
+        self.assertEqual(output.shape, (8, 3, 3, 16, 16))
+        self.assertFalse(torch.allclose(output[:, 0], output[:, 1]))
+
+    def test_same_seed_same_results(self):
+        first = BatchAugment(size=16, auto_augment=True, seed=7)(self.images)
+        second = BatchAugment(size=16, auto_augment=True, seed=7)(self.images)
+        self.assertTrue(torch.equal(first, second))
+
+    def test_original_sizes(self):
+        # Wide images are stretched to a square when decoded. Crops with the
+        # original aspect ratio cover the whole image
+        decode = DecodeToTensor(size=32)
+        pil_images = [Image.fromarray(x.permute(1, 2, 0).numpy()).resize((64, 32))
+                      for x in self.images]
+        images, sizes = zip(*[decode(image) for image in pil_images])
+        images, sizes = torch.stack(images), torch.stack(sizes)
+        self.assertEqual(images.shape, (8, 3, 32, 32))
+        self.assertEqual(sizes.tolist(), [[32, 64]] * 8)
+
+        augment = BatchAugment(size=32, scale=(1.0, 1.0), ratio=(2.0, 2.0), seed=42)
+        output = self._unnormalize(augment((images, sizes)), augment).round()
+        for x, y in zip(images.float(), output):
+            self.assertTrue(torch.allclose(x, y) or torch.allclose(x.flip(-1), y))
+
+        # A square crop of the original image only keeps its central part
+        augment = BatchAugment(size=32, scale=(0.5, 0.5), ratio=(1.0, 1.0), seed=42)
+        _, _, h, w = augment.crop_params(8, sizes[:, 0].float(), sizes[:, 1].float())
+        self.assertEqual(h.tolist(), [32.0] * 8)
+        self.assertEqual(w.tolist(), [32.0] * 8)
+
+    def test_rank_seed(self):
+        first = BatchAugment(size=16, seed=7, rank=0)(self.images)
+        second = BatchAugment(size=16, seed=7, rank=1)(self.images)
+        self.assertFalse(torch.equal(first, second))
+
+    def test_auto_augment_ops_match_pil(self):
+        magnitude = torch.full((len(self.images),), 5.0)
+        for func, pil_func in ((equalize, ImageOps.equalize),
+                               (posterize, lambda x: ImageOps.posterize(x, 5))):
+            output = func(self.images.float(), magnitude)
+            for x, y in zip(self.images, output):
+                image = Image.fromarray(x.permute(1, 2, 0).numpy())
+                expected = np.asarray(pil_func(image))
+                np.testing.assert_array_equal(y.permute(1, 2, 0).numpy(), expected)
+
+    @unittest.skipUnless(torch.cuda.is_available(), "CUDA not available")
+    def test_cpu_gpu_match(self):
+        cpu = BatchAugment(size=16, auto_augment=True, seed=3)(self.images)
+        gpu = BatchAugment(size=16, auto_augment=True, seed=3)(self.images.cuda())
+        self.assertLess((cpu - gpu.cpu()).abs().max().item(), 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,12 +18,23 @@
 #  http://numenta.org/licenses/
 #
 
+import os
+import tempfile
 import unittest
 from unittest import TestCase
 
 import torch
+from torch.utils.data import DataLoader
+from torchvision.transforms import ToTensor
 
-from nupic.research.frameworks.pytorch.dataset_utils import ProgressiveRandomResizedCrop
+from nupic.research.frameworks.pytorch.dataset_utils import (
+    BatchedHDF5DataSaver,
+    HDF5Dataset,
+    HDF5DataSaver,
+    ProgressiveRandomResizedCrop,
+    ShardedDataset,
+    convert_hdf5_to_shards,
+)
 from nupic.research.frameworks.pytorch.test_utils import FakeDataLoader
 
 
@@ -59,5 +70,103 @@ class ProgressiveRandomResizedCropTest(TestCase):
         self.assertTrue(batches == 4)
 
 
+class BatchedHDF5DataSaverTest(TestCase):
+    def test_index(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            hdf5_file = os.path.join(temp_dir, "data.hdf5")
+            with BatchedHDF5DataSaver(hdf5_file, num_workers=0,
+                                      batch_size=4) as data_saver:
+                for i in range(25):
+                    data_saver.append_tensor(torch.rand(3, 4, 4),
+                                             "img_{}.png".format(i), "train",
+                                             "class_{}".format(i % 3))
+
+            # The index is written by the saver
+            index_file = os.path.join(temp_dir, "data.__hdf5_index__")
+            self.assertTrue(os.path.exists(index_file))
+            dataset = HDF5Dataset(hdf5_file, "train", transform=ToTensor())
+            self.assertEqual(len(dataset), 25)
+
+            # Same images as the index built by scanning the HDF5 file
+            os.remove(index_file)
+            scanned = HDF5Dataset(hdf5_file, "train")
+            self.assertEqual(sorted(dataset._images), sorted(scanned._images))
+
+            image, target = dataset[0]
+            self.assertEqual(image.shape, (3, 4, 4))
+
+
+class ShardedDatasetTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.hdf5_file = os.path.join(self.temp_dir.name, "data.hdf5")
+        data_saver = HDF5DataSaver(data_path=self.hdf5_file)
+        for i in range(50):
+            # Encode the sample number in the image
+            image = torch.full((3, 4, 4), i / 255.0)
+            data_saver.append_tensor(image, "img_{}.png".format(i), "train",
+                                     "class_{}".format(i % 5))
+        convert_hdf5_to_shards(self.hdf5_file, "train", self.temp_dir.name,
+                               shard_size=400)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _expected(self, **kwargs):
+        dataset = HDF5Dataset(self.hdf5_file, "train", **kwargs)
+        classes = dataset.get_classes()
+        return sorted(
+            (int(name.split("_")[-1][:-4]), classes[os.path.dirname(name)])
+            for name in dataset._images
+        )
+
+    def _samples(self, loader):
+        samples = []
+        for images, targets in loader:
+            for image, target in zip(images, targets):
+                samples.append((round(image[0, 0, 0].item() * 255), target.item()))
+        return sorted(samples)
+
+    def test_same_samples_as_hdf5(self):
+        for kwargs in ({}, dict(num_classes=3), dict(classes=["class_4", "class_1"])):
+            dataset = ShardedDataset(self.temp_dir.name, "train", transform=ToTensor(),
+                                     shuffle_buffer_size=8, **kwargs)
+            loader = DataLoader(dataset, batch_size=4)
+            self.assertEqual(self._samples(loader), self._expected(**kwargs))
+            self.assertEqual(dataset.get_classes(),
+                             HDF5Dataset(self.hdf5_file, "train",
+                                         **kwargs).get_classes())
+
+    def test_distributed_workers(self):
+        samples = []
+        for rank in range(3):
+            dataset = ShardedDataset(self.temp_dir.name, "train", transform=ToTensor(),
+                                     batch_size=4, num_replicas=3, rank=rank)
+            dataset.set_epoch(2)
+            loader = DataLoader(dataset, batch_size=4, num_workers=2)
+            rank_samples = self._samples(loader)
+            self.assertEqual(len(rank_samples), 17)
+            self.assertEqual(len(list(loader)), len(loader))
+            samples.extend(rank_samples)
+
+        # 50 samples padded to 51 with the first sample of the epoch
+        self.assertEqual(sorted(set(samples)), self._expected())
+
+    def test_unpadded_validation(self):
+        samples = []
+        for rank in range(3):
+            dataset = ShardedDataset(self.temp_dir.name, "train", transform=ToTensor(),
+                                     batch_size=4, num_replicas=3, rank=rank,
+                                     shuffle=False, pad=False)
+            loader = DataLoader(dataset, batch_size=4, num_workers=2)
+            rank_samples = self._samples(loader)
+            self.assertIn(len(rank_samples), (16, 17))
+            self.assertEqual(len(list(loader)), len(loader))
+            samples.extend(rank_samples)
+
+        # Every sample exactly once
+        self.assertEqual(sorted(samples), self._expected())
+
+
 if __name__ == "__main__":
     unittest.main()
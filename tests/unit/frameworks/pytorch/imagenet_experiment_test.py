@@ -21,6 +21,7 @@
 import os
 import unittest
 
+import numpy as np
 import torch
 
 from nupic.research.frameworks.pytorch.imagenet import ImagenetExperiment
@@ -123,6 +124,82 @@ class ImagenetExperimentTest(unittest.TestCase):
         data_exists = os.path.exists(temp_data_path)
         self.assertFalse(data_exists)
 
+    def test_reset_experiment(self):
+
+        exp = ImagenetExperiment()
+        with TempFakeSavedData(train_size=12, num_classes=10) as data:
+
+            self.config["data"] = data.dataset_path
+            self.config["num_classes"] = data.train_num_classes
+            self.config["batch_size"] = 4
+            exp.setup_experiment(self.config)
+            model = exp.model
+            train_loader = exp.train_loader
+            exp.current_epoch = 1
+
+            # Only the optimizer changes, the data loaders are kept
+            self.config["optimizer_args"] = dict(lr=0.01)
+            exp.reset_experiment(self.config)
+            self.assertIs(exp.train_loader, train_loader)
+            self.assertIsNot(exp.model, model)
+            self.assertEqual(set(exp.get_lr()), {0.01})
+            self.assertEqual(exp.current_epoch, 0)
+
+            # The batch size changes the data loaders
+            self.config["batch_size"] = 6
+            exp.reset_experiment(self.config)
+            self.assertIsNot(exp.train_loader, train_loader)
+            self.assertEqual(len(exp.train_loader), 2)
+
+    def test_packed_state(self):
+
+        def small_cnn(num_classes):
+            return torch.nn.Sequential(
+                torch.nn.Conv2d(3, 4, 3, stride=4),
+                torch.nn.BatchNorm2d(4),
+                torch.nn.AdaptiveAvgPool2d(1),
+                torch.nn.Flatten(),
+                torch.nn.Linear(4, num_classes),
+            )
+
+        with TempFakeSavedData(train_size=8, num_classes=10) as data:
+            self.config["data"] = data.dataset_path
+            self.config["num_classes"] = data.train_num_classes
+            self.config["batch_size"] = 4
+            self.config["model_class"] = small_cnn
+            self.config["model_args"] = dict(num_classes=data.train_num_classes)
+            exp1 = ImagenetExperiment()
+            exp1.setup_experiment(self.config)
+            exp1.run_epoch()
+            exp2 = ImagenetExperiment()
+            exp2.setup_experiment(self.config)
+            exp3 = ImagenetExperiment()
+            exp3.setup_experiment(self.config)
+
+        # Restore the state decoded once, and the snapshot serialized later
+        state = ImagenetExperiment.pack_state(exp1.get_state())
+        exp2.set_state(state)
+        snapshot = exp1.get_state_snapshot()
+        exp1.model.module[0].weight.data.zero_()
+        exp3.set_state(ImagenetExperiment.serialize_state(snapshot))
+        self.assertFalse(torch.equal(snapshot["model"]["0.weight"],
+                                     exp1.model.module[0].weight))
+
+        for exp in (exp2, exp3):
+            self.assertEqual(exp.current_epoch, 1)
+            self.assertEqual(exp.lr_scheduler.last_epoch, 1)
+            for key, value in snapshot["model"].items():
+                self.assertTrue(torch.equal(exp.model.module.state_dict()[key], value))
+            self.assertEqual(exp.optimizer.state_dict()["state"].keys(),
+                             snapshot["optimizer"]["state"].keys())
+
+        # Training does not modify the shared packed state
+        packed = state.copy()
+        for param in exp2.model.parameters():
+            param.grad = torch.ones_like(param)
+        exp2.optimizer.step()
+        self.assertTrue(np.array_equal(state, packed))
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -0,0 +1,79 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import tempfile
+import unittest
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import TensorDataset
+
+from nupic.research.frameworks.pytorch.dataset_utils import IndexedDataset
+from nupic.research.frameworks.pytorch.imagenet.mixins.knowledge_distillation import (
+    TeacherCache,
+)
+
+
+class TeacherCacheTest(unittest.TestCase):
+    def test_indexed_dataset(self):
+        dataset = IndexedDataset(TensorDataset(torch.rand(4, 2),
+                                               torch.tensor([3, 2, 1, 0])))
+        self.assertEqual(len(dataset), 4)
+        self.assertEqual(dataset[1][1].tolist(), [2, 1])
+
+    def test_cache(self):
+        softmax = F.softmax(torch.randn(6, 10), dim=1)
+        indices = torch.tensor([4, 0, 2])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = TeacherCache(tmpdir, num_samples=6, num_classes=10, top_k=3)
+            cache.put(indices, softmax[indices])
+            self.assertEqual(cache.num_cached(), 3)
+            self.assertEqual(cache.is_cached(torch.arange(6)).tolist(),
+                             [True, False, True, False, True, False])
+
+            # Reopen the cache from another process
+            cache = TeacherCache(tmpdir, num_samples=6, num_classes=10, top_k=3)
+            cached = cache.get(indices, device="cpu")
+            self.assertTrue(torch.allclose(cached.sum(dim=1), torch.ones(3)))
+            expected, classes = softmax[indices].topk(3, dim=1)
+            self.assertTrue(torch.equal(cached.topk(3, dim=1)[1], classes))
+            self.assertTrue(torch.allclose(cached.topk(3, dim=1)[0], expected,
+                                           atol=1e-3))
+
+            with self.assertRaises(ValueError):
+                TeacherCache(tmpdir, num_samples=7, num_classes=10, top_k=3)
+
+    def test_cache_metadata(self):
+        metadata = dict(teacher="resnet50", classes=["a", "b"], dataset="1234")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            TeacherCache(tmpdir, num_samples=6, num_classes=2, metadata=metadata)
+            TeacherCache(tmpdir, num_samples=6, num_classes=2, metadata=metadata)
+            for key, value in (("teacher", "resnet18"), ("classes", ["b", "a"]),
+                               ("dataset", "5678")):
+                with self.assertRaises(ValueError):
+                    TeacherCache(tmpdir, num_samples=6, num_classes=2,
+                                 metadata=dict(metadata, **{key: value}))
+            with self.assertRaises(ValueError):
+                TeacherCache(tmpdir, num_samples=6, num_classes=2, top_k=1,
+                             metadata=metadata)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import unittest
+
+import torch
+
+from nupic.research.frameworks.backprop_structure.experiments import mixins
+from nupic.research.frameworks.pytorch.imagenet.mixins.log_covariance import (
+    LogCovariance,
+)
+
+
+class Experiment(object):
+    """
+    Runs the model on `data` when validating, without batches by default as on
+    the epochs that are not validated
+    """
+    def __init__(self, data=()):
+        self.data = data
+        self.distributed = False
+        self.model = torch.nn.Sequential(torch.nn.Linear(16, 4))
+        self.network = self.model
+
+    def setup_experiment(self, config):
+        pass
+
+    def validate(self):
+        for batch in self.data:
+            self.model(batch)
+        return {}
+
+    def test(self, loader):
+        return self.validate()
+
+
+class ImagenetExperiment(LogCovariance, Experiment):
+    pass
+
+
+class BackpropStructureExperiment(mixins.LogCovariance, Experiment):
+    pass
+
+
+class LogCovarianceTest(unittest.TestCase):
+    def setUp(self):
+        imagenet_experiment = ImagenetExperiment()
+        imagenet_experiment.setup_experiment(dict(log_covariance_layernames=["0"]))
+        backprop_structure_experiment = BackpropStructureExperiment(
+            log_covariance_layernames=["0"])
+        self.validate_funcs = (
+            imagenet_experiment.validate,
+            lambda: backprop_structure_experiment.test(None),
+        )
+        self.experiments = (imagenet_experiment, backprop_structure_experiment)
+
+    def test_without_samples(self):
+        for validate in self.validate_funcs:
+            self.assertEqual(validate(), {})
+
+    def test_covariance(self):
+        data = torch.randn(100, 16).split(10)
+        for experiment, validate in zip(self.experiments, self.validate_funcs):
+            experiment.data = data
+            self.assertEqual(set(validate()),
+                             {"0/covariance_sum_of_squares", "0/variance_sum"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import unittest
+
+import torch
+import torch.nn.functional as F
+
+from nupic.research.frameworks.pytorch.imagenet.mixins.maxup import (
+    MaxupPerSample,
+    MaxupStandard,
+    replica_losses,
+)
+
+
+class Experiment(object):
+    def __init__(self, config):
+        torch.manual_seed(42)
+        self.model = torch.nn.Sequential(torch.nn.Flatten(),
+                                         torch.nn.Linear(3 * 4 * 4, 5))
+        self.device = torch.device("cpu")
+        self.setup_experiment(config)
+
+    def setup_experiment(self, config):
+        pass
+
+    def loss_function(self, output, target):
+        # ComplexLoss functions do not have to accept a reduction
+        return F.cross_entropy(output, target)
+
+
+class MaxupTest(unittest.TestCase):
+    def setUp(self):
+        self.data = torch.rand(8, 6, 3, 4, 4)
+        self.target = torch.randint(0, 5, (8,))
+
+    def test_replica_losses(self):
+        model = Experiment({}).model
+        expected = torch.stack([
+            F.cross_entropy(model(self.data[:, i]), self.target, reduction="none")
+            for i in range(6)
+        ])
+        for chunk_size in (None, 1, 4):
+            losses = replica_losses(model, self.data, self.target,
+                                    chunk_size=chunk_size)
+            self.assertEqual(losses.shape, (6, 8))
+            self.assertTrue(torch.allclose(losses, expected, atol=1e-6))
+
+    def _check_batched(self, mixin):
+        experiment_class = type("MaxupExperiment", (mixin, Experiment), {})
+        expected = experiment_class({}).calculate_batch_loss(self.data, self.target)
+        for chunk_size in (None, 4):
+            experiment = experiment_class(
+                dict(maxup_batched=True, maxup_chunk_size=chunk_size))
+            loss, output = experiment.calculate_batch_loss(self.data, self.target)
+            # Same replicas selected as in the non-batched mode
+            self.assertTrue(torch.allclose(loss, expected[0], atol=1e-6))
+            self.assertTrue(torch.allclose(output, expected[1], atol=1e-6))
+            self.assertTrue(loss.requires_grad)
+
+    def test_maxup_standard_batched(self):
+        self._check_batched(MaxupStandard)
+
+    def test_maxup_per_sample_batched(self):
+        self._check_batched(MaxupPerSample)
+
+
+if __name__ == "__main__":
+    unittest.main()
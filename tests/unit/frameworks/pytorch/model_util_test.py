@@ -18,8 +18,10 @@
 #  http://numenta.org/licenses/
 #
 import io
+import tempfile
 import unittest
 
+import numpy as np
 import torch
 import torch.nn
 
@@ -27,6 +29,8 @@ from nupic.research.frameworks.pytorch.model_compare import compare_models
 from nupic.research.frameworks.pytorch.model_utils import (
     count_nonzero_params,
     deserialize_state_dict,
+    load_flat_state_dict,
+    serialize_flat_state_dict,
     serialize_state_dict,
 )
 from nupic.research.frameworks.pytorch.models.le_sparse_net import LeSparseNet
@@ -139,6 +143,56 @@ class ModelSerializationTest(unittest.TestCase):
 
         self.assertTrue(compare_models(model1, model2, (32,)))
 
+    def test_flat_serialization(self):
+        model1 = simple_linear_net()
+        model2 = simple_linear_net()
+        optimizer1 = torch.optim.SGD(model1.parameters(), lr=0.1, momentum=0.9)
+        optimizer2 = torch.optim.SGD(model2.parameters(), lr=0.5)
+        model1(torch.rand(4, 32)).sum().backward()
+        optimizer1.step()
+
+        with io.BytesIO() as buffer:
+            serialize_flat_state_dict(buffer, model1.state_dict())
+            buffer.seek(0)
+            model2.load_state_dict(deserialize_state_dict(buffer))
+
+        with io.BytesIO() as buffer:
+            serialize_flat_state_dict(buffer, optimizer1.state_dict())
+            buffer.seek(0)
+            optimizer2.load_state_dict(deserialize_state_dict(buffer))
+
+        self.assertTrue(compare_models(model1, model2, (32,)))
+        self.assertEqual(optimizer2.param_groups[0]["lr"], 0.1)
+        for param1, param2 in zip(model1.parameters(), model2.parameters()):
+            self.assertTrue(torch.equal(
+                optimizer1.state[param1]["momentum_buffer"],
+                optimizer2.state[param2]["momentum_buffer"],
+            ))
+
+    def test_flat_lazy_loading(self):
+        model = simple_linear_net()
+        with tempfile.TemporaryFile() as fileobj:
+            serialize_flat_state_dict(fileobj, model.state_dict())
+            fileobj.seek(0)
+            state_dict = load_flat_state_dict(fileobj)
+
+        self.assertEqual(list(state_dict.keys()), list(model.state_dict().keys()))
+        self.assertTrue(torch.equal(state_dict["2.bias"], model[2].bias))
+
+    def test_flat_buffer_loading(self):
+        model = simple_linear_net()
+        with io.BytesIO() as buffer:
+            serialize_flat_state_dict(buffer, dict(model=model.state_dict(),
+                                                   epoch=3))
+            array = np.frombuffer(buffer.getvalue(), dtype=np.uint8)
+        array.flags.writeable = False
+        state = load_flat_state_dict(array)
+
+        self.assertEqual(state["epoch"], 3)
+        model2 = simple_linear_net()
+        model2.load_state_dict(state["model"])
+        self.assertTrue(compare_models(model, model2, (32,)))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,65 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import unittest
+
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from nupic.research.frameworks.pytorch.prefetch_loader import PrefetchLoader
+
+
+class PrefetchLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dataset = TensorDataset(torch.arange(50.0).view(50, 1),
+                                     torch.arange(50))
+
+    def _check(self, device, num_prefetch):
+        loader = PrefetchLoader(DataLoader(self.dataset, batch_size=8),
+                                device=device, num_prefetch=num_prefetch,
+                                transform=lambda x: x * 2)
+        batches = list(loader)
+        self.assertEqual(len(batches), len(loader))
+        data = torch.cat([d for d, _ in batches]).view(-1).cpu()
+        target = torch.cat([t for _, t in batches]).cpu()
+        self.assertTrue(torch.equal(data, torch.arange(50.0) * 2))
+        self.assertTrue(torch.equal(target, torch.arange(50)))
+        self.assertEqual(batches[0][0].device.type, torch.device(device).type)
+        self.assertGreaterEqual(loader.total_wait_time, loader.wait_time)
+
+    def test_cpu(self):
+        for num_prefetch in (0, 1, 3):
+            self._check("cpu", num_prefetch)
+
+    @unittest.skipUnless(torch.cuda.is_available(), "CUDA not available")
+    def test_cuda(self):
+        for num_prefetch in (0, 1, 3):
+            self._check("cuda", num_prefetch)
+
+    def test_loader_attributes(self):
+        data_loader = DataLoader(self.dataset, batch_size=8)
+        loader = PrefetchLoader(data_loader, device="cpu")
+        self.assertIs(loader.dataset, self.dataset)
+        self.assertIs(loader.sampler, data_loader.sampler)
+        self.assertFalse(loader.pin_memory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from nupic.research.frameworks.pytorch.sampling_profiler import SamplingProfiler
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def test_chrome_trace(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        for batch_idx in range(3):
+            profiler.begin_step(f"batch {batch_idx}", batch=batch_idx)
+            busy_wait(0.02)
+            profiler.end_step()
+        profiler.stop()
+        self.assertFalse(profiler.enabled)
+
+        # Steps are not recorded once stopped
+        profiler.begin_step("ignored")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "trace.json")
+            profiler.export_chrome_trace(path)
+            with open(path) as f:
+                events = json.load(f)["traceEvents"]
+
+        steps = [e for e in events if e.get("cat") == "step"]
+        self.assertEqual([e["name"] for e in steps],
+                         ["batch 0", "batch 1", "batch 2"])
+        self.assertEqual([e["args"]["batch"] for e in steps], [0, 1, 2])
+
+        # Every sampled frame is closed and busy_wait shows up in the samples
+        samples = [e for e in events if e["tid"] == 1 and e["ph"] in "BE"]
+        self.assertEqual(sum(e["ph"] == "B" for e in samples),
+                         sum(e["ph"] == "E" for e in samples))
+        self.assertTrue(any(e.get("name", "").startswith("busy_wait")
+                            for e in samples))
+
+
+if __name__ == "__main__":
+    unittest.main()
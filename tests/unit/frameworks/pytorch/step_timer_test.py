@@ -0,0 +1,68 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import unittest
+
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from nupic.research.frameworks.pytorch.model_utils import train_model
+from nupic.research.frameworks.pytorch.step_timer import StepTimer
+
+
+class StepTimerTest(unittest.TestCase):
+    def test_summary(self):
+        timer = StepTimer()
+        for _ in range(10):
+            timer.record(8, 0.01, 0.02, 0.03, 0.04)
+        summary = timer.summary()
+        for key in StepTimer.TIME_KEYS + ("images_per_sec",):
+            self.assertEqual(summary[key]["count"], 10)
+            self.assertEqual(sum(summary[key]["histogram"]), 10)
+            self.assertEqual(summary[key]["rank_mean"], [summary[key]["mean"]])
+        self.assertAlmostEqual(summary["forward"]["mean"], 0.02)
+        self.assertAlmostEqual(summary["images_per_sec"]["mean"], 80.0)
+        self.assertAlmostEqual(summary["epoch_images_per_sec"], 80.0)
+
+        # Percentiles are the center of the histogram bin holding the value
+        p50 = summary["optimizer"]["p50"]
+        self.assertLess(abs(p50 - 0.04) / 0.04, 0.2)
+
+        timer.reset()
+        summary = timer.summary()
+        self.assertEqual(summary["data"]["count"], 0)
+        self.assertEqual(summary["epoch_images_per_sec"], 0.0)
+
+    def test_train_model(self):
+        dataset = TensorDataset(torch.rand(40, 4), torch.randint(0, 2, (40,)))
+        model = torch.nn.Linear(4, 2)
+        timer = StepTimer()
+        train_model(model=model,
+                    loader=DataLoader(dataset, batch_size=8),
+                    optimizer=torch.optim.SGD(model.parameters(), lr=0.1),
+                    device=torch.device("cpu"),
+                    step_timer=timer)
+        summary = timer.summary()
+        self.assertEqual(summary["data"]["count"], 5)
+        self.assertGreater(summary["epoch_images_per_sec"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from nupic.research.frameworks.pytorch.streaming_covariance import (
+    StreamingCovariance,
+)
+
+
+def full_covariance(x):
+    x = x - x.mean(dim=0)
+    return x.t().mm(x) / x.size(0)
+
+
+def merge_worker(rank, world_size, init_file, data, result_file):
+    dist.init_process_group("gloo", init_method="file://" + init_file,
+                            rank=rank, world_size=world_size)
+    covariance = StreamingCovariance()
+    for batch in data[rank].split(7):
+        covariance.update(batch)
+    covariance.merge_distributed()
+    if rank == 0:
+        if covariance.count == 0:
+            torch.save((0, None), result_file)
+        else:
+            torch.save((covariance.count, covariance.covariance()), result_file)
+    dist.destroy_process_group()
+
+
+class StreamingCovarianceTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(42)
+        # Large offset to check the numerical stability
+        self.data = torch.randn(100, 16, dtype=torch.float64) * 3 + 1000
+
+    def test_update(self):
+        covariance = StreamingCovariance()
+        for batch in self.data.split([1, 30, 9, 60]):
+            covariance.update(batch)
+        self.assertEqual(covariance.count, 100)
+        self.assertTrue(torch.allclose(covariance.mean, self.data.mean(dim=0)))
+        self.assertTrue(torch.allclose(covariance.covariance(),
+                                       full_covariance(self.data)))
+
+    def test_merge_distributed(self):
+        data = self.data.split([45, 55])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            init_file = os.path.join(tmpdir, "init")
+            result_file = os.path.join(tmpdir, "result.pt")
+            mp.spawn(merge_worker, args=(2, init_file, data, result_file),
+                     nprocs=2)
+            count, cov = torch.load(result_file)
+        self.assertEqual(count, 100)
+        self.assertTrue(torch.allclose(cov, full_covariance(self.data)))
+
+    def _merge(self, data):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            init_file = os.path.join(tmpdir, "init")
+            result_file = os.path.join(tmpdir, "result.pt")
+            mp.spawn(merge_worker, args=(2, init_file, data, result_file),
+                     nprocs=2)
+            return torch.load(result_file)
+
+    def test_merge_distributed_without_samples(self):
+        # A process without samples contributes zeros
+        empty = self.data[:0]
+        count, cov = self._merge((self.data, empty))
+        self.assertEqual(count, 100)
+        self.assertTrue(torch.allclose(cov, full_covariance(self.data)))
+
+        count, cov = self._merge((empty, empty))
+        self.assertEqual(count, 0)
+
+    def test_covariance_without_samples(self):
+        with self.assertRaises(ValueError):
+            StreamingCovariance().covariance()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import os
+import tempfile
+import unittest
+
+import torch
+from torch import nn
+
+from nupic.research.frameworks.pytorch.imagenet import ImagenetExperiment
+from nupic.research.frameworks.pytorch.imagenet.experiment_search import (
+    GridSearch,
+    TrialsCollection,
+)
+from nupic.research.frameworks.pytorch.imagenet.successive_halving import (
+    SuccessiveHalving,
+    run_local,
+    shared_device_seconds,
+)
+from nupic.research.frameworks.pytorch.test_utils import TempFakeSavedData
+
+
+def small_cnn(num_classes):
+    return nn.Sequential(
+        nn.Conv2d(3, 4, 3, stride=2),
+        nn.ReLU(),
+        nn.AdaptiveAvgPool2d(1),
+        nn.Flatten(),
+        nn.Linear(4, num_classes),
+    )
+
+
+class SuccessiveHalvingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_data = TempFakeSavedData(
+            train_size=8, val_size=8, image_size=(3, 16, 16), num_classes=4)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.config = dict(
+            experiment_name="halving",
+            local_dir=self.temp_dir.name,
+            experiment_class=ImagenetExperiment,
+            data=self.temp_data.dataset_path,
+            num_classes=self.temp_data.train_num_classes,
+            batch_size=4,
+            epochs=3,
+            model_class=small_cnn,
+            model_args=dict(num_classes=self.temp_data.train_num_classes),
+            optimizer_class=torch.optim.SGD,
+            optimizer_args=dict(lr=GridSearch([0.1, 0.01, 0.001, 0.0])),
+            lr_scheduler_class=torch.optim.lr_scheduler.StepLR,
+            lr_scheduler_args=dict(gamma=0.1, step_size=2),
+            log_level="WARNING",
+        )
+
+    def tearDown(self):
+        self.temp_data.cleanup()
+        self.temp_dir.cleanup()
+
+    def test_successive_halving(self):
+        trials = TrialsCollection(self.config, num_trials=1, restore=False)
+        scheduler = SuccessiveHalving(trials, min_epochs=1, reduction_factor=2,
+                                      trials_per_worker=4, executor=run_local)
+        report = scheduler.run()
+
+        # 4 trials trained for 1 epoch, 2 promoted to 2 epochs and 1 to 3 epochs
+        records = report["trials"]
+        self.assertEqual(sorted(r["epoch"] for r in records), [1, 1, 2, 3])
+        self.assertEqual([r["status"] for r in records].count("done"), 1)
+        self.assertEqual(report["best"]["epoch"], 3)
+        for r in records:
+            self.assertTrue(r["packed"])
+            self.assertEqual(r["resources"], dict(num_gpus=0, num_cpus=0.25))
+            self.assertEqual(r["history"][-1], (r["epoch"], r["result"]))
+            self.assertEqual(os.path.exists(r["checkpoint_file"]),
+                             r["status"] == "done")
+        # The trials ran one after another, each one occupying the device for
+        # its whole wall time. Only the early stopping saves device time
+        for r in records:
+            self.assertAlmostEqual(r["gpu_hours"] * 3600,
+                                   r["setup_seconds"] + r["train_seconds"],
+                                   delta=0.1)
+        self.assertLess(report["gpu_hours"], report["flat_gpu_hours"])
+        self.assertAlmostEqual(report["saved_gpu_hours"],
+                               report["flat_gpu_hours"] - report["gpu_hours"])
+        self.assertEqual(len(trials.completed), 4)
+
+        # Restore the finished search
+        scheduler = SuccessiveHalving(trials, executor=run_local)
+        self.assertEqual(scheduler.rung, 3)
+        self.assertEqual(scheduler.running(), [])
+
+    def test_distributed_trials(self):
+        self.config["distributed"] = True
+        trials = TrialsCollection(self.config, num_trials=1, restore=False)
+        with self.assertRaises(ValueError):
+            SuccessiveHalving(trials, executor=run_local)
+
+    def test_shared_device_seconds(self):
+        # Two trials sharing a worker for 2 of their 4 seconds
+        self.assertEqual(shared_device_seconds([(0, 4), (2, 6)], 0.25), [3, 3])
+        # Sharing more trials than fit on a device
+        self.assertEqual(shared_device_seconds([(0, 2), (0, 2), (0, 2)], 0.5),
+                         [4 / 3] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
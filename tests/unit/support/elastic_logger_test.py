@@ -0,0 +1,169 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from elasticsearch import Elasticsearch
+
+from nupic.research.support.elastic_logger import BulkSender
+
+
+class FakeElasticsearch(HTTPServer):
+    """
+    Local endpoint answering the elasticsearch info and bulk APIs
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeElasticsearchHandler)
+        self.docs = []
+        self.num_requests = 0
+        self.status = 200
+        self.delay = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def host(self):
+        return "127.0.0.1:{}".format(self.server_address[1])
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        self._reply(200, {})
+
+    def do_GET(self):
+        self._reply(200, {"version": {"number": "7.10.2", "build_flavor": "default"},
+                          "tagline": "You Know, for Search"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        time.sleep(self.server.delay)
+        if self.server.status != 200:
+            self._reply(self.server.status, {"error": "unavailable"})
+            return
+
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        docs = lines[1::2]
+        self.server.num_requests += 1
+        self.server.docs += docs
+        items = [{"index": {"_id": str(i), "status": 201}} for i in range(len(docs))]
+        self._reply(200, {"took": 1, "errors": False, "items": items})
+
+
+class BulkSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeElasticsearch()
+        self.client = Elasticsearch(hosts=[self.server.host])
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.spill_file = os.path.join(self.tmpdir.name, "spill.jsonl")
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmpdir.cleanup()
+
+    def test_batches(self):
+        sender = BulkSender(self.client, "test", batch_size=10, flush_interval=60)
+        for i in range(25):
+            sender.put({"value": i})
+        sender.close()
+        self.assertEqual([d["value"] for d in self.server.docs], list(range(25)))
+        self.assertEqual(self.server.num_requests, 3)
+        self.assertEqual(sender.num_sent, 25)
+
+    def test_flush_interval(self):
+        sender = BulkSender(self.client, "test", flush_interval=0.1)
+        sender.put({"value": 0})
+        time.sleep(1.0)
+        self.assertEqual(len(self.server.docs), 1)
+        sender.close()
+
+    def test_flush_then_close(self):
+        # Documents queued after a flush are sent by close, even when close is
+        # called before the background thread reaches the flush
+        self.server.delay = 0.5
+        sender = BulkSender(self.client, "test", spill_file=self.spill_file)
+        sender.put({"value": 0})
+        sender.flush()
+        time.sleep(0.1)
+        for i in range(1, 4):
+            sender.put({"value": i})
+        sender.flush()
+        for i in range(4, 6):
+            sender.put({"value": i})
+        sender.close()
+        self.assertEqual([d["value"] for d in self.server.docs], list(range(6)))
+        self.assertEqual(sender.num_sent, 6)
+        self.assertEqual(sender.num_spilled, 0)
+
+    def test_spill_and_replay(self):
+        self.server.status = 503
+        sender = BulkSender(self.client, "test", max_retries=2, backoff=0.01,
+                            spill_file=self.spill_file)
+        for i in range(5):
+            sender.put({"value": i})
+        sender.flush()
+        sender.close()
+        self.assertEqual(sender.num_spilled, 5)
+        self.assertEqual(len(self.server.docs), 0)
+
+        self.server.status = 200
+        sender = BulkSender(self.client, "test", spill_file=self.spill_file)
+        sender.close()
+        self.assertEqual([d["value"] for d in self.server.docs], list(range(5)))
+        self.assertFalse(os.path.exists(self.spill_file))
+
+    def test_put_does_not_block(self):
+        self.server.status = 503
+        sender = BulkSender(self.client, "test", max_queue_size=2, batch_size=1,
+                            backoff=10, put_timeout=0.01,
+                            spill_file=self.spill_file)
+        t0 = time.time()
+        for i in range(10):
+            sender.put({"value": i})
+        self.assertLess(time.time() - t0, 5)
+        self.assertGreater(sender.num_spilled, 0)
+        sender.close()
+        self.assertEqual(sender.num_spilled, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
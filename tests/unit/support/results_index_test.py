@@ -0,0 +1,130 @@
+#  Numenta Platform for Intelligent Computing (NuPIC)
+#  Copyright (C) 2020, Numenta, Inc.  Unless you have an agreement
+#  with Numenta, Inc., for a separate license for this software code, the
+#  following terms and conditions apply:
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero Public License version 3 as
+#  published by the Free Software Foundation.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#  See the GNU Affero Public License for more details.
+#
+#  You should have received a copy of the GNU Affero Public License
+#  along with this program.  If not, see http://www.gnu.org/licenses.
+#
+#  http://numenta.org/licenses/
+#
+
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from nupic.research.frameworks.dynamic_sparse.common import browser
+from nupic.research.support.ray_utils import load_ray_tune_experiment
+from nupic.research.support.results_index import ResultsIndex
+
+COLUMNS = ["training_iteration", "val_acc", "time_this_iter_s", "note", "done"]
+
+
+def write_rows(trial_dir, first, last):
+    progress_file = os.path.join(trial_dir, "progress.csv")
+    new_file = not os.path.exists(progress_file)
+    with open(progress_file, "a") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(COLUMNS)
+        for i in range(first, last):
+            writer.writerow([i + 1, 0.5 + i / 100, 1.5, "a, \"quoted\" note",
+                             i % 2 == 0])
+    with open(os.path.join(trial_dir, "result.json"), "a") as f:
+        for i in range(first, last):
+            f.write(json.dumps({"training_iteration": i + 1}) + "\n")
+
+
+def create_experiment(path, num_trials=4, num_rows=3):
+    checkpoints = []
+    for i in range(num_trials):
+        logdir = os.path.join("/cluster/results/exp", f"trial_{i}")
+        os.makedirs(os.path.join(path, f"trial_{i}"))
+        params = {"lr": 0.01 * (i + 1), "network": "GSC" if i % 2 else "MLP",
+                  "model": {"on_perc": [0.1, 0.2]}, "seed": i}
+        with open(os.path.join(path, f"trial_{i}", "params.json"), "w") as f:
+            json.dump(params, f)
+        write_rows(os.path.join(path, f"trial_{i}"), 0, num_rows)
+        checkpoints.append({"logdir": logdir, "experiment_tag": f"{i}_lr={i}"})
+    with open(os.path.join(path, "experiment_state-2020.json"), "w") as f:
+        json.dump({"checkpoints": checkpoints}, f)
+
+
+class ResultsIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "exp")
+        create_experiment(self.path)
+        self.index = ResultsIndex(os.path.join(self.tmpdir.name, "index.sqlite"))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def test_browser_load(self):
+        expected = browser.load(self.path)
+        df = browser.load(self.path, index=self.index)
+        pd.testing.assert_frame_equal(df, expected)
+        self.assertEqual(len(browser.agg(df, ["network"], metric="val_acc_max")), 2)
+
+        # Raw metrics add every progress column
+        expected = browser.load(self.path, ["val_acc"], ["val_acc"])
+        df = browser.load(self.path, ["val_acc"], ["val_acc"], index=self.index)
+        pd.testing.assert_frame_equal(df, expected)
+        self.assertIn("note", df.columns)
+
+    def test_incremental_update(self):
+        self.assertEqual(self.index.update(self.path), 4 * 3 * 2)
+        self.assertEqual(self.index.update(self.path), 0)
+
+        write_rows(os.path.join(self.path, "trial_1"), 3, 5)
+        self.assertEqual(self.index.update(self.path), 2 * 2)
+
+        trial_id = os.path.join(self.path, "trial_1")
+        progress = self.index.progress([trial_id])[trial_id]
+        expected = pd.read_csv(os.path.join(trial_id, "progress.csv"))
+        pd.testing.assert_frame_equal(progress, expected)
+        self.assertEqual(len(self.index.results(trial_id)), 5)
+
+    def test_where(self):
+        self.index.update(self.path)
+        trial_ids = self.index.trial_ids(self.path, where={"network": "GSC"})
+        self.assertEqual([os.path.basename(t) for t in trial_ids],
+                         ["trial_1", "trial_3"])
+        trial_ids = self.index.trial_ids(
+            where={"lr": ("<", 0.035), "model/on_perc": [0.1, 0.2],
+                   "seed": ("in", [0, 2, 3])})
+        self.assertEqual([os.path.basename(t) for t in trial_ids],
+                         ["trial_0", "trial_2"])
+
+        df = browser.load(self.path, index=self.index, where={"network": "MLP"})
+        self.assertEqual(list(df["network"]), ["MLP", "MLP"])
+
+    def test_progress_columns(self):
+        self.index.update(self.path)
+        trial_id = os.path.join(self.path, "trial_0")
+        progress = self.index.progress([trial_id], columns=["val_acc"])[trial_id]
+        self.assertEqual(list(progress.columns), ["val_acc"])
+
+    def test_ray_tune_results(self):
+        expected = load_ray_tune_experiment(self.path, load_results=True)
+        state = load_ray_tune_experiment(self.path, load_results=True,
+                                         index=self.index)
+        self.assertEqual(state, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()